@@ -177,10 +177,12 @@ class ExtendedCanvas(Canvas): # pylint: disable=too-many-ancestors
         h = self.winfo_height()
         return h
 
-    def clear(self) -> None:
-        """Empty the canvas"""
-        maxsize = 10000
-        self.create_rectangle(0, 0, maxsize, maxsize, width=0, fill=self.cget("bg"))
+    def clear(self, keep: str | None = None) -> None:
+        """Delete every item on the canvas, except any tagged keep"""
+        if keep is None:
+            self.delete("all")
+        else:
+            self.delete(*(item for item in self.find_all() if keep not in self.gettags(item)))
 
 
 class ListboxVar: # pylint: disable=too-few-public-methods
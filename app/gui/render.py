@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+from tkinter import Canvas, NW
+
+import numpy as np
+from PIL import Image, ImageTk
+
+STITCH, BLANK = 0, 255
+# smaller than this and a stitch has no room for an outline
+MIN_OUTLINED_SIZE = 4
+PATTERN_TAG = "pattern"
+# patterns kept at one pixel a stitch, so switching back and forth is cheap
+NATIVE_CACHE_SIZE = 8
+
+
+def native_image(pattern: np.ndarray) -> Image.Image:
+    """The (rows, stitches) pattern one pixel to a stitch, first row at the bottom"""
+    return Image.fromarray(np.where(pattern[::-1], STITCH, BLANK).astype(np.uint8))
+
+
+def scale_image(native: Image.Image, size: int) -> Image.Image:
+    """
+    A native image blown up to size pixels a stitch. Each stitch is
+    outlined in the opposite colour, so the grid shows over both.
+    """
+    scaled = native.resize((native.width * size, native.height * size), Image.Resampling.NEAREST)
+    if size < MIN_OUTLINED_SIZE:
+        return scaled
+    pixels = np.asarray(scaled).copy()
+    pixels[::size, :] ^= 0xFF
+    pixels[:, ::size] ^= 0xFF
+    # the corners were flipped twice
+    pixels[::size, ::size] ^= 0xFF
+    return Image.fromarray(pixels)
+
+
+def pattern_image(pattern: np.ndarray, size: int) -> Image.Image:
+    """The (rows, stitches) pattern as a greyscale image, size pixels to a stitch"""
+    return scale_image(native_image(pattern), size)
+
+
+class PatternRenderer:  # pylint: disable=too-few-public-methods
+    """
+    Draws a pattern on a canvas as a single image item, rather than a
+    rectangle per stitch, and reuses that item on every redraw. Given a
+    key naming the pattern, its image is kept at one pixel a stitch and
+    rescaled to whatever size it is drawn at, and a redraw at the size
+    already shown reuses the image on screen.
+    """
+
+    def __init__(self, canvas: Canvas) -> None:
+        self.canvas = canvas
+        # the canvas only holds a name, the image must be kept alive here
+        self.photo: ImageTk.PhotoImage | None = None
+        self.shown: tuple | None = None
+        self.natives: OrderedDict[Hashable, Image.Image] = OrderedDict()
+
+    def forget(self) -> None:
+        """Drop the kept images, when the patterns behind the keys change"""
+        self.natives.clear()
+        self.shown = None
+
+    def __native(self, pattern: np.ndarray, key: Hashable) -> Image.Image:
+        if key is None:
+            return native_image(pattern)
+        native = self.natives.get(key)
+        if native is None:
+            native = self.natives[key] = native_image(pattern)
+            if len(self.natives) > NATIVE_CACHE_SIZE:
+                self.natives.popitem(last=False)
+        else:
+            self.natives.move_to_end(key)
+        return native
+
+    def draw(  # pylint: disable=too-many-arguments
+            self, pattern: np.ndarray, x: int, y: int, size: int, key: Hashable = None
+        ) -> None:
+        if key is None or self.shown != (key, size):
+            native = self.__native(pattern, key)
+            self.photo = ImageTk.PhotoImage(scale_image(native, size))
+            self.shown = None if key is None else (key, size)
+        items = self.canvas.find_withtag(PATTERN_TAG)
+        if items:
+            self.canvas.itemconfigure(items[0], image=self.photo)
+            self.canvas.coords(items[0], x, y)
+        else:
+            self.canvas.create_image(x, y, anchor=NW, image=self.photo, tags=PATTERN_TAG)
@@ -6,19 +6,27 @@ import tkinter.filedialog
 import os
 import os.path
 from collections import namedtuple
-from PIL import Image
 
-from pddemulate.drive import PDDemulator
+from pddemulate.drive import AsyncPDDemulator
+from pddemulate.loop import EventLoopThread
 from pddemulate.listener import PDDEmulatorListener
+from pddemulate.trace import configure_logging
 from pattern.dump import PatternDumper
-from pattern.insert import PatternInserter
+from pattern.file import BrotherFile
+from pattern.export import pattern_to_image
+from pattern.insert import InserterException, PatternInserter
 
 from app.gui.gui import ExtendedCanvas, Gui
+from app.gui.render import PATTERN_TAG, PatternRenderer
 from app.tkapp.config import Config
 from app.tkapp.messages import Messages
+from app.tkapp.worker import BackgroundWorker, Job
 
 Point = namedtuple('Point', 'x y')
 
+# quiet time after the last resize event before the pattern is redrawn
+RESIZE_DELAY_MS = 80
+
 class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
     pattern_canvas: ExtendedCanvas
 
@@ -33,25 +41,36 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
         self.init_config()
 
         self.gui = Gui(self)
-        self.__update_pattern_canvas_last_size()
+        self.pattern_renderer = PatternRenderer(self.pattern_canvas)
+        self.pattern_canvas.drawn_size = None
+        self.resize_pending = None
+        # the decoded stitches of the pattern on show, and which it is:
+        # (file, place in the file's directory)
+        self.pattern_key = None
+        self.pattern_data = None
+        # the pattern being decoded on a worker, to be shown when done
+        self.decode_job = None
+        self.decode_key = None
         self.patternListBox.bind("<<ListboxSelect>>", self.pattern_selected)
-        self.after_idle(self.__canvas_configured)
+        self.pattern_canvas.bind("<Configure>", self.__canvas_configured)
         self.deviceEntry.set(self.__get_config().device)
         self.datFileEntry.entryText.set(self.__get_config().dat_file)
 
-        self.emu = PDDemulator(self.__get_config().imgdir)
+        # before the emulator, whose thread hands its events over through it
+        self.worker = BackgroundWorker(self)
+        self.emu = AsyncPDDemulator(self.__get_config().imgdir)
         self.emu.listeners.append(PDDListener(self))
+        self.emu_loop = EventLoopThread()
+        self.emu_task = None
+        self.closing = False
         self.__set_emulator_started(False)
 
-        self.pattern_dumper = PatternDumper()
-        self.pattern_dumper.print_info_callback = self.msg.show_info
-        self.pattern_inserter = PatternInserter(self.msg.show_info)
-        self.pattern_inserter.print_error_callback = self.msg.show_error
+        self.reload_job = None
         self.after_idle(self.reload_pattern_file)
 
     def emu_button_clicked(self) -> None:
         self.__get_config().device = self.deviceEntry.get()
-        if self.emu.started:
+        if self.emu_started:
             self.__stop_emulator()
         else:
             self.start_emulator()
@@ -65,10 +84,11 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
         else:
             try:
                 port = self.__get_config().device
-                self.emu.open(cport=port)
+                self.emu_loop.run(self.emu.open(cport=port))
                 self.msg.show_info("Emulation ready!")
                 self.__set_emulator_started(True)
-                self.after_idle(self.emulator_loop)
+                self.emu_task = self.emu_loop.submit(self.emu.handle_requests())
+                self.emu_task.add_done_callback(self.__emulator_finished)
             except IOError as e:
                 self.msg.show_error(
                     "Ensure that TFDI cable is connected to port "
@@ -78,28 +98,40 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
                 )
                 self.__set_emulator_started(False)
 
-    def emulator_loop(self) -> None:
-        if self.emu.started:
-            self.emu.handle_request()
-            # repeated call to after_idle() caused all window dialogs to hang
-            # out application, using after() each 10 milliseconds
-            self.after(100, self.emulator_loop)
-        else:
-            print("waiting...")
+    def __emulator_finished(self, task) -> None:
+        # called on the emulator's event loop thread
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.worker.call(self.__emulator_failed, error)
+
+    def __emulator_failed(self, error) -> None:
+        self.msg.show_error("Emulator stopped\n\nError: " + str(error))
+        self.__stop_emulator()
 
     def __stop_emulator(self) -> None:
+        if self.emu_task is not None:
+            self.emu_task.cancel()
+            self.emu_task = None
         if self.emu is not None:
-            self.emu.close()
+            self.emu_loop.call(self.emu.close)
             self.msg.show_info("PDDemulate stopped.")
             self.__set_emulator_started(False)
-        self.init_emulator()
 
-    def quit_application(self) -> None:
+    def quit_application(self, *_signal) -> None:
+        # the window, a signal, Ctrl-C and atexit can all get here, once is enough
+        if self.closing:
+            return
+        self.closing = True
         self.__stop_emulator()
+        self.emu_loop.stop()
+        self.emu.disk.close()
+        self.worker.shutdown()
         self.after_idle(self.quit)
 
     def __set_emulator_started(self, started) -> None:
-        self.emu.started = started
+        self.emu_started = started
         if started:
             self.gui.set_emu_button_started()
         else:
@@ -127,19 +159,37 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
         if not path_to_file:
             return
         self.current_dat_file = path_to_file
-        try:
-            result = self.pattern_dumper.dump_pattern([path_to_file])
-            self.patterns = result.patterns
-            list_box_model = []
-            for p in self.patterns:
-                list_box_model.append(self.__get_pattern_title(p))
-            selected_index = self.__get_selected_pattern_index()
-            self.patternListBox.items.set(list_box_model)
-            self.__set_selected_pattern_index(selected_index)
-        except IOError as e:
-            self.msg.show_error(
+        # the file may have changed under the same name, decode afresh
+        self.pattern_key = None
+        if self.decode_job is not None:
+            self.decode_job.cancel()
+        self.decode_job = self.decode_key = None
+        self.pattern_renderer.forget()
+        # only the latest reload matters, the machine may send several tracks
+        if self.reload_job is not None:
+            self.reload_job.cancel()
+        self.reload_job = self.worker.submit(
+            self.__read_patterns,
+            path_to_file,
+            on_done=self.__patterns_read,
+            on_error=lambda e: self.msg.show_error(
                 f"Could not open pattern file {path_to_file}" + "\n" + str(e)
-            )
+            ),
+        )
+
+    def __read_patterns(self, _: Job, path_to_file: str) -> list:
+        # on a worker thread
+        return PatternDumper().dump_pattern([path_to_file]).patterns
+
+    def __patterns_read(self, patterns: list) -> None:
+        self.reload_job = None
+        self.patterns = patterns
+        list_box_model = []
+        for p in self.patterns:
+            list_box_model.append(self.__get_pattern_title(p))
+        selected_index = self.__get_selected_pattern_index()
+        self.patternListBox.items.set(list_box_model)
+        self.__set_selected_pattern_index(selected_index)
 
     def __store_track(self, path_to_file=None) -> None:
         if not path_to_file:
@@ -150,37 +200,43 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
         track_path_2 = os.path.join(self.config.imgdir, track_file_2)
         track_size = 1024
 
-        start_emu = self.emu.started
+        start_emu = self.emu_started
         if start_emu:
             self.__stop_emulator()
 
+        def stored(_) -> None:
+            self.msg.show_info(
+                "Stored file to tracks "
+                + track_file_1
+                + " and "
+                + track_file_2
+                + " in "
+                + self.config.imgdir
+            )
+            if start_emu:
+                self.start_emulator()
+
+        def failed(e) -> None:
+            self.msg.show_error(str(e))
+            if start_emu:
+                self.start_emulator()
+
+        self.worker.submit(
+            self.__copy_tracks,
+            path_to_file,
+            [track_path_1, track_path_2],
+            track_size,
+            on_done=stored,
+            on_error=failed,
+        )
+
+    @staticmethod
+    def __copy_tracks(_: Job, path_to_file: str, track_paths: list[str], track_size: int) -> None:
+        # on a worker thread
         with open(path_to_file, "rb") as infile:
-            try:
-                with open(track_path_1, "wb") as track0file, open(track_path_2, "wb") as track1file:
-                    t0dat = infile.read(track_size)
-                    t1dat = infile.read(track_size)
-
-                    track0file.write(t0dat)
-                    track1file.write(t1dat)
-                    self.msg.show_info(
-                        "Stored file to tracks "
-                        + track_file_1
-                        + " and "
-                        + track_file_2
-                        + " in "
-                        + self.config.imgdir
-                    )
-            except IOError as e:
-                self.msg.show_error(str(e))
-            finally:
-                if infile:
-                    self.msg.show_debug("Closing infile...")
-                if track0file:
-                    self.msg.show_debug("Closing track0file...")
-                if track1file:
-                    self.msg.show_debug("Closing track1file...")
-                if start_emu:
-                    self.start_emulator()
+            for track_path in track_paths:
+                with open(track_path, "wb") as trackfile:
+                    trackfile.write(infile.read(track_size))
 
     def help_button_clicked(self) -> None:
         help_msg = """Commands to execute on Knitting machine:
@@ -238,31 +294,82 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
     def __display_pattern(self, pattern=None) -> None:
         if not pattern:
             pattern = self.pattern
-        self.pattern_canvas.clear()
+        entry = self.__entry_of(pattern) if pattern else None
+        if entry is None:
+            pattern = None
+        # the pattern's image item is reused by the next draw
+        self.pattern_canvas.clear(keep=PATTERN_TAG if pattern else None)
         self.patternTitle.caption.set(self.__get_pattern_title(pattern))
-        if pattern:
-            result = self.pattern_dumper.dump_pattern(
-                [self.current_dat_file, str(pattern["number"])]
-            )
-            if result.pattern:
-                self.__print_pattern_on_canvas(result.pattern)
         self.pattern = pattern
+        if pattern:
+            key = (self.current_dat_file, entry)
+            if key != self.pattern_key:
+                # drawn once the worker has decoded it
+                self.__decode_pattern(key)
+                return
+            if self.pattern_data is not None:
+                self.__print_pattern_on_canvas(self.pattern_data, key)
+        self.pattern_canvas.drawn_size = (
+            self.pattern_canvas.get_width(), self.pattern_canvas.get_height()
+        )
+
+    def __entry_of(self, pattern) -> int | None:
+        """Its place in the file's directory, or that of its number after a reload"""
+        for i, p in enumerate(self.patterns):
+            if p is pattern:
+                return i
+        for i, p in enumerate(self.patterns):
+            if p.number == pattern.number:
+                return i
+        return None
+
+    def __decode_pattern(self, key) -> None:
+        if key == self.decode_key:
+            return
+        # only the latest selection matters
+        if self.decode_job is not None:
+            self.decode_job.cancel()
+        self.decode_key = key
+        self.decode_job = self.worker.submit(
+            self.__read_entry,
+            *key,
+            on_done=lambda data: self.__pattern_decoded(key, data),
+            on_error=lambda e: self.__pattern_failed(key, e),
+        )
+
+    @staticmethod
+    def __read_entry(_: Job, path_to_file: str, entry: int):
+        # on a worker thread
+        return BrotherFile(path_to_file).get_entry_data(entry)
+
+    def __pattern_decoded(self, key, data) -> None:
+        if key != self.decode_key:
+            return
+        self.decode_job = self.decode_key = None
+        self.pattern_key, self.pattern_data = key, data
+        self.__display_pattern()
+
+    def __pattern_failed(self, key, error) -> None:
+        if key != self.decode_key:
+            return
+        self.decode_job = self.decode_key = None
+        self.msg.show_error(f"Could not read pattern from {key[0]}\n{error}")
 
     def __get_pattern_title(self, pattern) -> str:
         p = pattern
         if p:
             return (
                 "Pattern no: "
-                + str(p["number"])
+                + str(p.number)
                 + " (rows x stitches: "
-                + str(p["rows"])
+                + str(p.rows)
                 + " x "
-                + str(p["stitches"])
+                + str(p.stitches)
                 + ")"
             )
         return "No pattern"
 
-    def __print_pattern_on_canvas(self, pattern) -> None: # pylint: disable=too-many-locals
+    def __print_pattern_on_canvas(self, pattern, key) -> None: # pylint: disable=too-many-locals
         #        pattern = []
         #        for x in range(8):
         #            row = []
@@ -274,9 +381,10 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
         margin = Point(10, 10)
         bit_width = (self.pattern_canvas.get_width() - margin.x) / (pattern_width)
         bit_height = (self.pattern_canvas.get_height() - margin.y) / (pattern_height)
-        bit_width = min(bit_width, bit_height)
+        # whole pixels per stitch, so every stitch is drawn the same size
+        bit_width = max(1, int(min(bit_width, bit_height)))
         bit_height = bit_width
-        self.__print_pattern_body(pattern, margin, bit_width, bit_height)
+        self.__print_pattern_body(pattern, key, margin, bit_width, bit_height)
         sec_coord_big, sec_coord_small, sec_coord_2 = 0, margin.y / 2, margin.y
         step, big_step = 5, 10
         for i in range(0, max(pattern_width, pattern_height) + 1, step):
@@ -288,33 +396,12 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
                 y_coord = margin.x + i * bit_height
                 self.pattern_canvas.create_line(sec_coord, y_coord, sec_coord_2, y_coord)
 
-    def __print_pattern_body(
-        self, pattern, position: Point, bit_width, bit_height
+    def __print_pattern_body( # pylint: disable=too-many-arguments
+        self, pattern, key, position: Point, bit_width, bit_height
     ) -> None:
         pattern_height = len(pattern)
         pattern_width = len(pattern[0])
-        self.pattern_canvas.clear()
-        for row in range(pattern_height):
-            for stitch in range(pattern_width):
-                if (pattern[row][stitch]) == 1:
-                    fill = "black"
-                    border = "white"
-                    # border=fill
-                else:
-                    fill = "white"
-                    border = "black"
-                    # border=fill
-                row = pattern_height - row - 1
-                # stitch = patternWidth - stitch - 1
-                self.pattern_canvas.create_rectangle(
-                    position.x + stitch * bit_width,
-                    position.y + row * bit_height,
-                    position.x + (stitch + 1) * bit_width,
-                    position.y + (row + 1) * bit_height,
-                    width=1,
-                    fill=fill,
-                    outline=border,
-                )
+        self.pattern_renderer.draw(pattern, position.x, position.y, int(bit_width), key)
         # pattern border
         self.pattern_canvas.create_rectangle(
             position.x,
@@ -325,20 +412,19 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
             outline="black",
         )
 
-    def __update_pattern_canvas_last_size(self) -> None:
-        self.pattern_canvas.lastWidth = self.pattern_canvas.get_width()
-        self.pattern_canvas.lastHeight = self.pattern_canvas.get_height()
+    def __canvas_configured(self, _) -> None:
+        # a window drag sends a stream of these, redraw once it settles
+        if self.resize_pending is not None:
+            self.after_cancel(self.resize_pending)
+        self.resize_pending = self.after(RESIZE_DELAY_MS, self.__canvas_resized)
 
-    def __canvas_configured(self) -> None:
-        if (
-            self.pattern_canvas.lastWidth != self.pattern_canvas.get_width()
-            or self.pattern_canvas.lastHeight != self.pattern_canvas.get_height()
-        ):
+    def __canvas_resized(self) -> None:
+        self.resize_pending = None
+        size = (self.pattern_canvas.get_width(), self.pattern_canvas.get_height())
+        if size != self.pattern_canvas.drawn_size:
             self.msg.display_messages = False
-            self.__update_pattern_canvas_last_size()
             self.__display_pattern()
             self.msg.display_messages = True
-        self.after(100, self.__canvas_configured)
 
     def insert_bitmap_button_clicked(self) -> None:
         sel = self.patternListBox.curselection()
@@ -352,7 +438,7 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
             title="Choose bitmap file to insert...",
         )
         if len(file_path) > 0:
-            self.__insert_bitmap(file_path, pattern["number"])
+            self.__insert_bitmap(file_path, pattern.number)
 
     def export_bitmap_button_clicked(self) -> None:
         sel = self.patternListBox.curselection()
@@ -365,40 +451,55 @@ class KnittingApp(tkinter.Tk): # pylint: disable=too-many-instance-attributes
             filetypes=[("2-color Bitmap", "*.bmp")], title="Save as a bitmap file..."
         )
         if len(file_path) > 0:
-            pattern_number = pattern["number"]
+            pattern_number = pattern.number
             self.msg.show_info(
                 f"Saving pattern number {pattern_number} as bmp file {file_path}"
             )
-            result = self.pattern_dumper.dump_pattern(
-                [self.current_dat_file, str(pattern_number)]
-            )
-            pattern = result.pattern
-            pattern_height = len(pattern)
-            pattern_width = len(pattern[0])
-            img = Image.new("RGB", (pattern_width, pattern_height), None)
-            for x in range(pattern_width):
-                for y in range(pattern_height):
-                    color = (
-                        (0, 0, 0)
-                        if pattern[pattern_height - y - 1][x] == 1
-                        else (255, 255, 255)
-                    )
-                    img.putpixel((x, y), color)
-            img = img.convert("1")
-            img.save(file_path, "BMP")
-            self.msg.show_info(
-                f"Saved pattern number {pattern_number} as bmp file {file_path}"
+            self.worker.submit(
+                self.__export_bitmap,
+                self.current_dat_file,
+                pattern_number,
+                file_path,
+                on_done=lambda _: self.msg.show_info(
+                    f"Saved pattern number {pattern_number} as bmp file {file_path}"
+                ),
+                on_error=lambda e: self.msg.show_error(
+                    f"Could not save pattern number {pattern_number}\n\nError: {e}"
+                ),
+                on_progress=self.msg.show_info,
             )
 
+    def __export_bitmap(self, job: Job, dat_file, pattern_number, file_path) -> None:
+        # on a worker thread
+        result = PatternDumper().dump_pattern([dat_file, str(pattern_number)])
+        job.check()
+        job.report(f"Saving pattern number {pattern_number} as bmp file {file_path}")
+        pattern_to_image(result.pattern).save(file_path, "BMP")
+
     def __insert_bitmap(self, bitmap_file, pattern_number):
         self.msg.show_info(
             f"Inserting dat file {bitmap_file} to pattern number {pattern_number}"
         )
         old_brother_file = self.current_dat_file
-        self.pattern_inserter.insert_pattern(
-            old_brother_file, pattern_number, bitmap_file, old_brother_file
+        self.worker.submit(
+            self.__insert,
+            old_brother_file,
+            pattern_number,
+            bitmap_file,
+            on_done=lambda _: self.reload_pattern_file(),
+            on_error=lambda e: self.msg.show_error(
+                f"Could not insert {bitmap_file} to pattern number {pattern_number}\n\n" +
+                (e.get_message() if isinstance(e, InserterException) else str(e))
+            ),
+            on_progress=self.msg.show_info,
+        )
+
+    @staticmethod
+    def __insert(job: Job, brother_file, pattern_number, bitmap_file) -> None:
+        # on a worker thread, the inserter's messages go back through the job
+        PatternInserter(job.report).insert_pattern(
+            brother_file, pattern_number, bitmap_file, brother_file
         )
-        self.reload_pattern_file()
 
 
 class PDDListener(PDDEmulatorListener): # pylint: disable=too-few-public-methods
@@ -407,9 +508,11 @@ class PDDListener(PDDEmulatorListener): # pylint: disable=too-few-public-methods
         self.app = inner_app
 
     def data_received(self, full_file_path) -> None:
-        self.app.reload_pattern_file(full_file_path)
+        # called on the emulator's event loop thread
+        self.app.worker.call(self.app.reload_pattern_file, full_file_path)
 
 
 if __name__ == "__main__":
+    configure_logging()
     app = KnittingApp()
     app.mainloop()
@@ -0,0 +1,111 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+# how often the Tk loop collects results from the workers
+POLL_MS = 50
+
+
+class Cancelled(Exception):
+    """Raised inside a job by Job.check() once it has been cancelled"""
+
+
+class Job:
+    """
+    One piece of work on the pool. The work function gets its Job as the
+    first argument, to report progress and to notice cancellation.
+    """
+
+    def __init__(
+        self,
+        results: queue.SimpleQueue,
+        on_done: Callable[[Any], None] | None,
+        on_error: Callable[[BaseException], None] | None,
+        on_progress: Callable[[Any], None] | None,
+    ) -> None:
+        self.results = results
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.future: Future | None = None
+        self.__cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Stop the job if it hasn't started, its callbacks will not be called"""
+        self.__cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self) -> None:
+        """For long jobs to call now and then, gives up once cancelled"""
+        if self.cancelled:
+            raise Cancelled()
+
+    def report(self, progress) -> None:
+        """Pass progress (a message, a fraction...) to on_progress on the Tk thread"""
+        if self.on_progress is not None and not self.cancelled:
+            self.results.put((self.on_progress, progress))
+
+    def _finished(self, future: Future) -> None:
+        # called on the worker thread
+        if self.cancelled or future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            if self.on_done is not None:
+                self.results.put((self.on_done, future.result()))
+        elif not isinstance(error, Cancelled) and self.on_error is not None:
+            self.results.put((self.on_error, error))
+
+
+class BackgroundWorker:
+    """
+    A thread pool for the app's slow file work. Results, errors and
+    progress come back through a queue the Tk loop drains every POLL_MS,
+    so callbacks always run on the Tk thread and may touch widgets.
+    """
+
+    def __init__(self, root, max_workers: int = 2) -> None:
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="knitting-app")
+        self.results: queue.SimpleQueue = queue.SimpleQueue()
+        self.root.after(POLL_MS, self.__drain)
+
+    def submit(  # pylint: disable=too-many-arguments
+        self,
+        fn: Callable[..., Any],
+        *args,
+        on_done: Callable[[Any], None] | None = None,
+        on_error: Callable[[BaseException], None] | None = None,
+        on_progress: Callable[[Any], None] | None = None,
+    ) -> Job:
+        """Run fn(job, *args) on the pool"""
+        job = Job(self.results, on_done, on_error, on_progress)
+        job.future = self.executor.submit(fn, job, *args)
+        job.future.add_done_callback(job._finished)  # pylint: disable=protected-access
+        return job
+
+    def call(self, fn: Callable[..., Any], *args) -> None:
+        """
+        Run fn(*args) on the Tk thread. Safe from any thread, unlike
+        Tk's own after_idle, which must only be called from the Tk thread.
+        """
+        self.results.put((lambda _: fn(*args), None))
+
+    def __drain(self) -> None:
+        try:
+            while True:
+                callback, value = self.results.get_nowait()
+                callback(value)
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(POLL_MS, self.__drain)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
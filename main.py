@@ -6,8 +6,10 @@ import atexit
 import signal
 
 from app.tkapp.knitting_app import KnittingApp
+from pddemulate.trace import configure_logging
 
 if __name__ == "__main__":
+    configure_logging()
     app = KnittingApp()
     atexit.register(app.quit_application)
     signal.signal(signal.SIGTERM, app.quit_application)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+"""
+A searchable catalog of every pattern in a tree of track files.
+
+Walks a directory for .dat files (the file-N.dat tracks written by the
+emulator), parses each one with BrotherFile in a process pool and keeps
+what it found in an SQLite database: pattern number, stitches, rows, a
+hash of the decoded stitches, a similarity signature (see
+pattern.similarity), the file it came from and its place in the file's
+directory, as a file can hold a number twice. Files whose mtime and
+size are unchanged since the last scan are not parsed again.
+
+    python -m pattern.catalog catalog.db index dumps/
+    python -m pattern.catalog catalog.db find [--number 901]
+        [--stitches 60] [--rows 50] [--hash abc123...]
+    python -m pattern.catalog catalog.db dupes
+    python -m pattern.catalog catalog.db similar dumps/file-1.dat 901 [-k 8]
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pattern.file import BrotherFile
+from pattern.similarity import (
+    BANDS,
+    MAX_BAND_RADIUS,
+    band_neighbours,
+    bands,
+    distance,
+    signature,
+)
+
+VERSION = "1.0"
+
+# bump whenever the tables change, older catalogs are rebuilt from scratch
+SCHEMA_VERSION = 4
+
+BAND_COLUMNS = [f"band{i}" for i in range(BANDS)]
+
+SCHEMA = """
+CREATE TABLE files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    error TEXT
+);
+CREATE TABLE patterns (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    entry INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    stitches INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    """ + "".join(f"{column} INTEGER NOT NULL,\n    " for column in BAND_COLUMNS) + """
+    PRIMARY KEY (path, entry)
+);
+CREATE INDEX patterns_number ON patterns(number);
+CREATE INDEX patterns_size ON patterns(stitches, rows);
+CREATE INDEX patterns_hash ON patterns(hash);
+""" + "".join(f"CREATE INDEX patterns_{column} ON patterns({column});\n" for column in BAND_COLUMNS)
+
+# what a CatalogEntry is made from, see entry_of
+ENTRY_COLUMNS = "path, number, stitches, rows, hash, entry"
+
+# SQLite allows this many ? in one statement since 3.32, keep well below
+MAX_PARAMS = 500
+
+TRACK_SUFFIX = ".dat"
+
+# files handed to each worker at a time, small files so batch them up
+CHUNK_SIZE = 16
+
+
+def pattern_hash(stitches: np.ndarray) -> str:
+    """
+    Hash of a decoded (rows, stitches) pattern. Only the stitches and the
+    shape go in, so the same motif saved anywhere hashes the same.
+    """
+    digest = hashlib.sha1(b"%dx%d:" % stitches.shape)
+    digest.update(np.packbits(stitches, axis=1).tobytes())
+    return digest.hexdigest()
+
+
+class CatalogEntry:  # pylint: disable=too-few-public-methods
+    """A cataloged pattern, entry is its place in the file's directory"""
+    __slots__ = ("path", "entry", "number", "stitches", "rows", "hash")
+    path: str
+    entry: int
+    number: int
+    stitches: int
+    rows: int
+    hash: str
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            path: str,
+            number: int,
+            stitches: int,
+            rows: int,
+            hash: str,  # pylint: disable=redefined-builtin
+            *,
+            entry: int = 0,
+        ) -> None:
+        self.path = path
+        self.entry = entry
+        self.number = number
+        self.stitches = stitches
+        self.rows = rows
+        self.hash = hash
+
+    def __repr__(self) -> str:
+        return (
+            f"CatalogEntry({self.path!r}, entry={self.entry}, number={self.number}, " +
+            f"stitches={self.stitches}, rows={self.rows}, hash={self.hash!r})"
+        )
+
+
+def entry_of(row) -> CatalogEntry:
+    """A CatalogEntry from the ENTRY_COLUMNS of a row"""
+    *fields, entry = row
+    return CatalogEntry(*fields, entry=entry)
+
+
+class IndexReport:  # pylint: disable=too-few-public-methods
+    def __init__(self) -> None:
+        self.seen = 0
+        self.parsed = 0
+        self.removed = 0
+        self.patterns = 0
+        self.errors: list[tuple[str, str]] = []
+
+
+def scan_file(
+        path: str
+    ) -> tuple[str, list[tuple[int, int, int, int, str, bytes]], str | None]:
+    """
+    Parse one track file, run in the worker processes.
+    Returns (path, [(entry, number, stitches, rows, hash, signature)], error)
+    """
+    try:
+        bf = BrotherFile(path)
+        found = []
+        for entry, pattern in enumerate(bf.get_patterns()):
+            stitches = bf.get_entry_data(entry)
+            found.append((
+                entry,
+                pattern.number,
+                pattern.stitches,
+                pattern.rows,
+                pattern_hash(stitches),
+                signature(stitches),
+            ))
+        return path, found, None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # junk in an archive shouldn't stop the scan, it is noted and skipped
+        return path, [], repr(e)
+
+
+def track_files(root: str):
+    """Every .dat file under root, as absolute paths"""
+    for dirpath, _, filenames in os.walk(os.path.abspath(root)):
+        for name in filenames:
+            if name.endswith(TRACK_SUFFIX):
+                yield os.path.join(dirpath, name)
+
+
+class Catalog:
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.__create()
+
+    def __create(self) -> None:
+        with self.db:
+            self.db.execute("DROP TABLE IF EXISTS patterns")
+            self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        self.db.close()
+
+    def index(self, root: str, workers: int | None = None) -> IndexReport:
+        """
+        Bring the catalog up to date with the files under root. Only new
+        or changed files are parsed, files that have gone are dropped.
+        """
+        report = IndexReport()
+        root = os.path.abspath(root)
+        prefix = os.path.join(root, "")
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.db.execute("SELECT path, mtime_ns, size FROM files")
+            if path.startswith(prefix)
+        }
+        stats: dict[str, tuple[int, int]] = {}
+        for path in track_files(root):
+            st = os.stat(path)
+            stats[path] = (st.st_mtime_ns, st.st_size)
+        report.seen = len(stats)
+        changed = [path for path, stat in stats.items() if known.get(path) != stat]
+        gone = [(path,) for path in known if path not in stats]
+
+        with self.db:
+            self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+            report.removed = len(gone)
+            if changed:
+                with ProcessPoolExecutor(workers) as pool:
+                    for path, found, error in pool.map(scan_file, changed, chunksize=CHUNK_SIZE):
+                        self.__store(path, stats[path], found, error)
+                        report.parsed += 1
+                        report.patterns += len(found)
+                        if error is not None:
+                            report.errors.append((path, error))
+        return report
+
+    def __store(self, path: str, stat: tuple[int, int], found: list, error: str | None) -> None:
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.db.execute(
+            "INSERT INTO files (path, mtime_ns, size, error) VALUES (?, ?, ?, ?)",
+            (path, *stat, error),
+        )
+        columns = ", ".join(
+            ["path", "entry", "number", "stitches", "rows", "hash", "signature"] + BAND_COLUMNS
+        )
+        self.db.executemany(
+            f"INSERT INTO patterns ({columns}) VALUES ({', '.join('?' * (7 + BANDS))})",
+            [(path, *entry, *bands(entry[-1])) for entry in found],
+        )
+
+    def find(
+            self,
+            *,
+            number: int | None = None,
+            stitches: int | None = None,
+            rows: int | None = None,
+            hash: str | None = None,  # pylint: disable=redefined-builtin
+        ) -> list[CatalogEntry]:
+        """Every cataloged pattern matching all the given fields"""
+        clauses, params = [], []
+        for column, value in (
+            ("number", number), ("stitches", stitches), ("rows", rows), ("hash", hash)
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = f"SELECT {ENTRY_COLUMNS} FROM patterns"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY path, entry"
+        return [entry_of(row) for row in self.db.execute(sql, params)]
+
+    def duplicates(self) -> list[list[CatalogEntry]]:
+        """Every pattern stored more than once, grouped by content hash"""
+        groups: dict[str, list[CatalogEntry]] = {}
+        for row in self.db.execute(
+            f"SELECT {ENTRY_COLUMNS} FROM patterns WHERE hash IN " +
+            "(SELECT hash FROM patterns GROUP BY hash HAVING COUNT(*) > 1) " +
+            "ORDER BY hash, path, entry"
+        ):
+            entry = entry_of(row)
+            groups.setdefault(entry.hash, []).append(entry)
+        return list(groups.values())
+
+    def signature_of(self, path: str, number: int) -> bytes | None:
+        """Of the first entry with that number in the file"""
+        row = self.db.execute(
+            "SELECT signature FROM patterns WHERE path = ? AND number = ? ORDER BY entry LIMIT 1",
+            (os.path.abspath(path), number),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def similar(self, sig: bytes, k: int) -> list[tuple[int, CatalogEntry]]:
+        """
+        (distance, entry) for every pattern whose signature is within k
+        bits of sig, closest first. Candidates come from the band indexes,
+        see pattern.similarity, only they are compared in full.
+        """
+        found = []
+        for *row, other in self.__candidates(sig, k // BANDS):
+            bits = distance(sig, other)
+            if bits <= k:
+                found.append((bits, entry_of(row)))
+        found.sort(key=lambda match: (match[0], match[1].path, match[1].entry))
+        return found
+
+    def __candidates(self, sig: bytes, radius: int) -> list[tuple]:
+        """Rows with some band within radius bits of the same band of sig"""
+        select = f"SELECT {ENTRY_COLUMNS}, signature FROM patterns"
+        if radius > MAX_BAND_RADIUS:
+            return self.db.execute(select).fetchall()
+        seen = {}
+        for column, value in zip(BAND_COLUMNS, bands(sig)):
+            values = band_neighbours(value, radius)
+            for i in range(0, len(values), MAX_PARAMS):
+                chunk = values[i:i + MAX_PARAMS]
+                for row in self.db.execute(
+                    f"{select} WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+                ):
+                    seen[row[0], row[5]] = row
+        return list(seen.values())
+
+    def count(self) -> tuple[int, int]:
+        """(files, patterns) in the catalog"""
+        files = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        patterns = self.db.execute("SELECT COUNT(*) FROM patterns").fetchone()[0]
+        return files, patterns
+
+
+def format_entry(entry: CatalogEntry) -> str:
+    return (
+        f"  {entry.number}       {entry.stitches:4d}   {entry.rows:4d}   " +
+        f"{entry.hash[:8]}   {entry.path}"
+    )
+
+
+def print_entries(entries: list[CatalogEntry]) -> None:
+    print("Pattern   Stitches   Rows   Hash       File")
+    for entry in entries:
+        print(format_entry(entry))
+
+
+def main() -> None:  # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description="Catalog the patterns in a tree of track files")
+    parser.add_argument("catalog", help="SQLite file, created if missing")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="scan a directory for new and changed files")
+    index.add_argument("root")
+    index.add_argument("--workers", type=int, help="parser processes, default one per CPU")
+    find = commands.add_parser("find", help="list matching patterns")
+    find.add_argument("--number", type=int)
+    find.add_argument("--stitches", type=int)
+    find.add_argument("--rows", type=int)
+    find.add_argument("--hash")
+    commands.add_parser("dupes", help="list patterns stored more than once")
+    similar = commands.add_parser("similar", help="list patterns that look like this one")
+    similar.add_argument("path", help="a cataloged track file")
+    similar.add_argument("number", type=int)
+    similar.add_argument("-k", type=int, default=8, help="most differing signature bits")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    try:
+        match args.command:
+            case "index":
+                report = catalog.index(args.root, args.workers)
+                for path, error in report.errors:
+                    print(f"Could not read {path}: {error}")
+                files, patterns = catalog.count()
+                print(
+                    f"{report.seen} files, {report.parsed} parsed, {report.removed} removed, " +
+                    f"{report.patterns} patterns found; catalog has {patterns} patterns " +
+                    f"in {files} files"
+                )
+            case "find":
+                entries = catalog.find(
+                    number=args.number, stitches=args.stitches, rows=args.rows, hash=args.hash
+                )
+                print_entries(entries)
+                if not entries:
+                    sys.exit(1)
+            case "dupes":
+                for group in catalog.duplicates():
+                    print(f"{len(group)} copies of {group[0].hash[:8]}")
+                    print_entries(group)
+            case "similar":
+                sig = catalog.signature_of(args.path, args.number)
+                if sig is None:
+                    print(f"Pattern {args.number} in {args.path} is not in the catalog")
+                    sys.exit(1)
+                matches = catalog.similar(sig, args.k)
+                print("Bits   Pattern   Stitches   Rows   Hash       File")
+                for bits, entry in matches:
+                    print(f"{bits:4d}   " + format_entry(entry))
+    finally:
+        catalog.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
+import struct
 import sys
+from typing import BinaryIO, TextIO
+
+import numpy as np
+
 from pattern.file import BrotherFile
 
 # import convenience functions from brother module
@@ -10,9 +15,27 @@ DEBUG = True
 
 VERSION = '1.0'
 
+TEXT = 'text'
+JSONL = '--jsonl'
+BINARY = '--binary'
+
+# glyphs for each bit of a byte, least significant first
+BYTE_GLYPHS = [''.join('* ' if b & (1<<j) else '  ' for j in range(8)) for b in range(256)]
+NIBBLE_GLYPHS = BYTE_GLYPHS[:16]
+# indexed by stitch
+STITCH_GLYPHS = np.frombuffer(b' *', dtype=np.uint8)
+BIT_GLYPHS = np.frombuffer(b'01', dtype=np.uint8)
+BINARY_HEADER = struct.Struct('>3H')
+# rows of output built and written at a time
+CHUNK_ROWS = 256
+
 class PatternDumper: # pylint: disable=too-few-public-methods
     """Extractor for patterns"""
 
+    def __init__(self, out: TextIO | None = None):
+        # where progress and the debug dump go
+        self.out = sys.stdout if out is None else out
+
     def dump_pattern(self,argv: list[str]):
         """Extract patterns from file"""
         if len(argv) < 1:
@@ -31,66 +54,48 @@ class PatternDumper: # pylint: disable=too-few-public-methods
             if DEBUG:
                 self.__pattern_print(bf)
         else:
-            print(f'Searching for pattern number {patt}')
+            self.out.write(f'Searching for pattern number {patt}\n')
             pats = bf.get_pattern(patt)
             if pats is None:
                 raise PatternNotFoundException(patt)
             stitches = pats.stitches
             rows = pats.rows
-            print(f'{stitches} Stitches, {rows} Rows')
+            self.out.write(f'{stitches} Stitches, {rows} Rows\n')
+            result.number = patt
             result.pattern = bf.get_pattern_data(patt)
+        result.file = bf
         return result
 
-    def __pattern_print(self, bf: BrotherFile): # pylint: disable=too-many-locals,too-many-branches,too-many-statements
-        print("-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+")
-        print("Data file")
-        print("-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+")
+    def __pattern_print(self, bf: BrotherFile): # pylint: disable=too-many-locals
+        out = self.out
+        out.write("-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+\n")
+        out.write("Data file\n")
+        out.write("-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+\n")
 
-        # first dump the 99 'pattern id' blocks
+        # first dump the 99 'pattern id' blocks, each block is 7 bytes
         for i in range(99):
-            print(f"program entry {i}")
-            # each block is 7 bytes
             bytenum = i*7
-
-            pattused = bf.get_indexed_byte(bytenum)
-            print("\t",hex(bytenum),": ",hex(pattused), end=' ')
-            if pattused == 1:
-                print("\t(used)")
-            else:
-                print("\t(unused)")
-                #print "\t-skipped-"
-                #continue
-            bytenum += 1
-
-            unk1 = bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(unk1)},\t(unknown)")
-            bytenum += 1
-
-            rows100 =  bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(rows100)}\t" +
-                  f"(rows = {(rows100 >> 4)*100} + {(rows100 & 0xF)*10}")
-            bytenum += 1
-
-            rows1 =  bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(rows1)}\t" +
-                  f"\t+ {(rows1 >> 4)} stiches = {(rows1 & 0xF)*100}+")
-            bytenum += 1
-
-            stitches10 =  bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(stitches10)}\t" +
-                  f"\t+ {(stitches10 >> 4)*10} + {(stitches10 & 0xF)})")
-            bytenum += 1
-
-            prog100 = bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(prog100)}\t(unknown , prog# = {(prog100&0xF) * 100}+")
-            bytenum += 1
-
-            prog10 = bf.get_indexed_byte(bytenum)
-            print(f"\t{hex(bytenum)}: {hex(prog10)}\t\t + {(prog10>>4) * 10} + {(prog10&0xF)})")
-            bytenum += 1
-
-        print("============================================")
-        print("Program memory grows -up-")
+            (pattused, unk1, rows100, rows1,
+             stitches10, prog100, prog10) = bf.data[bytenum:bytenum + 7]
+            used = "used" if pattused == 1 else "unused"
+            out.write(
+                f"program entry {i}\n"
+                f"\t {hex(bytenum)} :  {hex(pattused)} \t({used})\n"
+                f"\t{hex(bytenum + 1)}: {hex(unk1)},\t(unknown)\n"
+                f"\t{hex(bytenum + 2)}: {hex(rows100)}\t"
+                f"(rows = {(rows100 >> 4)*100} + {(rows100 & 0xF)*10}\n"
+                f"\t{hex(bytenum + 3)}: {hex(rows1)}\t"
+                f"\t+ {(rows1 >> 4)} stiches = {(rows1 & 0xF)*100}+\n"
+                f"\t{hex(bytenum + 4)}: {hex(stitches10)}\t"
+                f"\t+ {(stitches10 >> 4)*10} + {(stitches10 & 0xF)})\n"
+                f"\t{hex(bytenum + 5)}: {hex(prog100)}\t"
+                f"(unknown , prog# = {(prog100&0xF) * 100}+\n"
+                f"\t{hex(bytenum + 6)}: {hex(prog10)}\t\t"
+                f" + {(prog10>>4) * 10} + {(prog10&0xF)})\n"
+            )
+
+        out.write("============================================\n")
+        out.write("Program memory grows -up-\n")
         # now we're onto data data
 
         # dump the first program
@@ -102,7 +107,7 @@ class PatternDumper: # pylint: disable=too-few-public-methods
                 # :(
                 break
             # otherwise its a valid pattern
-            print("pattern bank #", i)
+            out.write(f"pattern bank # {i}\n")
             # calc pattern size
             rows100 =  bf.get_indexed_byte(i*7 + 2)
             rows1 =  bf.get_indexed_byte(i*7 + 3)
@@ -110,43 +115,72 @@ class PatternDumper: # pylint: disable=too-few-public-methods
 
             rows = (rows100 >> 4)*100 + (rows100 & 0xF)*10 + (rows1 >> 4)
             stitches = (rows1 & 0xF)*100 + (stitches10 >> 4)*10 + (stitches10 & 0xF)
-            print("rows = ", rows, "stitches = ", stitches)
-#        print "total nibs per row = ", nibblesPerRow(stitches)
-
+            out.write(f"rows =  {rows} stitches =  {stitches}\n")
 
             # dump the memo data
-            print("memo length =",bytes_for_memo(rows))
-            for i in range (bytes_for_memo(rows)):
-                b = pointer - i
-                print("\t",hex(b),": ",hex(bf.get_indexed_byte(b)))
+            out.write(f"memo length = {bytes_for_memo(rows)}\n")
+            out.writelines(
+                f"\t {hex(b)} :  {hex(bf.data[b])}\n"
+                for b in range(pointer, pointer - bytes_for_memo(rows), -1)
+            )
             pointer -= bytes_for_memo(rows)
 
-            print("pattern length = ", bytes_per_pattern(stitches, rows))
-            for i in range (bytes_per_pattern(stitches, rows)):
-                b = pointer - i
-                print("\t",hex(b),": ",hex(bf.get_indexed_byte(b)), end=' ')
-                for j in range(8):
-                    if bf.get_indexed_byte(b) & (1<<j):
-                        print("*", end=' ')
-                    else:
-                        print(" ", end=' ')
-                print("")
-
-            # print it out in nibbles per row?
+            out.write(f"pattern length =  {bytes_per_pattern(stitches, rows)}\n")
+            out.writelines(
+                f"\t {hex(b)} :  {hex(bf.data[b])} {BYTE_GLYPHS[bf.data[b]]}\n"
+                for b in range(pointer, pointer - bytes_per_pattern(stitches, rows), -1)
+            )
+
+            # print it out in nibbles per row
+            per_row = nibbles_per_row(stitches)
             for row in range(rows):
-                for nibs in range(nibbles_per_row(stitches)):
-                    n = bf.get_indexed_nibble(pointer, nibbles_per_row(stitches)*row + nibs)
-                    print(hex(n), end=' ')
-                    for j in range(8):
-                        if n & (1<<j):
-                            print("*", end=' ')
-                        else:
-                            print(" ", end=' ')
-                print("")
+                nibs = (
+                    bf.get_indexed_nibble(pointer, per_row*row + nib) for nib in range(per_row)
+                )
+                out.write("".join(f"{hex(n)} {NIBBLE_GLYPHS[n]}" for n in nibs) + "\n")
             pointer -=  bytes_per_pattern(stitches, rows)
-
-        #for i in range (0x06DF, 99*7, -1):
-        #    print "\t",hex(i),": ",hex(bf.getIndexedByte(i))
+        out.flush()
+
+
+def write_text(_: int, pattern: np.ndarray, out: BinaryIO) -> None:
+    """
+    The stitches as '* ' and blanks, one line per row. All the rows are
+    laid out in one byte array and written in chunks.
+    """
+    rows, stitches = pattern.shape
+    text = np.full((rows, 2*stitches + 1), ord(" "), dtype=np.uint8)
+    text[:, 0:-1:2] = STITCH_GLYPHS[pattern]
+    text[:, -1] = ord("\n")
+    for first in range(0, rows, CHUNK_ROWS):
+        out.write(text[first:first + CHUNK_ROWS].tobytes())
+
+
+def write_jsonl(number: int, pattern: np.ndarray, out: BinaryIO) -> None:
+    """One JSON object per row: {"pattern": 901, "row": 0, "stitches": "0110..."}"""
+    for first in range(0, len(pattern), CHUNK_ROWS):
+        chunk = BIT_GLYPHS[pattern[first:first + CHUNK_ROWS]]
+        out.write(b"".join(
+            b'{"pattern": %d, "row": %d, "stitches": "%s"}\n' % (number, first + i, row.tobytes())
+            for i, row in enumerate(chunk)
+        ))
+
+
+def write_binary(number: int, pattern: np.ndarray, out: BinaryIO) -> None:
+    """
+    A header of big-endian pattern number, stitches and rows (three
+    unsigned shorts), then each row packed first stitch in the most
+    significant bit and padded to a whole byte.
+    """
+    rows, stitches = pattern.shape
+    out.write(BINARY_HEADER.pack(number, stitches, rows))
+    out.write(np.packbits(pattern, axis=1).tobytes())
+
+
+WRITERS = {
+    TEXT: write_text,
+    JSONL: write_jsonl,
+    BINARY: write_binary,
+}
 
 
 class ArgumentsException(Exception):
@@ -157,30 +191,48 @@ class PatternNotFoundException(Exception):
         self.pattern_number = pattern_number
 
 class Result: # pylint: disable=too-few-public-methods
-    patterns = None # list of pat["number"], pat["stitches"], pat["rows"]
-    pattern = None # pattern object: array of [rows][stitches]
+    patterns = None # list of PatternMetadata
+    pattern = None # numpy array of [rows][stitches]
+    number = None # of the one pattern
+    file = None # the BrotherFile it came from
 
 def main():
+    args = sys.argv[1:]
+    mode = TEXT
+    for flag in (JSONL, BINARY):
+        if flag in args:
+            args.remove(flag)
+            mode = flag
+    out = sys.stdout.buffer
     try:
-        #print sys.argv
-        dumper = PatternDumper()
-        out = dumper.dump_pattern(sys.argv[1:])
-        if out.patterns is not None:
-            print('Pattern   Stitches   Rows')
-            for pat in out.patterns:
-                print(f'  {pat["number"]}       {pat["stitches"]}      {pat["rows"]}')
-        elif out.pattern is not None:
-            for row, _ in enumerate(out.pattern):
-                for stitch, _ in enumerate(out.pattern[row]):
-                    if(out.pattern[row][stitch]) == 0:
-                        print(' ', end=' ')
-                    else:
-                        print('*', end=' ')
-                print()
+        # keep the output stream clean for machine readable modes
+        dumper = PatternDumper(sys.stdout if mode == TEXT else sys.stderr)
+        result = dumper.dump_pattern(args)
+        if result.pattern is not None:
+            patterns = [(result.number, result.pattern)]
+        elif mode == TEXT:
+            sys.stdout.write('Pattern   Stitches   Rows\n' + ''.join(
+                f'  {pat.number}       {pat.stitches}      {pat.rows}\n'
+                for pat in result.patterns
+            ))
+            patterns = []
+        else:
+            # by directory index, a number can be stored more than once
+            patterns = [
+                (pat.number, result.file.get_entry_data(index))
+                for index, pat in enumerate(result.patterns)
+            ]
+        sys.stdout.flush()
+        writer = WRITERS[mode]
+        for number, pattern in patterns:
+            writer(number, pattern, out)
+        out.flush()
 
     except ArgumentsException:
-        print(f'Usage: {sys.argv[0]} file [patternnum]')
+        print(f'Usage: {sys.argv[0]} file [patternnum] [--jsonl | --binary]')
         print('Dumps user programs (901-999) from brother data files')
+        print('--jsonl writes a JSON object per row, --binary packed rows')
+        print('after a header of pattern number, stitches and rows')
         sys.exit(1)
     except IOError as e:
         print(e)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Save patterns as 1-bit images, stitches black and the first row at the
+bottom, the way insert.py expects to read them back.
+
+    python -m pattern.export [--format png] [--workers N] source... outdir
+
+Each source is a .dat file or a directory searched for them. Every
+pattern in each file is written to outdir as <file>-<pattern>.<format>,
+or <file>-<pattern>-<entry>.<format> (its place in the file's directory)
+for a number the file holds more than once, keeping the directory
+layout below a source directory. Files are
+exported in parallel, one process per CPU.
+"""
+
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from pattern.catalog import track_files
+from pattern.file import BrotherFile
+
+VERSION = "1.0"
+
+FORMATS = {"bmp": "BMP", "png": "PNG"}
+
+
+def pattern_to_image(pattern: np.ndarray) -> Image.Image:
+    """
+    A (rows, stitches) pattern as a mode "1" image. Mode "1" rows are
+    packed most significant bit first with set bits white, so the rows
+    are flipped, inverted and packed in one go.
+    """
+    rows, stitches = pattern.shape
+    packed = np.packbits(pattern[::-1] == 0, axis=1)
+    return Image.frombytes("1", (stitches, rows), packed.tobytes())
+
+
+def export_file(dat_file: str, outdir: str, image_format: str = "png") -> list[str]:
+    """Write every pattern in dat_file to outdir, returns the image paths"""
+    bf = BrotherFile(dat_file)
+    stem = os.path.splitext(os.path.basename(dat_file))[0]
+    os.makedirs(outdir, exist_ok=True)
+    written = []
+    patterns = bf.get_patterns()
+    numbers = Counter(pattern.number for pattern in patterns)
+    for entry, pattern in enumerate(patterns):
+        name = f"{stem}-{pattern.number}"
+        if numbers[pattern.number] > 1:
+            name += f"-{entry}"
+        path = os.path.join(outdir, f"{name}.{image_format}")
+        pattern_to_image(bf.get_entry_data(entry)).save(path, FORMATS[image_format])
+        written.append(path)
+    return written
+
+
+def _export_job(job: tuple[str, str, str]) -> tuple[str, list[str], str | None]:
+    dat_file, outdir, image_format = job
+    try:
+        return dat_file, export_file(dat_file, outdir, image_format), None
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return dat_file, [], repr(e)
+
+
+def export_all(
+        sources: list[str],
+        outdir: str,
+        image_format: str = "png",
+        workers: int | None = None,
+    ):
+    """
+    Export every .dat file named in sources or found under source
+    directories, in parallel. Yields (dat file, image paths, error) as
+    each file finishes.
+    """
+    jobs = []
+    for source in sources:
+        if os.path.isdir(source):
+            for dat_file in track_files(source):
+                relative = os.path.relpath(os.path.dirname(dat_file), os.path.abspath(source))
+                jobs.append((dat_file, os.path.normpath(os.path.join(outdir, relative)),
+                             image_format))
+        else:
+            jobs.append((source, outdir, image_format))
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(_export_job, jobs, chunksize=8)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export patterns as 1-bit images")
+    parser.add_argument("sources", nargs="+", help=".dat files or directories of them")
+    parser.add_argument("outdir")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="png")
+    parser.add_argument("--workers", type=int, help="processes, default one per CPU")
+    args = parser.parse_args()
+
+    files = images = failed = 0
+    for dat_file, written, error in export_all(args.sources, args.outdir, args.format,
+                                               args.workers):
+        files += 1
+        images += len(written)
+        if error is not None:
+            failed += 1
+            print(f"Could not export {dat_file}: {error}")
+    print(f"Exported {images} patterns from {files} files to {args.outdir}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
-import array  # type: ignore
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+import struct
+
+import numpy as np
+
 from pattern.maths import (
+    BCD,
+    HIGH_NIBBLE,
+    LOW_NIBBLE,
     nibbles,
     bytes_for_memo,
     bytes_per_pattern_and_memo,
-    hto,
 )
 from pattern.pattern import PatternMetadata
 
@@ -18,6 +26,13 @@ NEXT_ROW_ADDR = 0x072F
 CURRENT_ROW_NUMBER_ADDR = 0x0702
 CARRIAGE_STATUS_ADDR = 0x070F
 SELECT_ADDR = 0x07EA
+DIRECTORY_SIZE = 99 * 7  # seven bytes for each of patterns 901-999
+# memo pointer (flag and unknown byte), then rows, stitches and pattern
+# number as three digit BCD packed into the remaining five bytes
+DIRECTORY_ENTRY = struct.Struct(">H5B")
+
+# how many decoded patterns a BrotherFile keeps around
+DECODED_CACHE_SIZE = 32
 
 
 # various unknowns which are probably something we care about
@@ -44,17 +59,54 @@ unknownList = {
 }
 
 
+class EditBatch:  # pylint: disable=too-few-public-methods
+    """
+    Writes collected by BrotherFile.edit(). Each write is checked as it
+    is made, and nothing reaches the file's data until the batch commits.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.writes: list[tuple[int, bytes]] = []
+
+    def __setitem__(self, key: int | slice, value) -> None:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            value = bytes(value)
+            if step != 1 or stop - start != len(value):
+                raise ValueError(
+                    f"Write of {len(value)} bytes does not fit [{start}:{stop}:{step}]"
+                )
+        else:
+            start = key + self.size if key < 0 else key
+            if not 0 <= start < self.size:
+                raise IndexError(f"Write to {hex(key)} is outside the file")
+            if not 0 <= value <= 0xFF:
+                raise ValueError(f"{value} is not a byte")
+            value = bytes([value])
+        self.writes.append((start, value))
+
+
 class BrotherFile:  # pylint: disable=too-many-public-methods
     """Reading a brother "file" representing a floppy disk track"""
 
     def __init__(self, fn):
         self.dfn: str
-        self.data: bytes
+        self.data: bytearray
         self.verbose = False
+        # (start, end) spans changed since the last save, sorted and disjoint
+        self.dirty: list[tuple[int, int]] = []
+        # parsed on first use, dropped when the directory bytes change.
+        # A file can hold the same pattern number twice, so entries are
+        # kept in order and looked up by number through the first of them
+        self.__directory: list[PatternMetadata] | None = None
+        self.__numbers: dict[int, int] = {}
+        # decoded patterns by directory index
+        self.__decoded: OrderedDict[int, np.ndarray] = OrderedDict()
         try:
-            with open(fn, "rb+") as df:
+            with open(fn, "rb") as df:
                 try:
-                    self.data = df.read(-1)
+                    self.data = bytearray(df.read(-1))
                     if len(self.data) == 0:
                         raise FileNotFoundError("The file has no data")
                 except:
@@ -65,30 +117,80 @@ class BrotherFile:  # pylint: disable=too-many-public-methods
             raise
         self.dfn = fn
 
+    @property
+    def view(self) -> memoryview:
+        """Read-only, zero copy view of the file's data"""
+        return memoryview(self.data).toreadonly()
+
     def get_indexed_byte(self, index: int) -> int:
         return self.data[index]
 
     def set_indexed_byte(self, index: int, b: int):
-        # python strings are mutable so we
-        # will convert the string to a char array, poke
-        # and convert back
-        dataarray = array.array("c")
-        dataarray.frombytes(self.data)
+        with self.edit() as buf:
+            buf[index] = b
+
+    @contextmanager
+    def edit(self) -> Iterator[EditBatch]:
+        """
+        Make a batch of writes, applied together once the block ends:
+
+            with bf.edit() as buf:
+                buf[0x6DF] = 0
+                buf[0x600:0x610] = pattern_bytes
+
+        If the block raises, none of the writes are applied.
+        """
+        batch = EditBatch(len(self.data))
+        yield batch
+        for start, value in batch.writes:
+            if self.verbose:
+                print(("* writing ", value.hex(), "to", hex(start)))
+            # this is the actual edit
+            self.data[start:start + len(value)] = value
+            self.__mark_dirty(start, start + len(value))
+            self.__invalidate(start, start + len(value))
 
-        if self.verbose:
-            print(("* writing ", hex(b), "to", hex(index)))
-        # print dataarray
+    def __invalidate(self, start: int, end: int) -> None:
+        if start < DIRECTORY_SIZE:
+            self.__directory = None
+            self.__decoded.clear()
+            return
+        directory = self.__get_directory()
+        for index in list(self.__decoded):
+            pattern = directory[index]
+            if start <= pattern.memo_offset and end > pattern.pattern_end_offset:
+                del self.__decoded[index]
 
-        # this is the actual edit
-        dataarray[index] = chr(b)
+    def __mark_dirty(self, start: int, end: int) -> None:
+        spans = []
+        for s, e in self.dirty:
+            if e < start or s > end:
+                spans.append((s, e))
+            else:
+                start, end = min(s, start), max(e, end)
+        spans.append((start, end))
+        spans.sort()
+        self.dirty = spans
 
-        # save the new string. sure its not very memory-efficient
-        # but who cares?
-        self.data = dataarray.tobytes()
+    def save(self, fn: str | None = None) -> None:
+        """
+        Write the data back to the file it came from, only the changed
+        spans are written. Given another file name, the whole file is
+        written there.
+        """
+        if fn is not None and fn != self.dfn:
+            with open(fn, "wb") as outfile:
+                outfile.write(self.data)
+            return
+        with open(self.dfn, "rb+") as outfile:
+            for start, end in self.dirty:
+                outfile.seek(start)
+                outfile.write(self.view[start:end])
+        self.dirty = []
 
     # handy for debugging
-    def get_full_data(self) -> bytes:
-        return self.data
+    def get_full_data(self) -> memoryview:
+        return self.view
 
     def get_indexed_nibble(self, offset: int, nibble: int) -> int:
         # nibbles is zero based
@@ -110,20 +212,21 @@ class BrotherFile:  # pylint: disable=too-many-public-methods
           rows
           patternOffset
           memoOffset
+        If the number is in the directory more than once, the first
+        entry is the one returned.
         """
-        patterns = self.get_patterns()
-        for pattern in patterns:
-            if pattern.number == pattern_number:
-                return pattern
-        return None
+        index = self.__index_of(pattern_number)
+        return None if index is None else self.__directory[index]
 
-    def get_patterns(self) -> list[PatternMetadata]:  # pylint: disable=too-many-locals
+    def get_patterns(self) -> list[PatternMetadata]:
         """
         Get a list of custom patterns stored in the file, or
         information for a single pattern.
         Pattern information is stored at the beginning
         of the file, with seven bytes per pattern and
         99 possible patterns, numbered 901-999.
+        The directory is parsed once, and again only after
+        its bytes have been edited.
         Returns: A list of tuples:
           patternNumber
           stitches
@@ -131,66 +234,83 @@ class BrotherFile:  # pylint: disable=too-many-public-methods
           patternOffset
           memoOffset
         """
+        return list(self.__get_directory())
+
+    def __get_directory(self) -> list[PatternMetadata]:
+        if self.__directory is None:
+            self.__directory = self.__parse_directory()
+            self.__numbers = {}
+            for index, pattern in enumerate(self.__directory):
+                self.__numbers.setdefault(pattern.number, index)
+        return self.__directory
+
+    def __index_of(self, pattern_number: int) -> int | None:
+        self.__get_directory()
+        return self.__numbers.get(pattern_number)
+
+    def __parse_directory(self) -> list[PatternMetadata]:  # pylint: disable=too-many-locals
         patlist: list[PatternMetadata] = []
-        idx = 0
-        pptr = INIT_PATTERN_OFFSET
-        for pi in range(1, 100):
-            flag = self.data[idx]
+        end = len(self.data) - 1
+        entries = DIRECTORY_ENTRY.iter_unpack(self.view[:DIRECTORY_SIZE])
+        for pi, (pointer, rows_ht, rows_o_stitches_h, stitches_to, number_h, number_to) in (
+            enumerate(entries, 1)
+        ):
+            # pointer is the flag byte and the byte after it, the
+            # distance of this pattern's memo from the end of the file
             if self.verbose:
-                print(f"Entry {pi}, flag is 0x{flag}X")
-            idx = idx + 1
-            unknown = self.data[
-                idx
-            ]  # is this the mode? or track? mode 1 disk has two tracks, mode 2 disk has 40 tracks
-            idx = idx + 1
-            rh, rt = nibbles(self.data[idx])
-            idx = idx + 1
-            ro, sh = nibbles(self.data[idx])
-            idx = idx + 1
-            st, so = nibbles(self.data[idx])
-            idx = idx + 1
-            _, ph = nibbles(self.data[idx])  # is unk here page number?
-            idx = idx + 1
-            pt, po = nibbles(self.data[idx])
-            idx = idx + 1
-            rows = hto(rh, rt, ro)
-            stitches = hto(sh, st, so)
-            patno = hto(ph, pt, po)
+                print(f"Entry {pi}, flag is 0x{pointer >> 8:X}")
+            rows = BCD[rows_ht] * 10 + HIGH_NIBBLE[rows_o_stitches_h]
+            stitches = LOW_NIBBLE[rows_o_stitches_h] * 100 + BCD[stitches_to]
+            patno = LOW_NIBBLE[number_h] * 100 + BCD[number_to]
             # we have this entry
             if self.verbose:
                 print(f"   Pattern {patno}: {rows} Rows, {stitches} Stitches - ")
-            if flag != 0:
-                # valid entry
-                pptr = len(self.data) - 1 - ((flag << 8) + unknown)
-                memoff = pptr
-                if self.verbose:
-                    print(("Memo #", patno, "offset ", memoff))
-                patoff = pptr - bytes_for_memo(rows)
-                if self.verbose:
-                    print(("Pattern #", patno, "offset ", patoff))
-                pptr = pptr - bytes_per_pattern_and_memo(stitches, rows)
-                if self.verbose:
-                    print(("Ending offset ", hex(pptr)))
-                patlist.append(
-                    PatternMetadata(
-                        number=patno,
-                        stitches=stitches,
-                        rows=rows,
-                        memo_offset=memoff,
-                        pattern_offset=patoff,
-                        pattern_end_offset=pptr,
-                    )
-                )
-            else:
+            if pointer < 0x100:
                 break
+            # valid entry
+            memoff = end - pointer
+            patoff = memoff - bytes_for_memo(rows)
+            pptr = memoff - bytes_per_pattern_and_memo(stitches, rows)
+            if self.verbose:
+                print(("Memo #", patno, "offset ", memoff))
+                print(("Pattern #", patno, "offset ", patoff))
+                print(("Ending offset ", hex(pptr)))
+            patlist.append(
+                PatternMetadata(
+                    number=patno,
+                    stitches=stitches,
+                    rows=rows,
+                    memo_offset=memoff,
+                    pattern_offset=patoff,
+                    pattern_end_offset=pptr,
+                )
+            )
         return patlist
 
-    def get_pattern_data(self, pattern_number: int) -> bytearray:
+    def get_pattern_data(self, pattern_number: int) -> np.ndarray:
+        """
+        Return a (rows, stitches) array containing the pattern
+        information for a pattern, the first entry of that number.
+        """
+        return self.get_entry_data(self.__index_of(pattern_number))
+
+    def get_entry_data(self, index: int) -> np.ndarray:
         """
-        Return an array containing the pattern
-        information for a pattern.
+        The (rows, stitches) array of the index'th pattern of
+        get_patterns(), even where two share a number.
         """
-        return self.get_pattern(pattern_number).get_data(self.data)
+        directory = self.__get_directory()
+        pattern = self.__decoded.get(index)
+        if pattern is not None:
+            self.__decoded.move_to_end(index)
+            return pattern
+        pattern = directory[index].get_data(self.data)
+        # shared between callers, so nobody gets to change it
+        pattern.flags.writeable = False
+        self.__decoded[index] = pattern
+        if len(self.__decoded) > DECODED_CACHE_SIZE:
+            self.__decoded.popitem(last=False)
+        return pattern
 
     # def motif_data(self) -> list[dict]:
     #     motiflist = []
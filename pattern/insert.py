@@ -2,6 +2,7 @@
 
 from collections import namedtuple
 import sys
+import numpy as np
 from PIL import Image
 import pattern.file as brother
 
@@ -16,7 +17,7 @@ class PatternInserter: # pylint: disable=too-few-public-methods
     def __init__(self, printer) -> None:
         self.print = printer
 
-    def insert_pattern(self, oldbrotherfile, pattnum, imgfile, newbrotherfile): # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    def insert_pattern(self, oldbrotherfile, pattnum, imgfile, newbrotherfile): # pylint: disable=too-many-locals
         bf = brother.BrotherFile(oldbrotherfile)
 
         # ok got a bank, now lets figure out how big this thing we want to insert is
@@ -31,6 +32,8 @@ class PatternInserter: # pylint: disable=too-few-public-methods
 
         # find the program entry
         the_pattern = bf.get_pattern(pattnum)
+        if the_pattern is None:
+            raise PatternNotFoundException(pattnum)
 
         if height != the_pattern.rows or width != the_pattern.stitches:
             raise InserterException(
@@ -44,77 +47,25 @@ class PatternInserter: # pylint: disable=too-few-public-methods
                 the_pattern.stitches,
             )
 
-        # debugging stuff here
-        x = 0
-        y = 0
-
-        x = width - 1
-        for y in range(height):
-            for x in range(width):
-                value = the_image.getpixel((x, y))
-                if value:
-                    self.print("* ")
-                else:
-                    self.print("  ")
-            self.print(" ")
+        # black pixels are stitches, the bottom row of the image is knitted first
+        is_black = np.asarray(the_image.convert("L")) == 0
 
+        # debugging stuff here
+        self.print("\n".join(
+            "".join("  " if black else "* " for black in row) for row in is_black
+        ))
         # debugging stuff done
 
         # now to make the actual, yknow memo+pattern data
 
         # the memo seems to be always blank. i have no idea really
-        memoentry = []
-        for i in range(bytes_for_memo(height)):
-            memoentry.append(0x0)
-
-        # now for actual real live pattern data!
-        pattmemnibs = []
-        for r in range(height):
-            row = []  # we'll chunk in bits and then put em into nibbles
-            for s in range(width):
-                x = s
-                value = the_image.getpixel((x, height - r - 1))
-                is_black = value == 0
-                if is_black:
-                    row.append(1)
-                else:
-                    row.append(0)
-            # print row
-            # turn it into nibz
-            for s in range(roundfour(width) / 4):
-                n = 0
-                for nibs in range(4):
-                    # print "row size = ", len(row), "index = ",s*4+nibs
-
-                    if len(row) == (s * 4 + nibs):
-                        break  # padding!
-
-                    if row[s * 4 + nibs]:
-                        n |= 1 << nibs
-                pattmemnibs.append(n)
-                # print hex(n),
-
-        if len(pattmemnibs) % 2:
-            # odd nibbles, buffer to a byte
-            pattmemnibs.append(0x0)
-
-        # print len(pattmemnibs), "nibbles of data"
-
-        # turn into bytes
-        pattmem = []
-        for i in range(len(pattmemnibs) / 2):
-            pattmem.append(pattmemnibs[i * 2] | (pattmemnibs[i * 2 + 1] << 4))
-
-        # print map(hex, pattmem)
-        # whew.
+        memo_length = bytes_for_memo(height)
+        pattmem = self.encode(is_black[::-1])
 
         # now to insert this data into the file
 
-        # now we have to figure out the -end- of the last pattern is
-        endaddr = 0x6DF
-
         beginaddr = the_pattern.pattern_end_offset
-        endaddr = beginaddr + bytes_for_memo(height) + len(pattmem)
+        endaddr = beginaddr + memo_length + len(pattmem)
         self.print(
             "beginning will be at "
             + str(hex(beginaddr))
@@ -136,20 +87,27 @@ class PatternInserter: # pylint: disable=too-few-public-methods
             )
             # exit
 
-        # write the memo and pattern entry from the -end- to the -beginning- (up!)
-        for i in range(len(memoentry)):
-            bf.set_indexed_byte(endaddr, 0)
-            endaddr -= 1
-
-        for i in enumerate(pattmem):
-            bf.set_indexed_byte(endaddr, pattmem[i])
-            endaddr -= 1
+        # the memo and then the pattern are written from the -end- to the
+        # -beginning- (up!), so the pattern bytes land in reverse order
+        memo_start = endaddr - memo_length + 1
+        with bf.edit() as buf:
+            buf[memo_start:endaddr + 1] = bytes(memo_length)
+            buf[memo_start - len(pattmem):memo_start] = pattmem[::-1]
 
         # push the data to a file
-        with open(newbrotherfile, "wb") as outfile:
-            d = bf.get_full_data()
-            outfile.write(d)
-            outfile.close()
+        bf.save(newbrotherfile)
+
+    @staticmethod
+    def encode(stitches: np.ndarray) -> bytes:
+        """
+        Pack a (rows, stitches) array of stitches into pattern memory.
+        Each row is padded to a whole number of nibbles with the first
+        stitch in the low bit, and nibbles fill each byte low half first.
+        """
+        rows, width = stitches.shape
+        padded = np.zeros((rows, roundfour(width)), dtype=np.uint8)
+        padded[:, :width] = stitches
+        return np.packbits(padded, bitorder="little").tobytes()
 
 
 class InserterException(Exception):
@@ -175,7 +133,7 @@ if __name__ == "__main__":
     inserter = PatternInserter(print)
     argv = sys.argv
     try:
-        inserter.insert_pattern(argv[1], argv[2], argv[3], argv[4])
+        inserter.insert_pattern(argv[1], int(argv[2]), argv[3], argv[4])
     except PatternNotFoundException as e:
         print(f"ERROR: Pattern {e.pattern_number} not found")
         sys.exit(1)
@@ -5,6 +5,13 @@ def nibbles(achar: int) -> tuple[int, int]:
     return msn, lsn
 
 
+# whole byte lookups, indexed by the byte value
+HIGH_NIBBLE = bytes(b >> 4 for b in range(256))
+LOW_NIBBLE = bytes(b & 0x0F for b in range(256))
+# both nibbles as two BCD digits
+BCD = bytes(10 * (b >> 4) + (b & 0x0F) for b in range(256))
+
+
 def hto(hundreds: int, tens: int, ones: int) -> int:
     return (100 * hundreds) + (10 * tens) + ones
 
@@ -28,17 +35,17 @@ def roundfour(val: int) -> int:
 def nibbles_per_row(stitches: int) -> int:
     # there are four stitches per nibble
     # each row is nibble aligned
-    return roundfour(stitches) / 4
+    return roundfour(stitches) // 4
 
 
 def bytes_per_pattern(stitches: int, rows: int) -> int:
     nibbs = rows * nibbles_per_row(stitches)
-    b = roundeven(nibbs) / 2
+    b = roundeven(nibbs) // 2
     return b
 
 
 def bytes_for_memo(rows: int) -> int:
-    b = roundeven(rows) / 2
+    b = roundeven(rows) // 2
     return b
 
 
@@ -1,9 +1,23 @@
 import array
 
-from pattern.maths import nibbles, nibbles_per_row, roundeven
+import numpy as np
+
+from pattern.maths import nibbles, nibbles_per_row, bytes_for_memo, bytes_per_pattern
 
 
 class PatternMetadata:
+    """
+    One directory entry. Slotted, as archives can hold thousands of
+    these and they only ever carry the six fields below.
+    """
+    __slots__ = (
+        "number",
+        "stitches",
+        "rows",
+        "memo_offset",
+        "pattern_offset",
+        "pattern_end_offset",
+    )
     number: int
     stitches: int
     rows: int
@@ -28,10 +42,18 @@ class PatternMetadata:
         self.pattern_offset = pattern_offset
         self.pattern_end_offset = pattern_end_offset
 
+    def __repr__(self) -> str:
+        return (
+            f"PatternMetadata(number={self.number}, stitches={self.stitches}, " +
+            f"rows={self.rows}, memo_offset={self.memo_offset}, " +
+            f"pattern_offset={self.pattern_offset}, " +
+            f"pattern_end_offset={self.pattern_end_offset})"
+        )
+
     def get_memo(self, data):
         memos = array.array("B")
         rows = self.rows
-        memlen = roundeven(rows) / 2
+        memlen = bytes_for_memo(rows)
         # memo is padded to en even byte
         for i in range(self.memo_offset, self.memo_offset - memlen, -1):
             msn, lsn = nibbles(data[i])
@@ -42,43 +64,20 @@ class PatternMetadata:
                 rows = rows - 1
         return memos
 
-    def get_data(self, data: bytes):
-        pattern = []
-
-        # print 'patoff = 0x%04X' % patoff
-        # print 'rows = ', rows
-        # print 'stitches = ', stitches
-        for i in range(0, self.rows):
-            arow = self.__get_row_data(data, i)
-            # print arow
-            pattern.append(arow)
-        return pattern
-
-    def __get_row_data(self, data: bytes, rownumber: int) -> bytes:
-        row = array.array("B")
-        nibspr = nibbles_per_row(self.stitches)
-        startnib = int(nibspr * rownumber)
-        endnib = int(startnib + nibspr)
-
-        for i in range(startnib, endnib, 1):
-            nib = self.__get_indexed_nibble(data, i)
-            row.append(nib & 0x01)
-            stitches = stitches - 1
-            if stitches:
-                row.append((nib & 0x02) >> 1)
-                stitches = stitches - 1
-            if stitches:
-                row.append((nib & 0x04) >> 2)
-                stitches = stitches - 1
-            if stitches:
-                row.append((nib & 0x08) >> 3)
-                stitches = stitches - 1
-        return row
+    def get_data(self, data: bytes) -> np.ndarray:
+        """
+        The pattern as a (rows, stitches) array of 0s and 1s, first row first.
 
-    def __get_indexed_nibble(self, data: bytes, nibble: int) -> int:
-        # nibbles is zero based
-        byte_data = int(nibble / 2)
-        m, l = nibbles(data[self.pattern_offset - byte_data])
-        if nibble % 2:
-            return m
-        return l
+        Rows are a whole number of nibbles, stored from pattern_offset
+        downwards, low nibble first and with the first stitch in the low
+        bit. So reversing the pattern bytes and unpacking them least
+        significant bit first gives every stitch in order, one row after
+        another. The array indexes like the old list of rows did.
+        """
+        stride = nibbles_per_row(self.stitches) * 4
+        length = bytes_per_pattern(self.stitches, self.rows)
+        region = np.frombuffer(
+            data, dtype=np.uint8, count=length, offset=self.pattern_offset - length + 1
+        )[::-1]
+        bits = np.unpackbits(region, count=self.rows * stride, bitorder="little")
+        return bits.reshape(self.rows, stride)[:, :self.stitches]
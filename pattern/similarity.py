@@ -0,0 +1,67 @@
+"""
+Near-duplicate search for decoded patterns.
+
+Every pattern gets a signature: its stitches resampled onto a fixed
+SIGNATURE_SIZE x SIGNATURE_SIZE grid and packed into 256 bits, so two
+patterns that look alike differ in only a few bits whatever their size.
+
+Signatures are searched by multi-index hashing. The 256 bits are cut
+into BANDS bands of BAND_BITS, each kept in its own indexed column. Two
+signatures within k bits of each other must have some band within
+k // BANDS bits (if every band differed by more, the total would be
+more than k), so a search only looks up the band values near the
+query's in each index and checks the full distance of what it finds.
+"""
+
+from itertools import combinations
+
+import numpy as np
+
+SIGNATURE_SIZE = 16
+SIGNATURE_BYTES = SIGNATURE_SIZE * SIGNATURE_SIZE // 8
+
+BANDS = 16
+BAND_BITS = SIGNATURE_SIZE * SIGNATURE_SIZE // BANDS
+BAND_BYTES = BAND_BITS // 8
+# past this many bits per band there are too many neighbours to look up,
+# searches that wide just compare against everything
+MAX_BAND_RADIUS = 3
+
+
+def signature(stitches: np.ndarray) -> bytes:
+    """
+    Nearest-neighbour resample of a (rows, stitches) pattern onto the
+    signature grid, packed eight stitches to a byte. An empty pattern
+    has the blank signature.
+    """
+    rows, width = stitches.shape
+    if rows == 0 or width == 0:
+        return bytes(SIGNATURE_BYTES)
+    row_index = np.arange(SIGNATURE_SIZE) * rows // SIGNATURE_SIZE
+    stitch_index = np.arange(SIGNATURE_SIZE) * width // SIGNATURE_SIZE
+    grid = stitches[row_index[:, None], stitch_index[None, :]]
+    return np.packbits(grid).tobytes()
+
+
+def distance(a: bytes, b: bytes) -> int:
+    """Hamming distance between two signatures"""
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).bit_count()
+
+
+def bands(sig: bytes) -> list[int]:
+    """The signature cut into BANDS integers of BAND_BITS each"""
+    return [
+        int.from_bytes(sig[i:i + BAND_BYTES], "big") for i in range(0, SIGNATURE_BYTES, BAND_BYTES)
+    ]
+
+
+def band_neighbours(value: int, radius: int) -> list[int]:
+    """Every band value within radius bits of value, value itself first"""
+    found = [value]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), flips):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            found.append(value ^ mask)
+    return found
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Throughput and latency benchmarks for the emulator, no machine needed.
+
+Plays the machine's side of each FDC command over a LoopbackConnection
+and times how long PDDemulator takes to answer. Reports commands per
+second, p50/p99 latency per command, the time for a full format and the
+time to upload a track (and the whole disk). Results can be saved as
+JSON and later runs compared against them to catch regressions.
+
+    python -m pddemulate.benchmark [--image] [--json out.json]
+        [--compare baseline.json] [--replay session.jsonl]
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+from pddemulate.disk import WRITE_POLICIES, make_write_policy
+from pddemulate.drive import PDDemulator
+from pddemulate.loopback import LoopbackConnection, SessionPlayer
+from pddemulate.trace import Tracer
+
+VERSION = "1.0"
+
+SECTOR = bytes(range(256)) * 4
+SECTOR_ID = b"\x01" + bytes(11)
+NUM_SECTORS = 80
+
+
+def opmode_request() -> bytes:
+    """ZZ, request 0x08 (switch to FDC mode), length, payload, checksum"""
+    req, payload = 0x08, b"\x00"
+    checksum = ((req + len(payload) + sum(payload)) % 0x100) ^ 0xFF
+    return b"ZZ" + bytes([req, len(payload)]) + payload + bytes([checksum])
+
+
+def command_bytes(cmd: bytes, psn: int) -> bytes:
+    """Everything the machine sends for one command, including its replies"""
+    request = cmd + b" %d\r" % psn
+    match cmd:
+        case b"A" | b"R":
+            # then a carriage return to ask for the data
+            return request + b"\r"
+        case b"S":
+            return b"S 0\r" + SECTOR_ID
+        case b"W":
+            return request + SECTOR
+        case b"B":
+            # the ID, then a bare carriage return as the follow up command
+            return request + SECTOR_ID + b"\r"
+        case b"F":
+            return b"F5\r\r"
+    raise ValueError(f"no benchmark for command {cmd}")
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Benchmark:
+    def __init__(
+            self,
+            disk_path: str,
+            write_policy=None,
+            journaled: bool = False,
+            tracer: Tracer | None = None,
+        ) -> None:
+        self.emu = PDDemulator(
+            disk_path, tracer=tracer, write_policy=write_policy, journaled=journaled
+        )
+        self.connection = LoopbackConnection()
+        self.emu.attach(self.connection)
+        self.latencies: dict[str, list[float]] = {}
+
+    def enter_fdc_mode(self) -> None:
+        self.connection.feed(opmode_request())
+        self.emu.handle_request()
+        self.connection.take()
+
+    def run(self, cmd: bytes, psn: int = 0) -> float:
+        self.connection.feed(command_bytes(cmd, psn))
+        start = time.perf_counter()
+        self.emu.handle_request()
+        elapsed = time.perf_counter() - start
+        if self.connection.pending():
+            raise RuntimeError(f"{cmd} left {self.connection.pending()} bytes unread")
+        self.connection.take()
+        self.latencies.setdefault(cmd.decode(), []).append(elapsed)
+        if cmd == b"F":
+            # a format always drops back to OpMode
+            self.enter_fdc_mode()
+        return elapsed
+
+    def upload_track(self, track: int) -> float:
+        return self.run(b"W", track * 2) + self.run(b"W", track * 2 + 1)
+
+    def run_all(self, iterations: int) -> dict:
+        self.enter_fdc_mode()
+        format_time = self.run(b"F")
+        for i in range(iterations):
+            psn = i % NUM_SECTORS
+            for cmd in (b"A", b"R", b"S", b"W", b"B"):
+                self.run(cmd, psn)
+        track_times = [self.upload_track(t) for t in range(NUM_SECTORS // 2)]
+        for _ in range(max(1, iterations // 100)):
+            self.run(b"F")
+
+        count = sum(len(v) for v in self.latencies.values())
+        total = sum(sum(v) for v in self.latencies.values())
+        return {
+            "commands": count,
+            "commands_per_second": count / total,
+            "latency": {
+                cmd: {
+                    "count": len(samples),
+                    "p50": percentile(samples, 50),
+                    "p99": percentile(samples, 99),
+                }
+                for cmd, samples in sorted(self.latencies.items())
+            },
+            "format_seconds": format_time,
+            "track_upload_seconds": percentile(track_times, 50),
+            "disk_upload_seconds": sum(track_times),
+            "writes": self.emu.disk.write_stats(),
+        }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Describe every p50 latency that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for cmd, stats in results["latency"].items():
+        before = baseline["latency"].get(cmd)
+        if before and stats["p50"] > before["p50"] * (1 + tolerance):
+            regressions.append(
+                f"{cmd}: p50 {before['p50'] * 1e6:.0f}us -> {stats['p50'] * 1e6:.0f}us"
+            )
+    for key in ("format_seconds", "track_upload_seconds"):
+        if key in baseline and results[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]:.4f}s -> {results[key]:.4f}s")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{results['commands']} commands, {results['commands_per_second']:.0f} commands/sec")
+    print("Command   Count     p50 (us)   p99 (us)")
+    for cmd, stats in results["latency"].items():
+        print(
+            f"  {cmd}       {stats['count']:6d}   " +
+            f"{stats['p50'] * 1e6:9.1f}  {stats['p99'] * 1e6:9.1f}"
+        )
+    print(f"Full format:        {results['format_seconds'] * 1000:8.2f} ms")
+    print(f"Track upload (p50): {results['track_upload_seconds'] * 1000:8.2f} ms")
+    print(f"Whole disk upload:  {results['disk_upload_seconds'] * 1000:8.2f} ms")
+    writes = results["writes"]
+    print(
+        f"Writes ({writes['policy']}): {writes['writes']}, " +
+        f"{writes['syncs']} synced in {writes['sync_seconds'] * 1000:.2f} ms"
+    )
+
+
+def main() -> None:  # pylint: disable=too-many-locals,too-many-statements
+    parser = argparse.ArgumentParser(description="Benchmark the PDD emulator")
+    parser.add_argument("--iterations", type=int, default=400)
+    parser.add_argument("--image", action="store_true", help="use a single .img disk")
+    parser.add_argument(
+        "--write-policy", choices=sorted(WRITE_POLICIES), help="for a sector directory disk"
+    )
+    parser.add_argument("--journal", action="store_true", help="journal sector directory writes")
+    parser.add_argument(
+        "--trace", action="store_true", help="run with a tracer, to see what it costs"
+    )
+    parser.add_argument("--json", help="save results to this file")
+    parser.add_argument("--compare", help="baseline results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--replay", help="also replay this recorded session")
+    parser.add_argument(
+        "--replay-disk",
+        help="image of the disk the session started from, if not the one recorded with it",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        disk_path = os.path.join(tmp, "disk.img" if args.image else "disk")
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            # the emulator is chatty, keep terminal output out of the timings
+            with contextlib.redirect_stdout(devnull):
+                policy = None if args.write_policy is None else make_write_policy(args.write_policy)
+                tracer = None
+                if args.trace:
+                    tracer = Tracer()
+                    tracer.install()
+                benchmark = Benchmark(disk_path, policy, args.journal, tracer)
+                results = benchmark.run_all(args.iterations)
+                # counts what was still held back too
+                benchmark.emu.disk.close()
+                results["writes"] = benchmark.emu.disk.write_stats()
+                if args.replay:
+                    player = SessionPlayer(args.replay, args.replay_disk)
+                    emu = PDDemulator(player.replay_disk(tmp))
+                    try:
+                        start = time.perf_counter()
+                        replay = player.replay(emu)
+                        replay_time = time.perf_counter() - start
+                    finally:
+                        emu.close()
+                        emu.disk.close()
+
+    print_results(results)
+    if args.trace:
+        counters = tracer.counters()
+        print(
+            f"Traced {counters['commands']} commands, {counters['bytes_in']} bytes in, " +
+            f"{counters['bytes_out']} bytes out, {len(tracer.ring.records)} log records kept"
+        )
+    if args.replay:
+        print(
+            f"Replayed {replay.requests} requests in {replay_time * 1000:.2f} ms, " +
+            ("output matched" if replay.matched else
+             f"output differs from byte {replay.first_difference}")
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    if args.replay and not replay.matched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
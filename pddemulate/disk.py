@@ -1,14 +1,230 @@
 import os
-from pddemulate.disk_sector import DiskSector
+import sys
+import threading
+import time
 
+from pddemulate import journal
+from pddemulate.disk_sector import DATA, ID, DiskSector
+from pddemulate.journal import Journal
+from pddemulate.snapshot import SnapshotStore, manifest_of, new_snapshot_name
+from pddemulate.sector_index import SectorIdIndex
+from pddemulate.track import TrackAssembler
 
-class Disk:
+
+class WriteStats:
+    """
+    writes: sector and ID writes made by the machine, and the time the
+    disk took over them. syncs: sector writes reaching the files.
+    """
+
+    def __init__(self) -> None:
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.syncs = 0
+        self.sync_bytes = 0
+        self.sync_seconds = 0.0
+        self.max_sync_seconds = 0.0
+
+    def record_write(self, seconds: float) -> None:
+        self.writes += 1
+        self.write_seconds += seconds
+        self.max_write_seconds = max(self.max_write_seconds, seconds)
+
+    def record_sync(self, sectors: int, written: int, seconds: float) -> None:
+        self.syncs += sectors
+        self.sync_bytes += written
+        self.sync_seconds += seconds
+        self.max_sync_seconds = max(self.max_sync_seconds, seconds)
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class WriteThrough:
+    """
+    Every write goes to the sector's files before the machine is answered,
+    with fsync also onto the disk itself. Without fsync this is how the
+    emulator always behaved.
+    """
+
+    def __init__(self, fsync: bool = True) -> None:
+        self.fsync = fsync
+        self.name = "fsync" if fsync else "flush"
+        self.stats = WriteStats()
+
+    def written(self, sector: DiskSector) -> None:
+        self.sync([sector])
+
+    def sync(self, sectors) -> None:
+        start = time.perf_counter()
+        written = sum(sector.sync(self.fsync) for sector in sectors)
+        if written:
+            self.stats.record_sync(len(sectors), written, time.perf_counter() - start)
+
+    def flush(self) -> None:
+        """Write out anything still held back"""
+
+    def close(self) -> None:
+        self.flush()
+
+
+class GroupCommit(WriteThrough):  # pylint: disable=too-many-instance-attributes
+    """
+    Writes are collected and synced together on a background thread,
+    once the line has been quiet for idle_ms or at the latest interval_ms
+    after the first unsynced write. A format or a track upload becomes a
+    single batch, and the machine never waits on the disk.
+    """
+
+    def __init__(self, interval_ms: float = 200, idle_ms: float = 20, fsync: bool = True) -> None:
+        super().__init__(fsync)
+        self.name = "group"
+        self.interval = interval_ms / 1000
+        self.idle = idle_ms / 1000
+        self.__dirty: set[DiskSector] = set()
+        self.__first = self.__last = 0.0
+        self.__changed = threading.Condition()
+        # only one thread writes the files at a time
+        self.__syncing = threading.Lock()
+        self.__worker: threading.Thread | None = None
+        self.__closed = False
+
+    def written(self, sector: DiskSector) -> None:
+        with self.__changed:
+            now = time.monotonic()
+            if not self.__dirty:
+                self.__first = now
+            self.__last = now
+            self.__dirty.add(sector)
+            if self.__worker is None:
+                self.__worker = threading.Thread(
+                    target=self.__run, name="group-commit", daemon=True
+                )
+                self.__worker.start()
+            self.__changed.notify()
+
+    def __take(self) -> list[DiskSector]:
+        sectors = list(self.__dirty)
+        self.__dirty.clear()
+        return sectors
+
+    def __run(self) -> None:
+        while True:
+            with self.__changed:
+                while not self.__closed:
+                    if not self.__dirty:
+                        self.__changed.wait()
+                        continue
+                    due = min(self.__first + self.interval, self.__last + self.idle)
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.__changed.wait(wait)
+                if self.__closed:
+                    return
+                sectors = self.__take()
+            with self.__syncing:
+                self.sync(sectors)
+
+    def flush(self) -> None:
+        with self.__changed:
+            sectors = self.__take()
+        with self.__syncing:
+            self.sync(sectors)
+
+    def close(self) -> None:
+        with self.__changed:
+            self.__closed = True
+            self.__changed.notify()
+        if self.__worker is not None:
+            self.__worker.join()
+        self.flush()
+
+
+class MemoryOnly(WriteThrough):
+    """
+    Sector writes stay in memory, for tests and benchmarks. Only the
+    writes: the sector files are still created and read when the disk is
+    opened, and each complete track is still assembled into its file-N.dat,
+    as listeners are handed that file.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(fsync=False)
+        self.name = "memory"
+
+    def written(self, sector: DiskSector) -> None:
+        sector.dirty = 0
+
+
+WRITE_POLICIES = {
+    "flush": lambda: WriteThrough(fsync=False),
+    "fsync": WriteThrough,
+    "group": GroupCommit,
+    "memory": MemoryOnly,
+}
+
+
+def make_write_policy(name: str) -> WriteThrough:
+    """A write policy by its command line name: flush, fsync, group or memory"""
+    try:
+        return WRITE_POLICIES[name]()
+    except KeyError:
+        print(f"Unknown write policy <{name}>, choose from {', '.join(WRITE_POLICIES)}")
+        raise
+
+
+# writes further apart than this are taken to be separate saves
+SESSION_GAP = 60.0
+SNAPSHOT_DIR = "snapshots"
+LOCK_NAME = "lock"
+
+
+def lock_directory(dirpath: str):
+    """
+    Take <dirpath>/lock for as long as the returned file stays open, so
+    an emulator and the snapshot tool never write one disk together.
+    The operating system drops the lock if the holder dies.
+    """
+    f = open(os.path.join(dirpath, LOCK_NAME), "a+b")  # pylint: disable=consider-using-with
+    try:
+        # pylint: disable=import-outside-toplevel
+        if sys.platform == "win32":
+            import msvcrt  # pylint: disable=import-error
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        f.close()
+        print(f"Disk <{dirpath}> is in use by another emulator or tool")
+        raise IOError from e
+    return f
+
+
+class Disk:  # pylint: disable=too-many-instance-attributes
     """
     Fields:
         self.lastDatFilePath : string
+        self.policy : when sector writes reach the files, WriteThrough
+            without fsync unless told otherwise
+        self.journal : with journaled=True, the write-ahead journal. Writes
+            are held back from the policy until the upload they belong to
+            is committed (a track, a format, or an ID written outside a
+            track upload), and a crashed session is replayed on opening.
+        self.auto_snapshot : snapshot the disk before the first write of
+            each save, so earlier saves can be restored
     """
 
-    def __init__(self, basename: str):
+    def __init__(
+            self,
+            basename: str,
+            deferred_tracks: bool = False,
+            write_policy: WriteThrough | None = None,
+            journaled: bool = False,
+            auto_snapshot: bool = False,
+        ):
         self.num_sectors = 80
         self.sectors: list[DiskSector] = []
         self.filespath = ""
@@ -38,45 +254,224 @@ class Disk:
                 raise IOError from e
 
         self.filespath = dirpath
+        self.__lock = lock_directory(dirpath)
+        self.policy = WriteThrough(fsync=False) if write_policy is None else write_policy
+        self.tracks = TrackAssembler(dirpath, deferred=deferred_tracks)
         # we have a directory now - set up disk sectors
         for i in range(self.num_sectors):
             fname = os.path.join(dirpath, str(i))
             ds = DiskSector(fname)
             self.sectors.append(ds)
+        self.journal: Journal | None = None
+        # journaled writes not yet committed, and committed writes that
+        # may not have reached the disk yet
+        self.__uncommitted: set[DiskSector] = set()
+        self.__unsettled: set[DiskSector] = set()
+        # an even sector has been written and its track waits for the odd one
+        self.__track_open = False
+        if journaled:
+            self.journal = Journal(os.path.join(dirpath, journal.JOURNAL_NAME))
+            self.__recover()
+        self.id_index = SectorIdIndex(s.get_sector_id() for s in self.sectors)
+        self.auto_snapshot = auto_snapshot
+        self.__last_write: float | None = None
+        self.__snapshots: SnapshotStore | None = None
 
     def __del__(self):
         return
 
+    def __recover(self) -> None:
+        records = self.journal.recover()
+        for kind, psn, payload in records:
+            sector = self.sectors[psn]
+            match kind:
+                case journal.DATA:
+                    sector.data = payload
+                    sector.dirty |= DATA
+                case journal.ID:
+                    sector.id = payload
+                    sector.dirty |= ID
+                case journal.FORMAT:
+                    for s in self.sectors:
+                        s.format()
+        if records:
+            print(f"Replayed {len(records)} journaled writes into <{self.filespath}>")
+        for sector in self.sectors:
+            if sector.dirty:
+                sector.sync(fsync=True)
+        self.journal.truncate()
+
+    def __written(self, sector: DiskSector) -> None:
+        if self.journal is None:
+            self.policy.written(sector)
+        else:
+            self.__uncommitted.add(sector)
+
+    def commit(self) -> None:
+        """Seal the journaled writes so far, and pass them on to the write policy"""
+        if self.journal is None or not self.__uncommitted:
+            return
+        self.journal.commit()
+        self.__track_open = False
+        for sector in self.__uncommitted:
+            self.policy.written(sector)
+        self.__unsettled |= self.__uncommitted
+        self.__uncommitted.clear()
+        if self.journal.size >= journal.CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Get every committed write onto the disk, then empty the journal"""
+        if self.journal is None:
+            return
+        self.policy.flush()
+        for sector in self.__unsettled:
+            sector.sync(fsync=True)
+            sector.settle()
+        self.__unsettled.clear()
+        self.journal.truncate()
+
+    def close(self) -> None:
+        self.tracks.close()
+        self.commit()
+        self.policy.close()
+        if self.journal is not None:
+            self.checkpoint()
+            self.journal.close()
+        for sector in self.sectors:
+            sector.close()
+        self.__lock.close()
+
+    def flush(self) -> None:
+        """Write every sector change still held back by the write policy"""
+        self.commit()
+        self.policy.flush()
+
+    def write_stats(self) -> dict:
+        return {"policy": self.policy.name, **self.policy.stats.as_dict()}
+
+    def __snapshot_store(self) -> SnapshotStore:
+        if self.__snapshots is None:
+            self.__snapshots = SnapshotStore(os.path.join(self.filespath, SNAPSHOT_DIR))
+        return self.__snapshots
+
+    def snapshots(self) -> list[str]:
+        """Names of the snapshots taken, oldest first"""
+        return self.__snapshot_store().names()
+
+    def snapshot(self, name: str | None = None) -> str:
+        """Save the disk as it is now, returns the snapshot's name"""
+        store = self.__snapshot_store()
+        name = new_snapshot_name() if name is None else name
+        store.save(name, [(store.put(s.data), store.put(s.id)) for s in self.sectors])
+        return name
+
+    def diff(self, name: str, other: str | None = None) -> list[int]:
+        """Sectors that differ between two snapshots, or a snapshot and the disk"""
+        store = self.__snapshot_store()
+        current = manifest_of(self) if other is None else store.load(other)
+        return store.diff(store.load(name), current)
+
+    def restore(self, name: str) -> list[int]:
+        """
+        Put the disk back as it was in a snapshot, returns the sectors
+        changed. The disk as it was is snapshotted first, so a restore
+        can itself be undone.
+        """
+        store = self.__snapshot_store()
+        wanted = store.load(name)
+        current = manifest_of(self)
+        changed = store.diff(wanted, current)
+        if changed:
+            print(f"Saved the disk as it was before the restore as {self.snapshot()}")
+        for psn in changed:
+            sector = self.sectors[psn]
+            data_hash, id_hash = wanted[psn]
+            if data_hash != current[psn][0]:
+                sector.write(store.get(data_hash))
+                if self.journal is not None:
+                    self.journal.append(journal.DATA, psn, sector.data)
+            if id_hash != current[psn][1]:
+                sector.set_sector_id(store.get(id_hash))
+                if self.journal is not None:
+                    self.journal.append(journal.ID, psn, sector.id)
+                self.id_index.update(psn, sector.id)
+            self.__written(sector)
+        self.commit()
+        for psn in sorted({psn | 1 for psn in changed}):
+            self.last_dat_file_path = self.tracks.assemble(
+                psn, self.sectors[psn - 1].data, self.sectors[psn].data
+            )
+        return changed
+
+    def __before_write(self) -> None:
+        if not self.auto_snapshot:
+            return
+        now = time.monotonic()
+        if self.__last_write is None or now - self.__last_write > SESSION_GAP:
+            names = self.snapshots()
+            # no need for another copy of a disk nobody has changed
+            if not names or self.__snapshot_store().load(names[-1]) != manifest_of(self):
+                self.snapshot()
+        self.__last_write = now
+
     def format(self) -> None:
+        self.__before_write()
+        start = time.perf_counter()
+        if self.journal is not None:
+            self.journal.append(journal.FORMAT, 0)
         for i in range(self.num_sectors):
             self.sectors[i].format()
+            self.__written(self.sectors[i])
+        self.commit()
+        self.id_index.reset(self.sectors[0].get_sector_id())
+        self.policy.stats.record_write(time.perf_counter() - start)
 
     def find_sector_id(self, psn: int, sector_id: bytes) -> bytes:
-        for i in range(psn, self.num_sectors):
-            sid = self.sectors[i].get_sector_id()
-            if sector_id == sid:
-                return b"00" + b"%02X" % i + b"0000"
+        i = self.id_index.find(psn, sector_id)
+        if i is not None:
+            return b"00" + b"%02X" % i + b"0000"
         return b"40000000"
 
     def get_sector_id(self, psn: int) -> bytes:
         return self.sectors[psn].get_sector_id()
 
     def set_sector_id(self, psn: int, sector_id: bytes) -> None:
+        self.__before_write()
+        start = time.perf_counter()
         self.sectors[psn].set_sector_id(sector_id)
+        if self.journal is not None:
+            self.journal.append(journal.ID, psn, self.sectors[psn].id)
+        self.__written(self.sectors[psn])
+        self.id_index.update(psn, self.sectors[psn].get_sector_id())
+        # the machine writes IDs after the data, an acknowledged ID must
+        # not wait for a track upload that may never come. Inside an
+        # upload it is committed with the track.
+        if not self.__track_open:
+            self.commit()
+        self.policy.stats.record_write(time.perf_counter() - start)
 
     def write_sector(self, psn: int, __lsn: int, indata: bytes) -> None:
+        self.__before_write()
+        start = time.perf_counter()
         self.sectors[psn].write(indata)
-        if psn % 2:
-            filenum = ((psn - 1) / 2) + 1
-            filename = f"file-{filenum}.dat" % filenum
+        if self.journal is not None:
+            self.journal.append(journal.DATA, psn, self.sectors[psn].data)
+        self.__written(self.sectors[psn])
+        if psn % 2 == 0:
+            self.__track_open = self.journal is not None
+        else:
+            # the track is complete
+            self.commit()
             # we wrote an odd sector, so create the
             # associated file
-            fn1 = os.path.join(self.filespath, f"{psn - 1}.dat")
-            fn2 = os.path.join(self.filespath, f"{psn}.dat")
-            outfn = os.path.join(self.filespath, filename)
-            cmd = f"cat {fn1} {fn2} > {outfn}"
-            os.system(cmd)
-            self.last_dat_file_path = outfn
+            self.last_dat_file_path = self.tracks.assemble(
+                psn, self.sectors[psn - 1].data, self.sectors[psn].data
+            )
+        self.policy.stats.record_write(time.perf_counter() - start)
+
+    def flush_tracks(self) -> None:
+        self.tracks.flush()
 
     def read_sector(self, psn: int, __lsn: int) -> bytes:
         return self.sectors[psn].read(1024)
@@ -0,0 +1,274 @@
+"""
+A single file alternative to the one-file-per-sector layout used by Disk.
+
+All 80 sectors live in one memory mapped image. Each sector is stored as
+its 1024 data bytes immediately followed by its 12 byte ID, so the whole
+image is 80 * 1036 bytes. Reads hand out memoryview slices of the map
+rather than copies, and writes only flush the pages they dirtied.
+
+The per-sector directory layout is still supported as an import and
+export format, see DiskImage.import_directory and export_directory.
+"""
+
+import mmap
+import os
+import sys
+import time
+
+from pddemulate.disk import Disk, WriteStats, WriteThrough
+from pddemulate.sector_index import SectorIdIndex
+from pddemulate.track import TrackAssembler
+
+SECTOR_SIZE = 1024
+ID_SIZE = 12
+RECORD_SIZE = SECTOR_SIZE + ID_SIZE
+NUM_SECTORS = 80
+IMAGE_SIZE = NUM_SECTORS * RECORD_SIZE
+IMAGE_SUFFIX = ".img"
+
+
+class DiskImage:  # pylint: disable=too-many-instance-attributes
+    """
+    Fields:
+        self.path : string, the image file
+        self.filespath : string, where the assembled track files are written
+        self.last_dat_file_path : string
+    """
+
+    def __init__(self, path: str, deferred_tracks: bool = False):
+        self.num_sectors = NUM_SECTORS
+        self.path = os.path.abspath(path)
+        self.filespath = os.path.dirname(self.path)
+        self.last_dat_file_path = None
+        self.__dirty_pages: set[int] = set()
+        self.stats = WriteStats()
+
+        if os.path.exists(self.path):
+            if not os.access(self.path, os.R_OK | os.W_OK):
+                print(
+                    f"Image <{self.path}> exists but cannot be accessed, check permissions"
+                )
+                raise IOError
+            size = os.path.getsize(self.path)
+            if size != IMAGE_SIZE:
+                print(
+                    f"Found an image <{self.path}> with the wrong size," +
+                    f" is {size} should be {IMAGE_SIZE}"
+                )
+                raise IOError
+        else:
+            try:
+                with open(self.path, "wb") as f:
+                    f.truncate(IMAGE_SIZE)
+            except Exception as e:
+                print(f"Unable to create image <{self.path}>")
+                raise IOError from e
+
+        self.__closed = False
+        self.__file = open(self.path, "r+b")  # pylint: disable=consider-using-with
+        self.__map = mmap.mmap(self.__file.fileno(), IMAGE_SIZE)
+        self.__view = memoryview(self.__map)
+        self.tracks = TrackAssembler(self.filespath, deferred=deferred_tracks)
+        self.id_index = SectorIdIndex(self.get_sector_id(i) for i in range(NUM_SECTORS))
+
+    def __del__(self):
+        return
+
+    def close(self) -> None:
+        """
+        Flush outstanding writes and unmap the image. Sectors read earlier
+        may still be in use: the map then stays until they are let go.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        try:
+            self.flush()
+            self.tracks.close()
+        finally:
+            try:
+                self.__view.release()
+                self.__map.close()
+            except BufferError:
+                pass
+            self.__file.close()
+
+    def write_stats(self) -> dict:
+        # every write is flushed, the image is its own write-through policy
+        return {"policy": "mmap", **self.stats.as_dict()}
+
+    def flush(self) -> None:
+        """Write the dirtied pages, and only those, back to the image file"""
+        if not self.__dirty_pages:
+            return
+        began = time.perf_counter()
+        page = mmap.ALLOCATIONGRANULARITY
+        pages = sorted(self.__dirty_pages)
+        self.__dirty_pages.clear()
+        start = prev = pages[0]
+        for p in pages[1:] + [None]:
+            if p is not None and p == prev + 1:
+                prev = p
+                continue
+            offset = start * page
+            self.__map.flush(offset, min((prev + 1) * page, IMAGE_SIZE) - offset)
+            if p is not None:
+                start = prev = p
+        self.stats.record_sync(
+            len(pages), len(pages) * page, time.perf_counter() - began
+        )
+
+    def __mark_dirty(self, offset: int, length: int) -> None:
+        page = mmap.ALLOCATIONGRANULARITY
+        self.__dirty_pages.update(range(offset // page, (offset + length - 1) // page + 1))
+
+    @staticmethod
+    def __data_offset(psn: int) -> int:
+        if not 0 <= psn < NUM_SECTORS:
+            print(f"Error, sector {psn} out of range")
+            raise IOError
+        return psn * RECORD_SIZE
+
+    def __id_offset(self, psn: int) -> int:
+        return self.__data_offset(psn) + SECTOR_SIZE
+
+    def format(self) -> None:
+        began = time.perf_counter()
+        self.__view[:] = bytes(IMAGE_SIZE)
+        self.__mark_dirty(0, IMAGE_SIZE)
+        self.flush()
+        self.id_index.reset(bytes(ID_SIZE))
+        self.stats.record_write(time.perf_counter() - began)
+
+    def find_sector_id(self, psn: int, sector_id: bytes) -> bytes:
+        i = self.id_index.find(psn, sector_id)
+        if i is not None:
+            return b"00" + b"%02X" % i + b"0000"
+        return b"40000000"
+
+    def get_sector_id(self, psn: int) -> bytes:
+        offset = self.__id_offset(psn)
+        return bytes(self.__view[offset:offset + ID_SIZE])
+
+    def set_sector_id(self, psn: int, sector_id: bytes) -> None:
+        if len(sector_id) == 0:
+            sector_id = bytes(ID_SIZE)
+        elif len(sector_id) != ID_SIZE:
+            print(
+                f"Error, bad id {sector_id} length of {len(sector_id)} bytes" +
+                f" when expecting {ID_SIZE}"
+            )
+            raise IOError
+        began = time.perf_counter()
+        offset = self.__id_offset(psn)
+        self.__view[offset:offset + ID_SIZE] = sector_id
+        self.__mark_dirty(offset, ID_SIZE)
+        self.flush()
+        self.id_index.update(psn, sector_id)
+        self.stats.record_write(time.perf_counter() - began)
+
+    def write_sector(self, psn: int, __lsn: int, indata: bytes) -> None:
+        if len(indata) != SECTOR_SIZE:
+            print(f"Error, write of {len(indata)} bytes when expecting {SECTOR_SIZE}")
+            raise IOError
+        began = time.perf_counter()
+        offset = self.__data_offset(psn)
+        self.__view[offset:offset + SECTOR_SIZE] = indata
+        self.__mark_dirty(offset, SECTOR_SIZE)
+        self.flush()
+        if psn % 2:
+            # we wrote an odd sector, so create the associated file
+            self.last_dat_file_path = self.tracks.assemble(
+                psn, self.read_sector(psn - 1, 1), self.read_sector(psn, 1)
+            )
+        self.stats.record_write(time.perf_counter() - began)
+
+    def flush_tracks(self) -> None:
+        self.tracks.flush()
+
+    def read_sector(self, psn: int, __lsn: int) -> memoryview:
+        """
+        A read-only view of the sector in the map, not a copy: it shows
+        later writes to the sector, take bytes() of it to keep the data.
+        """
+        offset = self.__data_offset(psn)
+        return self.__view[offset:offset + SECTOR_SIZE].toreadonly()
+
+    @classmethod
+    def import_directory(cls, dirpath: str, path: str) -> "DiskImage":
+        """Build an image from a per-sector directory (nn.dat and nn.id files)"""
+        image = cls(path)
+        for i in range(NUM_SECTORS):
+            fname = os.path.join(dirpath, str(i))
+            for suffix, offset, size in (
+                (".dat", image.__data_offset(i), SECTOR_SIZE),
+                (".id", image.__id_offset(i), ID_SIZE),
+            ):
+                if not os.path.exists(fname + suffix):
+                    continue
+                with open(fname + suffix, "rb") as f:
+                    content = f.read()
+                if len(content) not in (0, size):
+                    print(f"Found a file <{fname + suffix}> with the wrong size")
+                    raise IOError
+                if content:
+                    image.__view[offset:offset + size] = content
+                    if suffix == ".id":
+                        image.id_index.update(i, content)
+        image.__mark_dirty(0, IMAGE_SIZE)
+        image.flush()
+        return image
+
+    def export_directory(self, dirpath: str) -> None:
+        """Write the image out as a per-sector directory readable by Disk"""
+        os.makedirs(dirpath, exist_ok=True)
+        for i in range(NUM_SECTORS):
+            fname = os.path.join(dirpath, str(i))
+            with open(fname + ".dat", "wb") as f:
+                f.write(self.read_sector(i, 1))
+            with open(fname + ".id", "wb") as f:
+                f.write(self.get_sector_id(i))
+
+
+def save_image(disk: Disk | DiskImage, path: str) -> None:
+    """Write the sectors and IDs of any disk to path as an image file"""
+    with open(path, "wb") as f:
+        for i in range(NUM_SECTORS):
+            f.write(disk.read_sector(i, 1))
+            f.write(disk.get_sector_id(i))
+
+
+def open_disk(
+        path: str,
+        deferred_tracks: bool = False,
+        write_policy: WriteThrough | None = None,
+        journaled: bool = False,
+        auto_snapshot: bool = False,
+    ) -> Disk | DiskImage:
+    """
+    A DiskImage for paths ending in .img, otherwise a per-sector Disk
+    directory. The write policy, journal and snapshots only apply to
+    directories, an image always flushes the pages each write touched.
+    """
+    if path.endswith(IMAGE_SUFFIX):
+        return DiskImage(path, deferred_tracks=deferred_tracks)
+    return Disk(
+        path,
+        deferred_tracks=deferred_tracks,
+        write_policy=write_policy,
+        journaled=journaled,
+        auto_snapshot=auto_snapshot,
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("import", "export"):
+        print(f"Usage: {sys.argv[0]} import sectordir image.img")
+        print(f"       {sys.argv[0]} export image.img sectordir")
+        sys.exit(1)
+    if sys.argv[1] == "import":
+        DiskImage.import_directory(sys.argv[2], sys.argv[3]).close()
+    else:
+        img = DiskImage(sys.argv[2])
+        img.export_directory(sys.argv[3])
+        img.close()
@@ -6,15 +6,29 @@ Note that this code makes a fundamental assumption which
  the brother uses a LS size of 1024 bytes, so only one can fit.
 """
 
+import logging
 import os
 
+log = logging.getLogger(__name__)
+
+# what DiskSector.dirty can hold
+DATA = 1
+ID = 2
+
 
 class DiskSector:
+    """
+    A sector held in memory. write, set_sector_id and format change the
+    buffers and mark them dirty; sync() is what writes them to the files,
+    and the disk's write policy decides when that happens.
+    """
+
     def __init__(self, fn):
         self.sector_size = 1024
         self.id_size = 12
         self.data: bytes = b""
         self.id: bytes = b""
+        self.dirty = 0
         # self.id = array('c')
 
         dfn = fn + ".dat"
@@ -76,9 +90,8 @@ class DiskSector:
 
     def format(self):
         self.data = bytearray(self.sector_size)
-        self.write_d_file()
         self.id = bytearray(self.id_size)
-        self.write_id_file()
+        self.dirty = DATA | ID
 
     def write_d_file(self) -> None:
         self.df.seek(0)
@@ -90,6 +103,34 @@ class DiskSector:
         self.idf.write(self.id)
         self.idf.flush()
 
+    def sync(self, fsync: bool = False) -> int:
+        """
+        Write whatever has changed to the files, and with fsync make sure
+        it has reached the disk. Returns the number of bytes written.
+        """
+        # clear first, a change made while writing marks it dirty again
+        dirty, self.dirty = self.dirty, 0
+        written = 0
+        for flag, f, write in (
+            (DATA, self.df, self.write_d_file),
+            (ID, self.idf, self.write_id_file),
+        ):
+            if dirty & flag:
+                write()
+                if fsync:
+                    os.fsync(f.fileno())
+                written += self.sector_size if flag == DATA else self.id_size
+        return written
+
+    def settle(self) -> None:
+        """Make sure what has been written to the files is on the disk"""
+        os.fsync(self.df.fileno())
+        os.fsync(self.idf.fileno())
+
+    def close(self) -> None:
+        self.df.close()
+        self.idf.close()
+
     def read(self, length: int) -> bytes:
         if length != self.sector_size:
             print(f"Error, read of {length} bytes when expecting {self.sector_size}")
@@ -103,7 +144,7 @@ class DiskSector:
             )
             raise IOError
         self.data = indata
-        self.write_d_file()
+        self.dirty |= DATA
 
     def get_sector_id(self) -> bytes:
         return self.id
@@ -118,9 +159,8 @@ class DiskSector:
             raise IOError
         else:
             self.id = newid
-        self.write_id_file()
-        print("Wrote New ID: ", end=" ")
-        self.dump_id()
+        self.dirty |= ID
+        log.debug("Wrote New ID: %r", self.id)
 
     def dump_id(self) -> None:
         print(f"{self.id}")
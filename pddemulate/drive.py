@@ -1,8 +1,18 @@
-from array import array  # type: ignore
+import logging
+from collections.abc import Coroutine
 
 from pddemulate.disk import Disk
+from pddemulate.disk_image import DiskImage, open_disk
 from pddemulate.listener import PDDEmulatorListener
-from pddemulate.serial import SerialConnection
+from pddemulate.serial import (
+    AsyncSerialConnection,
+    BlockingTransport,
+    SerialConnection,
+    Transport,
+)
+from pddemulate.trace import TracedTransport, Tracer
+
+log = logging.getLogger(__name__)
 
 FORMAT_LENGTH = {
     b"0": 64,
@@ -15,100 +25,125 @@ FORMAT_LENGTH = {
 }
 
 
-class PDDemulator:
-    serial: SerialConnection = None
-    listeners: list[PDDEmulatorListener] = []  # list of PDDEmulatorListener
-    fdc_mode = False
-    disk: Disk
+class AsyncPDDemulator:
+    """
+    The FDC/OpMode state machine, driven by an asyncio event loop.
+
+    Reads come from a Transport, so several drives can share one loop
+    and nothing blocks while a machine is quiet. Given a Tracer, each
+    command is timed and the bytes either way are counted.
+    """
+    listeners: list[PDDEmulatorListener]
+    fdc_mode: bool
+    disk: Disk | DiskImage
     # bytes per logical sector
-    bpls = 1024
+    bpls: int
+
+    def __init__(self, basename, deferred_tracks=False, tracer: Tracer | None = None,
+                 **disk_options):
+        # disk_options are for a sector directory Disk: write_policy,
+        # journaled and auto_snapshot
+        self.disk = open_disk(basename, deferred_tracks=deferred_tracks, **disk_options)
+        self.tracer = tracer
+        self.__transport: Transport | None = None
+        self.listeners = []
+        self.fdc_mode = False
+        self.bpls = 1024
 
-    def __init__(self, basename):
-        self.disk = Disk(basename)
+    @property
+    def transport(self) -> Transport | None:
+        return self.__transport
 
-    def open(self, cport="/dev/ttyUSB0") -> None:
-        self.serial = SerialConnection(cport)
+    @transport.setter
+    def transport(self, transport: Transport | None) -> None:
+        if transport is not None and self.tracer is not None:
+            self.tracer.connected()
+            transport = TracedTransport(transport, self.tracer)
+        self.__transport = transport
 
-    def is_open(self) -> None:
-        return self.serial is not None
+    async def open(self, cport="/dev/ttyUSB0") -> None:
+        self.transport = AsyncSerialConnection(cport)
+
+    def is_open(self) -> bool:
+        return self.transport is not None
 
     def close(self) -> None:
-        self.serial = None
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = None
 
-    def __read_fdd_request(self) -> list[bytes]:
-        inbuf = []
+    async def __read_fdd_request(self) -> list[bytes]:
         # read through a carriage return
         # parameters are seperated by commas
-        while True:
-            inc = self.serial.read_char()
-            if inc == b"\r":
-                break
-            if inc == b" ":
-                continue
-            inbuf.append(inc)
-
-        all_data = b"".join(inbuf)
+        all_data = (await self.transport.read_until(b"\r"))[:-1].replace(b" ", b"")
         rv = all_data.split(b",")
         return rv
 
-    def __read_opmode_request(self, req: int):
-        buff = array("b")
-        checksum = req
-        reqlen = ord(self.serial.read_char())
-        buff.append(reqlen)
-        checksum = checksum + reqlen
-
-        for _ in range(reqlen, 0, -1):
-            rb = ord(self.serial.read_char())
-            buff.append(rb)
-            checksum = checksum + rb
+    async def __read_opmode_request(self, req: int) -> bytes | None:
+        reqlen = await self.transport.read_char()
+        payload = await self.transport.read_exact(ord(reqlen))
 
         # calculate ckecksum
-        checksum = checksum % 0x100
+        checksum = (req + ord(reqlen) + sum(payload)) % 0x100
         checksum = checksum ^ 0xFF
 
-        chkbit = self.serial.read_char()
+        chkbit = await self.transport.read_char()
         cksum = ord(chkbit)
 
         if cksum == checksum:
-            # if self.verbose:
-            #     print(f"Checksum match! {req} {chkbit}")
-            return buff
-        print("Checksum mismatch!!")
+            return reqlen + payload
+        log.warning("Checksum mismatch on request %d: got %d, expected %d", req, cksum, checksum)
+        if self.tracer is not None:
+            self.tracer.checksum_mismatch()
         return None
 
-    def handle_requests(self):  # never returns
+    async def handle_requests(self):  # never returns
         while True:
-            self.handle_request()
+            await self.handle_request()
 
-    def handle_request(self) -> None:
-        inc = self.serial.read_char()
+    async def handle_request(self) -> None:
+        if self.tracer is None:
+            await self.__handle_request()
+            return
+        self.tracer.activate()
+        try:
+            await self.__handle_request()
+        except Exception as e:
+            self.tracer.failed(e)
+            raise
+        finally:
+            self.tracer.end()
+
+    async def __handle_request(self) -> None:
+        inc = await self.transport.read_char()
         if self.fdc_mode:
-            self.__handle_fdc_mode_request(inc)
+            await self.__handle_fdc_mode_request(inc)
         else:
             # in OpMode, look for ZZ
-            # inc = self.serial.readchar()
+            # inc = self.transport.readchar()
             if inc != b"Z":
                 return
-            inc = self.serial.read_char()
+            inc = await self.transport.read_char()
             if inc == b"Z":
-                self.__handle_op_mode_request()
+                await self.__handle_op_mode_request()
             else:
-                print(f"Unknown op mode command: {hex(ord(inc))}")
+                log.warning("Unknown op mode command: 0x%02X", ord(inc))
 
-    def __handle_op_mode_request(self) -> None:
-        req = ord(self.serial.read())
-        print(f"Request: {req}")
+    async def __handle_op_mode_request(self) -> None:
+        req = ord(await self.transport.read_char())
+        if self.tracer is not None:
+            self.tracer.begin("ZZ")
+        log.debug("Request: %d", req)
         if req == 0x08:
             # Change to FDD emulation mode (no data returned)
-            inbuf = self.__read_opmode_request(req)
+            inbuf = await self.__read_opmode_request(req)
             if inbuf is not None:
                 # Change Modes, leave any incoming serial data in buffer
                 self.fdc_mode = True
         else:
-            print(f"Invalid OpMode request code {req} received")
+            log.warning("Invalid OpMode request code %d received", req)
 
-    def __handle_fdc_mode_request(self, cmd: bytes) -> None:
+    async def __handle_fdc_mode_request(self, cmd: bytes) -> None:  # pylint: disable=too-many-branches
         # Commands may be followed by an optional space
         # physical sector number range 0-79
         # logical sector number range 0-(number of logical sectors in a physical sector)
@@ -134,145 +169,156 @@ class PDDemulator:
         #   In the case of an S, C, or M command -- or an F command that ends in
         #   an error -- the bytes contain '0000'
         #
-        print("Handling command", cmd)
+        if self.tracer is not None:
+            self.tracer.begin(cmd.decode("latin-1"))
+        log.debug("Handling command %r", cmd)
 
         match cmd:
             case b"\r":
-                self.serial.write_bytes(b"00000000")
+                self.transport.write_bytes(b"00000000")
                 return
 
             case b"Z":
                 # Hmmm, looks like we got the start of an Opmode Request
-                inc = self.serial.read_char()
+                inc = await self.transport.read_char()
                 if inc == b"Z":
                     # definitely!
-                    print("Detected Opmode Request in FDC Mode, switching to OpMode")
+                    log.debug("Detected Opmode Request in FDC Mode, switching to OpMode")
                     self.fdc_mode = False
-                    self.__handle_op_mode_request()
+                    await self.__handle_op_mode_request()
 
             case b"M":
                 # apparently not used by brother knitting machine
-                print("FDC Change Modes")
+                log.warning("FDC Change Modes")
                 raise ValueError()
                 # following parameter - 0=FDC, 1=Operating
 
             case b"D":
                 # apparently not used by brother knitting machine
-                print("FDC Check Device")
+                log.warning("FDC Check Device")
                 raise ValueError()
                 # Sends result in third and fourth bytes of result code
                 # See doc - return zero for disk installed and not swapped
 
             case b"F" | b"G":
-                self.__format(with_check=cmd == b"G")
+                await self.__format(with_check=cmd == b"G")
 
             case b"A":
-                self.__read_id_section()
+                await self.__read_id_section()
 
             case b"R":
-                self.__read_logical_sector()
+                await self.__read_logical_sector()
 
             case b"S":
-                self.__search_id_section()
+                await self.__search_id_section()
 
             case b"B" | b"C":
-                self.__write_id_section(with_check=cmd == b"B")
+                await self.__write_id_section(with_check=cmd == b"B")
 
             case b"W" | b"X":
-                self.__write_logical_sector(with_check=cmd == b"W")
+                await self.__write_logical_sector(with_check=cmd == b"W")
 
             case _:
-                print(f"Unknown FDC command {cmd} received")
+                log.warning("Unknown FDC command %r received", cmd)
 
         # return to Operational Mode
         return
 
-    def __format(self, with_check=False) -> None:
-        print("FDC Format")
-        info = self.__read_fdd_request()
+    async def __format(self, with_check=False) -> None:
+        info = await self.__read_fdd_request()
 
         if len(info) != 1:
-            print(
-                f"wrong number of params ({len(info)}) received, assuming 1024 bytes per sector"
+            log.warning(
+                "wrong number of params (%d) received, assuming 1024 bytes per sector", len(info)
             )
             bps = 1024
         else:
             try:
                 bps = FORMAT_LENGTH[info[0]]
             except KeyError:
-                print(
-                    f"Invalid code {info[0]} for format, assuming 1024 bytes per sector"
-                )
+                log.warning("Invalid code %r for format, assuming 1024 bytes per sector", info[0])
                 bps = 1024
         # we assume 1024 because that's what the brother machine uses
         if self.bpls != bps:
-            print("Bad news, differing sector sizes")
+            log.warning("Bad news, differing sector sizes")
             self.bpls = bps
+        if self.tracer is not None:
+            self.tracer.parsed(0)
 
-        print(f"Formatting disk, {bps}")
+        log.info("Formatting disk, %d bytes per sector", bps)
         self.disk.format()
-        print("Format complete, replying")
+        if self.tracer is not None:
+            self.tracer.disk_done()
+        log.debug("Format complete, replying")
 
         # But this is probably more correct
         if with_check:
-            self.serial.write_bytes(b"00000000")
+            self.transport.write_bytes(b"00000000")
         else:
-            self.serial.write_bytes(b"000000FF")
+            self.transport.write_bytes(b"000000FF")
 
-        more = self.serial.read_char()
+        more = await self.transport.read_char()
         if more:
-            self.__handle_fdc_mode_request(more)
+            await self.__handle_fdc_mode_request(more)
 
         # After a format, we always start out with OPMode again
         self.fdc_mode = False
 
-    def __read_id_section(self) -> None:
+    async def __read_id_section(self) -> None:
         # Followed by physical sector number (0-79), defaults to 0
         # returns ID data, not sector data
-        info = self.__read_fdd_request()
+        info = await self.__read_fdd_request()
         physical_sector, _ = SerialConnection.get_physical_logical_sector_numbers(info)
-        print(f"FDC Read ID Section {physical_sector}")
+        if self.tracer is not None:
+            self.tracer.parsed(physical_sector)
+        log.debug("FDC Read ID Section %d", physical_sector)
 
         try:
             sector_id = self.disk.get_sector_id(physical_sector)
         except:
-            print(f"Error getting Sector ID {physical_sector}, quitting")
-            self.serial.write_bytes(b"80000000")
+            log.error("Error getting Sector ID %d, quitting", physical_sector)
+            self.transport.write_bytes(b"80000000")
             raise
+        if self.tracer is not None:
+            self.tracer.disk_done()
 
         resp = b"00" + b"%02X" % physical_sector + b"0000"
         # resp = b"0000" + b"%02X" % physical_sector + b"00"
-        print(resp)
-        self.serial.write_bytes(resp)
+        log.debug("Status %r", resp)
+        self.transport.write_bytes(resp)
 
         # see whether to send data
-        go = self.serial.read_char()
+        go = await self.transport.read_char()
         if go == b"\r":
-            self.serial.write_bytes(sector_id)
+            self.transport.write_bytes(sector_id)
 
-    def __read_logical_sector(self) -> None:
+    async def __read_logical_sector(self) -> None:
         # Followed by Physical Sector Number and Logical Sector Number
-        info = self.__read_fdd_request()
+        info = await self.__read_fdd_request()
         physical_sector, logical_sector = (
             SerialConnection.get_physical_logical_sector_numbers(info)
         )
-        print(f"FDC Read one Logical Sector {physical_sector}")
+        if self.tracer is not None:
+            self.tracer.parsed(physical_sector)
+        log.debug("FDC Read one Logical Sector %d", physical_sector)
 
         try:
             sd = self.disk.read_sector(physical_sector, logical_sector)
         except:
-            print(f"Failed to read Sector {physical_sector}, quitting")
-            self.serial.write_bytes(b"80000000")
+            log.error("Failed to read Sector %d, quitting", physical_sector)
+            self.transport.write_bytes(b"80000000")
             raise
+        if self.tracer is not None:
+            self.tracer.disk_done()
 
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
 
         # see whether to send data
-        go = self.serial.read_char()
+        go = await self.transport.read_char()
         if go == b"\r":
-            self.serial.write_bytes(sd)
+            self.transport.write_bytes(sd)
 
-    def __search_id_section(self) -> None:
+    async def __search_id_section(self) -> None:
         # We receive (optionally) physical sector number, (optionally) logical sector number
         # This is not documented well at all in the manual
         # What is expected is that all sectors will be searched
@@ -280,28 +326,32 @@ class PDDemulator:
         # will be returned. The brother machine always sends
         # physical sector = 0, so it is unknown whether searching should
         # start at Sector 0 or at the physical sector
-        info = self.__read_fdd_request()
+        info = await self.__read_fdd_request()
         physical_sector, _ = SerialConnection.get_physical_logical_sector_numbers(info)
-        print(f"FDC Search ID Section {physical_sector}")
+        if self.tracer is not None:
+            self.tracer.parsed(physical_sector)
+        log.debug("FDC Search ID Section %d", physical_sector)
 
         # Now we must send status (success)
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
 
-        # self.serial.writebytes(b'00000000')
+        # self.transport.writebytes(b'00000000')
 
         # we receive 12 bytes here
         # compare with the specified sector (formatted is apparently zeros)
-        sector_id = self.serial.read_some_chars(12)
-        print(f"checking ID for sector {physical_sector}")
+        sector_id = await self.transport.read_exact(12)
+        log.debug("checking ID for sector %d", physical_sector)
 
         try:
             status = self.disk.find_sector_id(physical_sector, sector_id)
         except:
-            print("FAIL")
+            log.error("Search for the ID of sector %d failed", physical_sector)
             status = "30000000"
             raise
+        if self.tracer is not None:
+            self.tracer.disk_done()
 
-        print(f"returning {status}")
+        log.debug("returning %r", status)
         # guessing - doc is unclear, but says that S always ends in 0000
         # MATCH 00000000
         # MATCH 02000000
@@ -314,58 +364,125 @@ class PDDemulator:
         # infinite retries 70000000
         # infinite retries 80000000
 
-        self.serial.write_bytes(status)
+        self.transport.write_bytes(status)
 
         # Stay in FDC mode
 
-    def __write_id_section(self, with_check=False) -> None: # pylint: disable=unused-argument
+    async def __write_id_section(self, with_check=False) -> None: # pylint: disable=unused-argument
         # Followed by physical sector number 0-79, defaults to 0
         # When received, send result status, if not error, wait
         # for data to be written, then after write, send status again
-        info = self.__read_fdd_request()
+        info = await self.__read_fdd_request()
         physical_sector, logical_sector = (
             SerialConnection.get_physical_logical_sector_numbers(info)
         )
-        print(
-            f"FDC Write ID section {physical_sector}, logical sector {logical_sector}"
-        )
+        if self.tracer is not None:
+            self.tracer.parsed(physical_sector)
+        log.debug("FDC Write ID section %d, logical sector %d", physical_sector, logical_sector)
 
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
 
-        sector_id = self.serial.read_some_chars(12)
+        sector_id = await self.transport.read_exact(12)
 
         try:
             self.disk.set_sector_id(physical_sector, sector_id)
         except:
-            print(f"Failed to write ID for sector {physical_sector}, quitting")
-            self.serial.write_bytes(b"80000000")
+            log.error("Failed to write ID for sector %d, quitting", physical_sector)
+            self.transport.write_bytes(b"80000000")
             raise
+        if self.tracer is not None:
+            self.tracer.disk_done()
 
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
 
-        more = self.serial.read_char()
+        more = await self.transport.read_char()
         if more:
-            self.__handle_fdc_mode_request(more)
+            await self.__handle_fdc_mode_request(more)
 
-    def __write_logical_sector(self, with_check=False) -> None: # pylint: disable=unused-argument
-        info = self.__read_fdd_request()
+    async def __write_logical_sector(self, with_check=False) -> None: # pylint: disable=unused-argument
+        info = await self.__read_fdd_request()
         physical_sector, logical_sector = (
             SerialConnection.get_physical_logical_sector_numbers(info)
         )
-        print(f"FDC Write logical sector {physical_sector}")
+        if self.tracer is not None:
+            self.tracer.parsed(physical_sector)
+        log.debug("FDC Write logical sector %d", physical_sector)
 
         # Now we must send status (success)
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
 
-        indata = self.serial.read_some_chars(1024)
+        indata = await self.transport.read_exact(1024)
         try:
             self.disk.write_sector(physical_sector, logical_sector, indata)
-            for l in self.listeners:
-                l.dataReceived(self.disk.last_dat_file_path)
-            print("Saved data in dat file: ", self.disk.last_dat_file_path)
         except:
-            print(f"Failed to write data for sector {physical_sector}, quitting")
-            self.serial.write_bytes(b"80000000")
+            log.error("Failed to write data for sector %d, quitting", physical_sector)
+            self.transport.write_bytes(b"80000000")
             raise
+        if self.tracer is not None:
+            self.tracer.disk_done()
+
+        self.transport.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+
+        # the machine has its answer, now make sure the track file is
+        # complete before telling anyone about it
+        if physical_sector % 2:
+            self.disk.flush_tracks()
+            for l in self.listeners:
+                l.data_received(self.disk.last_dat_file_path)
+            log.info("Saved data in dat file: %s", self.disk.last_dat_file_path)
+
 
-        self.serial.write_bytes(b"00" + b"%02X" % physical_sector + b"0000")
+def run_blocking(coro: Coroutine):
+    """
+    Run a coroutine to completion without an event loop. Only valid when
+    nothing it awaits ever suspends, as with a BlockingTransport.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError("blocking transport suspended, use an event loop")
+
+
+class PDDemulator:
+    """Blocking front end to AsyncPDDemulator, for callers without an event loop"""
+    serial: SerialConnection | None
+    engine: AsyncPDDemulator
+
+    def __init__(self, basename, deferred_tracks=False, tracer: Tracer | None = None,
+                 **disk_options):
+        self.engine = AsyncPDDemulator(
+            basename, deferred_tracks=deferred_tracks, tracer=tracer, **disk_options
+        )
+        self.serial = None
+
+    @property
+    def disk(self) -> Disk | DiskImage:
+        return self.engine.disk
+
+    @property
+    def listeners(self) -> list[PDDEmulatorListener]:
+        return self.engine.listeners
+
+    def open(self, cport="/dev/ttyUSB0") -> None:
+        self.attach(SerialConnection(cport))
+
+    def attach(self, connection: SerialConnection) -> None:
+        """Serve an already open connection (or anything that reads like one)"""
+        self.serial = connection
+        self.engine.transport = BlockingTransport(connection)
+
+    def is_open(self) -> bool:
+        return self.serial is not None
+
+    def close(self) -> None:
+        self.engine.close()
+        self.serial = None
+
+    def handle_requests(self):  # never returns
+        while True:
+            self.handle_request()
+
+    def handle_request(self) -> None:
+        run_blocking(self.engine.handle_request())
@@ -0,0 +1,90 @@
+"""
+Write-ahead journal for a sector directory disk.
+
+Every sector and ID write is appended to one file before the sector
+files are touched, and a commit record closes each finished upload (a
+track's odd sector, or a format). After a crash the committed records
+are replayed into the sector files and anything after the last commit
+is dropped, so a track is either wholly the old one or wholly the new.
+
+Records are a header of kind, sector, payload length and the CRC-32 of
+all three plus the payload, then the payload. A torn or corrupt record
+ends the journal.
+"""
+
+import os
+import struct
+import zlib
+
+# record kinds
+DATA = 1
+ID = 2
+FORMAT = 3
+COMMIT = 4
+
+HEADER = struct.Struct("<BBHI")
+
+JOURNAL_NAME = "journal"
+# the journal is folded into the sector files once it grows past this
+CHECKPOINT_BYTES = 256 * 1024
+
+
+def _checksum(kind: int, psn: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(bytes([kind, psn])))
+
+
+class Journal:
+    def __init__(self, path: str, fsync: bool = True) -> None:
+        self.path = path
+        self.fsync = fsync
+        self.__file = open(path, "ab")  # pylint: disable=consider-using-with
+
+    @property
+    def size(self) -> int:
+        return self.__file.tell()
+
+    def recover(self) -> list[tuple[int, int, bytes]]:
+        """(kind, psn, payload) of every committed record, in order"""
+        with open(self.path, "rb") as f:
+            data = f.read()
+        committed: list[tuple[int, int, bytes]] = []
+        pending: list[tuple[int, int, bytes]] = []
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            kind, psn, length, crc = HEADER.unpack_from(data, offset)
+            payload = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(payload) != length or _checksum(kind, psn, payload) != crc:
+                break
+            offset += HEADER.size + length
+            if kind == COMMIT:
+                committed.extend(pending)
+                pending.clear()
+            else:
+                pending.append((kind, psn, payload))
+        if pending or offset != len(data):
+            print(
+                f"Journal <{self.path}>: dropped {len(pending)} uncommitted records" +
+                f" and {len(data) - offset} bytes after the last good record"
+            )
+        return committed
+
+    def append(self, kind: int, psn: int, payload: bytes = b"") -> None:
+        self.__file.write(HEADER.pack(kind, psn, len(payload), _checksum(kind, psn, payload)))
+        self.__file.write(payload)
+
+    def commit(self) -> None:
+        """Close the records so far as one unit and make them durable"""
+        self.append(COMMIT, 0)
+        self.__file.flush()
+        if self.fsync:
+            os.fsync(self.__file.fileno())
+
+    def truncate(self) -> None:
+        """Everything journaled has reached the sector files, start afresh"""
+        self.__file.truncate(0)
+        self.__file.seek(0)
+        if self.fsync:
+            os.fsync(self.__file.fileno())
+
+    def close(self) -> None:
+        self.__file.close()
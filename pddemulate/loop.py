@@ -0,0 +1,39 @@
+import asyncio
+import concurrent.futures
+import threading
+from collections.abc import Coroutine
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a daemon thread, for programs (like
+    the Tk app) whose main thread is already taken by another loop.
+    """
+
+    def __init__(self, name: str = "pddemulate-loop") -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.thread.start()
+
+    def __run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop, returns a thread safe future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, fn, *args) -> None:
+        """Run a plain function on the loop thread"""
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def run(self, coro: Coroutine, timeout: float | None = None):
+        """Run a coroutine on the loop and wait for its result"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self) -> None:
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
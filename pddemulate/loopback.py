@@ -0,0 +1,208 @@
+"""
+Stand-ins for the serial port, for exercising the emulator without a
+knitting machine attached.
+
+LoopbackConnection is a drop-in for SerialConnection: the "machine" side
+feeds it bytes and collects whatever the emulator writes back.
+RecordingConnection wraps a real connection and logs every byte that
+crosses it, and SessionPlayer replays such a log against an emulator.
+The disk the session started from is saved next to the log as an image,
+so that a replay reading the disk gets the answers the machine got.
+"""
+
+import json
+import os
+import shutil
+import time
+
+from pddemulate.disk_image import IMAGE_SUFFIX, save_image
+from pddemulate.serial import RingBuffer
+
+
+def starting_disk_path(session_path: str) -> str:
+    """Where the disk a recorded session started from is kept"""
+    return os.path.splitext(session_path)[0] + IMAGE_SUFFIX
+
+
+class LoopbackExhausted(EOFError):
+    """The emulator wanted more bytes than the machine side has fed it"""
+
+
+class LoopbackConnection:
+    def __init__(self) -> None:
+        self.buffer = RingBuffer()
+        self.output = bytearray()
+
+    # the machine's side
+
+    def feed(self, data: bytes) -> None:
+        self.buffer.write(data)
+
+    def take(self) -> bytes:
+        """Everything the emulator has written since the last take"""
+        out = bytes(self.output)
+        self.output.clear()
+        return out
+
+    def pending(self) -> int:
+        """Bytes fed but not yet read by the emulator"""
+        return len(self.buffer)
+
+    # the emulator's side, as SerialConnection
+
+    def close(self) -> None:
+        self.buffer.clear()
+
+    def dump_chars(self) -> None:
+        self.buffer.clear()
+
+    def read(self) -> bytes:
+        return self.read_exact(1)
+
+    def read_exact(self, num: int) -> bytes:
+        if len(self.buffer) < num:
+            raise LoopbackExhausted(f"wanted {num} bytes, {len(self.buffer)} fed")
+        return self.buffer.read(num)
+
+    def read_until(self, terminator: bytes = b"\r") -> bytes:
+        idx = self.buffer.find(terminator[0])
+        if idx < 0:
+            raise LoopbackExhausted(f"no {terminator!r} in {len(self.buffer)} bytes fed")
+        return self.buffer.read(idx + 1)
+
+    def read_some_chars(self, num: int) -> bytes:
+        return self.read_exact(num)
+
+    def read_char(self) -> bytes:
+        return self.read_exact(1)
+
+    def write_bytes(self, b: bytes) -> None:
+        self.output += b
+
+
+class RecordingConnection:
+    """
+    Wraps a connection and writes each read and write to a JSON Lines
+    session log: {"t": seconds since start, "dir": "in"|"out", "data": hex}
+    Given the disk being served, its state is saved first, see
+    starting_disk_path.
+    """
+
+    def __init__(self, connection, path: str, disk=None) -> None:
+        if disk is not None:
+            save_image(disk, starting_disk_path(path))
+        self.connection = connection
+        self.log = open(path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.start = time.monotonic()
+
+    def __record(self, direction: str, data: bytes) -> bytes:
+        self.log.write(json.dumps({
+            "t": round(time.monotonic() - self.start, 6),
+            "dir": direction,
+            "data": data.hex(),
+        }) + "\n")
+        return data
+
+    def close(self) -> None:
+        self.log.close()
+        self.connection.close()
+
+    def dump_chars(self) -> None:
+        self.connection.dump_chars()
+
+    def read(self) -> bytes:
+        return self.read_exact(1)
+
+    def read_exact(self, num: int) -> bytes:
+        return self.__record("in", self.connection.read_exact(num))
+
+    def read_until(self, terminator: bytes = b"\r") -> bytes:
+        return self.__record("in", self.connection.read_until(terminator))
+
+    def read_some_chars(self, num: int) -> bytes:
+        return self.read_exact(num)
+
+    def read_char(self) -> bytes:
+        return self.read_exact(1)
+
+    def write_bytes(self, b: bytes) -> None:
+        self.connection.write_bytes(b)
+        self.__record("out", bytes(b))
+
+
+class ReplayResult:  # pylint: disable=too-few-public-methods
+    requests: int
+    expected: bytes
+    actual: bytes
+
+    def __init__(self, requests: int, expected: bytes, actual: bytes) -> None:
+        self.requests = requests
+        self.expected = expected
+        self.actual = actual
+
+    @property
+    def matched(self) -> bool:
+        return self.expected == self.actual
+
+    @property
+    def first_difference(self) -> int | None:
+        """Offset of the first byte the emulator got wrong, if any"""
+        if self.matched:
+            return None
+        for i, (e, a) in enumerate(zip(self.expected, self.actual)):
+            if e != a:
+                return i
+        return min(len(self.expected), len(self.actual))
+
+
+class SessionPlayer:
+    """
+    Replays the machine's side of a recorded session against an emulator.
+    disk_path is the image of the disk the session started from, by
+    default the one saved next to the log, if any.
+    """
+
+    def __init__(self, path: str, disk_path: str | None = None) -> None:
+        if disk_path is None and os.path.exists(starting_disk_path(path)):
+            disk_path = starting_disk_path(path)
+        self.disk_path = disk_path
+        self.incoming = bytearray()
+        self.outgoing = bytearray()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                data = bytes.fromhex(record["data"])
+                if record["dir"] == "in":
+                    self.incoming += data
+                else:
+                    self.outgoing += data
+
+    def replay_disk(self, dirpath: str) -> str:
+        """
+        A disk in dirpath to replay on: a copy of the starting disk, or
+        a path for a new blank image when none was recorded.
+        """
+        path = os.path.join(dirpath, "replay" + IMAGE_SUFFIX)
+        if self.disk_path is None:
+            print("No starting disk recorded, replaying against a blank disk")
+        else:
+            shutil.copyfile(self.disk_path, path)
+        return path
+
+    def replay(self, emulator) -> ReplayResult:
+        """
+        emulator is a PDDemulator, it is attached to a loopback connection
+        and run until the recorded input has all been consumed.
+        """
+        connection = LoopbackConnection()
+        connection.feed(bytes(self.incoming))
+        emulator.attach(connection)
+        requests = 0
+        try:
+            while connection.pending():
+                emulator.handle_request()
+                requests += 1
+        except LoopbackExhausted:
+            # the recording stopped part way through a command
+            pass
+        return ReplayResult(requests, bytes(self.outgoing), connection.take())
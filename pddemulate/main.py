@@ -2,28 +2,84 @@
 
 # meat and potatos here
 
+import logging
+import signal
 import sys
+from pddemulate.disk import WRITE_POLICIES, make_write_policy
 from pddemulate.drive import PDDemulator
+from pddemulate.loopback import RecordingConnection
+from pddemulate.metrics import DriveMetrics, MetricsServer
+from pddemulate.serial import SerialConnection
+from pddemulate.trace import Tracer, configure_logging
 
 VERSION = "2.0"
 
+OPTIONS = ("--record", "--write-policy", "--trace", "--metrics")
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
+    args = sys.argv[1:]
+    flags = {flag for flag in ("--journal", "--auto-snapshot", "--verbose") if flag in args}
+    for flag in flags:
+        args.remove(flag)
+    options = {}
+    while len(args) > 2 and args[-2] in OPTIONS:
+        options[args[-2]] = args[-1]
+        args = args[:-2]
+    if len(args) != 2:
         print(f"{sys.argv[0]} version {VERSION}")
-        print(f"Usage: {sys.argv[0]} basedir serialdevice")
+        print(
+            f"Usage: {sys.argv[0]} basedir|image.img serialdevice " +
+            f"[--record session.jsonl] [--write-policy {'|'.join(WRITE_POLICIES)}] " +
+            "[--journal] [--auto-snapshot] [--verbose] [--trace trace.log] " +
+            "[--metrics port]"
+        )
         sys.exit()
 
+    configure_logging(verbose="--verbose" in flags)
     print("Preparing . . . Please Wait")
-    emu = PDDemulator(sys.argv[1])
-
-    emu.open(cport=sys.argv[2])
+    tracer = None
+    if "--trace" in options or "--metrics" in options:
+        tracer = Tracer(dump_path=options.get("--trace"))
+    if "--trace" in options:
+        # dumped to the file when a command fails, or on SIGUSR1
+        tracer.install(logging.DEBUG if "--verbose" in flags else logging.INFO)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: tracer.dump())
+    metrics = None
+    if "--metrics" in options:
+        metrics = MetricsServer(int(options["--metrics"]))
+        metrics.add(DriveMetrics(args[1], tracer))
+        metrics.start()
+        print(f"Metrics on http://localhost:{metrics.port}/metrics")
+    policy = None
+    if "--write-policy" in options:
+        policy = make_write_policy(options["--write-policy"])
+    emu = PDDemulator(
+        args[0],
+        tracer=tracer,
+        write_policy=policy,
+        journaled="--journal" in flags,
+        auto_snapshot="--auto-snapshot" in flags,
+    )
 
-    print("Emulator Ready!")
+    # whatever stops the emulator, the disk is closed: pending writes
+    # are flushed and the directory lock released
     try:
+        if "--record" in options:
+            emu.attach(
+                RecordingConnection(SerialConnection(args[1]), options["--record"], emu.disk)
+            )
+        else:
+            emu.open(cport=args[1])
+
+        print("Emulator Ready!")
         while True:
             emu.handle_requests()
     except KeyboardInterrupt:
         pass
-
-    emu.close()
+    finally:
+        emu.close()
+        emu.disk.close()
+        if metrics is not None:
+            metrics.stop()
@@ -0,0 +1,260 @@
+"""
+Prometheus metrics for running emulators, served over local HTTP.
+
+Each drive's emulator gets a Tracer (see pddemulate.trace) and a
+DriveMetrics observing it, which only bumps a few counters as each
+command finishes. A MetricsServer renders every registered drive on
+GET /metrics from a daemon thread, reading those counters as they stand,
+so scraping never waits on or blocks the protocol loop.
+
+    pddemulate_commands_total{drive,opcode}
+    pddemulate_command_seconds{drive,opcode}  histogram of time spent
+                                              answering, without waiting
+                                              on the machine
+    pddemulate_sector_reads_total{drive}
+    pddemulate_sector_writes_total{drive}
+    pddemulate_formats_total{drive}
+    pddemulate_seconds_since_last_request{drive}
+    pddemulate_serial_reconnects_total{drive}
+    pddemulate_listener_queue_bytes{drive}    events not yet taken by the
+                                              parent of a DiskProcess,
+                                              where the OS can tell
+    pddemulate_bytes_received_total{drive}, pddemulate_bytes_sent_total,
+    pddemulate_checksum_mismatches_total, pddemulate_errors_total
+"""
+
+import bisect
+import struct
+import threading
+import time
+from collections.abc import Iterable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from pddemulate.trace import Span, Tracer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+
+SECTOR_READS = {"R"}
+SECTOR_WRITES = {"W", "X"}
+FORMATS = {"F", "G"}
+
+
+def pending_bytes(fd: int) -> int | None:
+    """
+    Bytes written to a pipe and not yet read, from either end. None
+    where that can't be asked (Windows).
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        import fcntl
+        import termios
+    except ImportError:
+        return None
+    return struct.unpack("i", fcntl.ioctl(fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class DriveMetrics:  # pylint: disable=too-many-instance-attributes
+    """
+    Counters for one drive, fed by its tracer. drive is the label the
+    metrics carry, normally the serial port, and may change while
+    running. queue_depth, if given, reports the listener queue.
+    """
+
+    def __init__(
+            self,
+            drive: str,
+            tracer: Tracer,
+            queue_depth: Callable[[], int | None] | None = None,
+        ) -> None:
+        self.drive = drive
+        self.tracer = tracer
+        self.queue_depth = queue_depth
+        self.started = time.perf_counter()
+        self.last_request: float | None = None
+        self.commands: dict[str, int] = {}
+        # per opcode, counts per bucket (not cumulative) with +Inf last
+        self.buckets: dict[str, list[int]] = {}
+        self.seconds: dict[str, float] = {}
+        self.sector_reads = 0
+        self.sector_writes = 0
+        self.formats = 0
+        tracer.observers.append(self.observe)
+
+    def observe(self, span: Span) -> None:
+        """Called on the protocol loop as each command finishes, keep it cheap"""
+        opcode = span.command
+        busy = span.busy
+        self.last_request = span.started
+        self.commands[opcode] = self.commands.get(opcode, 0) + 1
+        buckets = self.buckets.get(opcode)
+        if buckets is None:
+            buckets = self.buckets[opcode] = [0] * (len(LATENCY_BUCKETS) + 1)
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, busy)] += 1
+        self.seconds[opcode] = self.seconds.get(opcode, 0.0) + busy
+        if opcode in SECTOR_READS:
+            self.sector_reads += 1
+        elif opcode in SECTOR_WRITES:
+            self.sector_writes += 1
+        elif opcode in FORMATS:
+            self.formats += 1
+
+    def since_last_request(self) -> float:
+        """Seconds since the last command, or since starting if none came yet"""
+        return time.perf_counter() - (self.last_request or self.started)
+
+    def samples(self) -> dict[str, list[tuple[str, float]]]:
+        """(labels, value) per metric name, read without stopping the loop"""
+        drive = self.drive
+        counters = self.tracer.counters()
+        out: dict[str, list[tuple[str, float]]] = {
+            "pddemulate_commands_total": [],
+            "pddemulate_command_seconds_bucket": [],
+            "pddemulate_command_seconds_sum": [],
+            "pddemulate_command_seconds_count": [],
+        }
+        # copies, the loop may add an opcode while we go
+        for opcode, count in sorted(dict(self.commands).items()):
+            out["pddemulate_commands_total"].append((_labels(drive=drive, opcode=opcode), count))
+        for opcode, buckets in sorted(dict(self.buckets).items()):
+            buckets = list(buckets)
+            total = 0
+            for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+                total += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out["pddemulate_command_seconds_bucket"].append(
+                    (_labels(drive=drive, opcode=opcode, le=le), total)
+                )
+            labels = _labels(drive=drive, opcode=opcode)
+            out["pddemulate_command_seconds_sum"].append((labels, self.seconds.get(opcode, 0.0)))
+            out["pddemulate_command_seconds_count"].append((labels, total))
+        labels = _labels(drive=drive)
+        out.update({
+            "pddemulate_sector_reads_total": [(labels, self.sector_reads)],
+            "pddemulate_sector_writes_total": [(labels, self.sector_writes)],
+            "pddemulate_formats_total": [(labels, self.formats)],
+            "pddemulate_seconds_since_last_request": [(labels, self.since_last_request())],
+            "pddemulate_serial_reconnects_total": [
+                (labels, max(0, counters["connections"] - 1))
+            ],
+            "pddemulate_bytes_received_total": [(labels, counters["bytes_in"])],
+            "pddemulate_bytes_sent_total": [(labels, counters["bytes_out"])],
+            "pddemulate_checksum_mismatches_total": [(labels, counters["checksum_mismatches"])],
+            "pddemulate_errors_total": [(labels, counters["errors"])],
+        })
+        depth = None if self.queue_depth is None else self.queue_depth()
+        if depth is not None:
+            out["pddemulate_listener_queue_bytes"] = [(labels, depth)]
+        return out
+
+
+# name: (type, help), histograms are described once under their base name
+FAMILIES = {
+    "pddemulate_commands_total": ("counter", "Commands handled, by opcode"),
+    "pddemulate_command_seconds": (
+        "histogram", "Time spent answering a command, not counting waits on the machine"
+    ),
+    "pddemulate_sector_reads_total": ("counter", "Sectors read by the machine"),
+    "pddemulate_sector_writes_total": ("counter", "Sectors written by the machine"),
+    "pddemulate_formats_total": ("counter", "Disk formats requested by the machine"),
+    "pddemulate_seconds_since_last_request": ("gauge", "Seconds since the last command"),
+    "pddemulate_serial_reconnects_total": ("counter", "Serial port reopened after the first"),
+    "pddemulate_bytes_received_total": ("counter", "Bytes read from the machine"),
+    "pddemulate_bytes_sent_total": ("counter", "Bytes written to the machine"),
+    "pddemulate_checksum_mismatches_total": ("counter", "OpMode requests with a bad checksum"),
+    "pddemulate_errors_total": ("counter", "Commands that failed"),
+    "pddemulate_listener_queue_bytes": ("gauge", "Events waiting to be taken by listeners"),
+}
+
+
+def render(drives: Iterable[DriveMetrics]) -> str:
+    """All drives in the Prometheus text exposition format"""
+    merged: dict[str, list[tuple[str, float]]] = {}
+    for drive in drives:
+        for name, samples in drive.samples().items():
+            merged.setdefault(name, []).extend(samples)
+    lines = []
+    described = set()
+    for name, samples in merged.items():
+        family = name
+        if family not in FAMILIES:
+            family = name.rsplit("_", 1)[0]
+        if family not in described:
+            described.add(family)
+            kind, description = FAMILIES[family]
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server: "MetricsHTTPServer"
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(
+            drive for source in list(self.server.sources) for drive in source()
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        # scrapes come every few seconds, keep them off the terminal
+        pass
+
+
+class MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    sources: list[Callable[[], Iterable[DriveMetrics]]]
+
+
+class MetricsServer:
+    """
+    GET /metrics on host:port for the added drives, on a daemon thread.
+    Binds to localhost unless told otherwise. A source is asked for its
+    drives on every scrape, so drives it gains later are reported too.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1") -> None:
+        self.httpd = MetricsHTTPServer((host, port), MetricsHandler)
+        self.httpd.sources = []
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="pddemulate-metrics", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def add(self, drive: DriveMetrics) -> None:
+        self.httpd.sources.append(lambda: [drive])
+
+    def add_source(self, source: Callable[[], Iterable[DriveMetrics]]) -> None:
+        self.httpd.sources.append(source)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,95 +1,337 @@
-from multiprocessing import Process, Queue
-from queue import Empty
-from typing import Callable
+"""
+Run an emulated drive in its own process.
+
+The parent sends commands down a control pipe and hears back through
+an event pipe. On POSIX both are plain file descriptors: the worker's
+event loop sleeps until either the machine or the parent has something
+to say, and the parent can select on DiskProcess.fileno() rather than
+polling. Windows pipes can't be watched by the loop, there a thread in
+the worker waits for commands and the parent polls process_events().
+
+Commands are tuples of (command, *arguments), events are tuples of
+(event, payload). A worker that has died is replaced by a new process,
+on the disk it last had, by the next command sent to it. Given a
+metrics_port, the worker also serves Prometheus metrics for its drive,
+see pddemulate.metrics.
+"""
+
+import asyncio
+import threading
+import time
 import weakref
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from typing import Any, Callable
 
-from pddemulate.drive import PDDemulator
+from pddemulate.disk_image import open_disk
+from pddemulate.drive import AsyncPDDemulator
 from pddemulate.listener import PDDEmulatorListener
+from pddemulate.metrics import DriveMetrics, MetricsServer, pending_bytes
+from pddemulate.trace import Tracer
 
+# commands
+OPEN = "open"  # port, time.time() when sent
+CLOSE = "close"
+FORMAT = "format"
+SWAP = "swap"  # imgdir
+STATS = "stats"
+SHUTDOWN = "shutdown"
 
-def run_disk(port: Queue, responses: Queue, imgdir: str) -> None:
-    emu = PDDemulator(imgdir)
-    emu.listeners.append(DiskProcessListener(responses))
-    device = None
-    changed = False
-    while True:
-        try:
-            new_port = port.get(block=False)
-            if new_port != device:
-                print(f"swapping port from {device} to {new_port}")
-                changed = True
-            else:
-                changed = False
-            if new_port is not None:
-                device = new_port
-        except Empty:
-            changed = False
-        if changed:
-            if emu.isOpen():
-                emu.close()
-            emu.open(device)
-        if device is not None:
-            emu.handle_request()
-        else:
-            emu.close()
-
-
-class DiskProcessListener(PDDEmulatorListener): # pylint: disable=too-few-public-methods
-    queue: Queue
-
-    def __init__(self, queue: Queue) -> None:
-        self.queue = queue
+# events
+DATA_RECEIVED = "data_received"  # path of the track file written
+PORT_OPENED = "port_opened"  # (port, seconds from sending the command to open port)
+PORT_CLOSED = "port_closed"  # port
+FORMATTED = "formatted"
+SWAPPED = "swapped"  # imgdir
+STATS_REPORT = "stats"  # dict
+ERROR = "error"  # message
+
+
+class DiskProcessListener(PDDEmulatorListener):  # pylint: disable=too-few-public-methods
+    events: Connection
+
+    def __init__(self, events: Connection) -> None:
+        self.events = events
 
     def data_received(self, full_file_path: str):
-        self.queue.put(full_file_path)
+        self.events.send((DATA_RECEIVED, full_file_path))
+
+
+class DiskWorker:  # pylint: disable=too-many-instance-attributes
+    """The child side: an emulator plus the handlers for each command"""
+
+    def __init__(
+            self,
+            control: Connection,
+            events: Connection,
+            imgdir: str,
+            metrics_port: int | None = None,
+        ) -> None:
+        self.control = control
+        self.events = events
+        self.imgdir = imgdir
+        self.tracer = Tracer()
+        self.emu = AsyncPDDemulator(imgdir, tracer=self.tracer)
+        self.emu.listeners.append(DiskProcessListener(events))
+        self.port: str | None = None
+        self.task: asyncio.Task | None = None
+        self.done: asyncio.Future | None = None
+        self.started = time.monotonic()
+        self.opens = 0
+        self.errors = 0
+        self.last_switch_latency: float | None = None
+        self.handlers: dict[str, Callable[..., None]] = {
+            OPEN: self.open,
+            CLOSE: self.close,
+            FORMAT: self.format,
+            SWAP: self.swap,
+            STATS: self.stats,
+            SHUTDOWN: self.shutdown,
+        }
+        # the listener queue is the event pipe, whatever the parent has yet to read
+        self.metrics = DriveMetrics(
+            imgdir, self.tracer, queue_depth=lambda: pending_bytes(events.fileno())
+        )
+        self.metrics_server: MetricsServer | None = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(metrics_port)
+            self.metrics_server.add(self.metrics)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        try:
+            loop.add_reader(self.control.fileno(), self.__command_ready)
+            watching = True
+        except NotImplementedError:
+            watching = False
+            threading.Thread(
+                target=self.__receive_commands, args=[loop], name="disk-commands", daemon=True
+            ).start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        try:
+            await self.done
+        finally:
+            if watching:
+                loop.remove_reader(self.control.fileno())
+            self.__stop_serving()
+            self.emu.disk.close()
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+
+    def __command_ready(self) -> None:
+        while self.control.poll():
+            try:
+                message = self.control.recv()
+            except EOFError:
+                # the parent has gone, nobody left to serve
+                self.shutdown()
+                return
+            self.__dispatch(message)
+
+    def __receive_commands(self, loop: asyncio.AbstractEventLoop) -> None:
+        # on a thread, where the loop can't watch the pipe
+        while True:
+            try:
+                message = self.control.recv()
+            except (EOFError, OSError):
+                message = (SHUTDOWN,)
+            try:
+                loop.call_soon_threadsafe(self.__dispatch, message)
+            except RuntimeError:
+                # the loop has finished
+                return
+            if message[0] == SHUTDOWN:
+                return
+
+    def __dispatch(self, message: tuple) -> None:
+        command, *args = message
+        try:
+            self.handlers[command](*args)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.errors += 1
+            self.events.send((ERROR, f"{command} failed: {e!r}"))
+
+    def __stop_serving(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
 
+    async def __serve(self, port: str, sent: float) -> None:
+        try:
+            await self.emu.open(port)
+            self.opens += 1
+            self.last_switch_latency = time.time() - sent
+            self.events.send((PORT_OPENED, (port, self.last_switch_latency)))
+            await self.emu.handle_requests()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.errors += 1
+            self.events.send((ERROR, f"{port}: {e!r}"))
+        finally:
+            self.emu.close()
+            self.events.send((PORT_CLOSED, port))
+
+    def open(self, port: str, sent: float | None = None) -> None:
+        if sent is None:
+            sent = time.time()
+        if port == self.port and self.task is not None:
+            return
+        print(f"swapping port from {self.port} to {port}")
+        self.__stop_serving()
+        self.port = port
+        self.metrics.drive = port
+        self.task = asyncio.get_running_loop().create_task(self.__serve(port, sent))
+
+    def close(self) -> None:
+        self.__stop_serving()
+        self.port = None
+
+    def format(self) -> None:
+        self.emu.disk.format()
+        self.events.send((FORMATTED, None))
+
+    def swap(self, imgdir: str) -> None:
+        disk = open_disk(imgdir)
+        self.emu.disk.close()
+        self.emu.disk = disk
+        self.imgdir = imgdir
+        self.events.send((SWAPPED, imgdir))
+
+    def stats(self) -> None:
+        self.events.send((STATS_REPORT, {
+            "imgdir": self.imgdir,
+            "port": self.port,
+            "serving": self.task is not None and not self.task.done(),
+            "uptime": time.monotonic() - self.started,
+            "opens": self.opens,
+            "errors": self.errors,
+            "last_switch_latency": self.last_switch_latency,
+            "search_hits": self.emu.disk.id_index.hits,
+            "search_misses": self.emu.disk.id_index.misses,
+            "writes": self.emu.disk.write_stats(),
+            "trace": self.tracer.counters(),
+        }))
+
+    def shutdown(self) -> None:
+        if not self.done.done():
+            self.done.set_result(None)
 
-class DiskProcess:
+
+def run_disk(
+        control: Connection, events: Connection, imgdir: str, metrics_port: int | None = None
+    ) -> None:
+    asyncio.run(DiskWorker(control, events, imgdir, metrics_port).run())
+
+
+class DiskProcess:  # pylint: disable=too-many-instance-attributes
     process: Process
-    port_queue: Queue
-    responses: Queue
+    control: Connection
+    events: Connection
     callback: Callable[[str], None]
-    running: False
+    on_event: Callable[[str, Any], None] | None
+    running: bool
+    port: str | None
 
-    def __init__(self, imgdir: str, callback: Callable[[str], None]) -> None:
-        self.port_queue = Queue(10)
-        self.responses = Queue(10)
-        self.process = Process(
-            target=run_disk, args=[self.port_queue, self.responses, imgdir]
-        )
+    def __init__(
+        self,
+        imgdir: str,
+        callback: Callable[[str], None],
+        on_event: Callable[[str, Any], None] | None = None,
+        metrics_port: int | None = None,
+    ) -> None:
+        self.imgdir = imgdir
+        self.metrics_port = metrics_port
         self.callback = callback
+        self.on_event = on_event
         self.running = False
+        self.port = None
+        self.__spawn()
+
+    def __spawn(self) -> None:
+        """A new worker and pipes, started by the first command sent"""
+        child_control, self.control = Pipe(duplex=False)
+        self.events, child_events = Pipe(duplex=False)
+        self.process = Process(
+            target=run_disk,
+            args=[child_control, child_events, self.imgdir, self.metrics_port],
+            daemon=True,
+        )
         self._finalizer = weakref.finalize(
-            self, self.__exit, self.process, self.port_queue, self.responses
+            self, self.__exit, self.process, self.control, self.events
         )
 
     def exit(self) -> None:
         self._finalizer()
 
-    def __exit(self, process: Process, in_queue: Queue, out_queue: Queue) -> None:
+    @staticmethod
+    def __exit(process: Process, control: Connection, events: Connection) -> None:
         print("exit")
-        in_queue.close()
-        out_queue.close()
+        if process.is_alive():
+            try:
+                control.send((SHUTDOWN,))
+            except OSError:
+                pass
+            process.join(2)
         if process.is_alive():
             process.terminate()
-        process.close()
+            process.join()
+        control.close()
+        events.close()
+        if process.exitcode is not None:
+            process.close()
+
+    def __send(self, *command) -> None:
+        if self.process.pid is None:
+            self.process.start()
+        elif not self.process.is_alive():
+            # a Process can only be started once, the dead one is replaced
+            print(f"disk worker for {self.imgdir} died with exit code "
+                  f"{self.process.exitcode}, restarting it")
+            self.process_events()
+            self._finalizer()
+            self.__spawn()
+            self.process.start()
+            if self.running and command[0] != OPEN:
+                self.control.send((OPEN, self.port, time.time()))
+        self.control.send(command)
 
     def start(self, port: str) -> None:
         self.running = True
-        self.port_queue.put(port)
-        if not self.process.is_alive():
-            self.process.start()
+        self.port = port
+        self.__send(OPEN, port, time.time())
 
     def stop(self) -> None:
         if self.running:
             self.running = False
             if self.process.is_alive():
-                self.port_queue.put(None)
+                self.control.send((CLOSE,))
 
-    def queue_check(self) -> None:
-        while True:
+    def format(self) -> None:
+        self.__send(FORMAT)
+
+    def swap(self, imgdir: str) -> None:
+        self.__send(SWAP, imgdir)
+
+    def request_stats(self) -> None:
+        """The answer arrives later as a STATS_REPORT event"""
+        self.__send(STATS)
+
+    def fileno(self) -> int:
+        """Readable whenever the worker has sent events, for select() on POSIX"""
+        return self.events.fileno()
+
+    def process_events(self) -> None:
+        """Dispatch all events that have arrived, never blocks"""
+        while self.events.poll():
             try:
-                message = self.responses.get(block=False)
-                self.callback(message)
-            except Empty:
+                event, payload = self.events.recv()
+            except EOFError:
                 return
+            if event == DATA_RECEIVED:
+                self.callback(payload)
+            elif event == SWAPPED:
+                # so that a replacement worker opens the same disk
+                self.imgdir = payload
+            if self.on_event is not None:
+                self.on_event(event, payload)
@@ -0,0 +1,51 @@
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+
+
+class SectorIdIndex:
+    """
+    Maps each sector ID to the sorted list of physical sectors carrying
+    it, so the S (search ID) command is a dict lookup and a bisect rather
+    than a scan of every sector. Kept up to date by the disk as IDs are
+    written, and counts search hits and misses along the way.
+    """
+
+    def __init__(self, ids: Iterable[bytes]) -> None:
+        self.__ids: list[bytes] = []
+        self.__sectors: dict[bytes, list[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        for psn, sector_id in enumerate(ids):
+            sector_id = bytes(sector_id)
+            self.__ids.append(sector_id)
+            self.__sectors.setdefault(sector_id, []).append(psn)
+
+    def update(self, psn: int, sector_id: bytes) -> None:
+        """Sector psn now carries sector_id"""
+        sector_id = bytes(sector_id)
+        old = self.__ids[psn]
+        if old == sector_id:
+            return
+        sectors = self.__sectors[old]
+        del sectors[bisect_left(sectors, psn)]
+        if not sectors:
+            del self.__sectors[old]
+        insort(self.__sectors.setdefault(sector_id, []), psn)
+        self.__ids[psn] = sector_id
+
+    def reset(self, sector_id: bytes) -> None:
+        """Every sector now carries sector_id, as after a format"""
+        sector_id = bytes(sector_id)
+        self.__ids = [sector_id] * len(self.__ids)
+        self.__sectors = {sector_id: list(range(len(self.__ids)))}
+
+    def find(self, psn: int, sector_id: bytes) -> int | None:
+        """The first sector from psn on carrying sector_id"""
+        sectors = self.__sectors.get(bytes(sector_id))
+        if sectors is not None:
+            i = bisect_left(sectors, psn)
+            if i < len(sectors):
+                self.hits += 1
+                return sectors[i]
+        self.misses += 1
+        return None
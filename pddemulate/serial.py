@@ -1,54 +1,178 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Protocol
+
 import serial
 
+# where the loop can't watch a port, how long the reader thread blocks
+# in a read before checking whether the port has been closed
+THREAD_READ_TIMEOUT = 0.1
+
+
+class RingBuffer:
+    """
+    A byte FIFO over a fixed bytearray, so bytes arriving from the port
+    can be consumed without shifting or reallocating. It only grows if a
+    single burst is larger than the free space.
+    """
+
+    def __init__(self, capacity: int = 4096) -> None:
+        self.__buf = bytearray(capacity)
+        self.__head = 0
+        self.__size = 0
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def clear(self) -> None:
+        self.__head = 0
+        self.__size = 0
+
+    def write(self, data: bytes) -> None:
+        n = len(data)
+        if self.__size + n > len(self.__buf):
+            self.__grow(self.__size + n)
+        capacity = len(self.__buf)
+        tail = (self.__head + self.__size) % capacity
+        first = min(n, capacity - tail)
+        self.__buf[tail:tail + first] = data[:first]
+        if first < n:
+            self.__buf[:n - first] = data[first:]
+        self.__size += n
+
+    def read(self, n: int) -> bytes:
+        n = min(n, self.__size)
+        capacity = len(self.__buf)
+        end = self.__head + n
+        if end <= capacity:
+            out = bytes(self.__buf[self.__head:end])
+        else:
+            out = bytes(self.__buf[self.__head:]) + bytes(self.__buf[:end - capacity])
+        self.__head = end % capacity
+        self.__size -= n
+        return out
+
+    def find(self, b: int) -> int:
+        """Offset of byte value b from the front of the buffer, or -1"""
+        capacity = len(self.__buf)
+        end = self.__head + self.__size
+        idx = self.__buf.find(b, self.__head, min(end, capacity))
+        if idx >= 0:
+            return idx - self.__head
+        if end > capacity:
+            idx = self.__buf.find(b, 0, end - capacity)
+            if idx >= 0:
+                return capacity - self.__head + idx
+        return -1
+
+    def __grow(self, needed: int) -> None:
+        capacity = len(self.__buf)
+        while capacity < needed:
+            capacity *= 2
+        size = self.__size
+        data = self.read(size)
+        self.__buf = bytearray(capacity)
+        self.__buf[:size] = data
+        self.__head = 0
+        self.__size = size
+
+
+def open_port(port: str, timeout: float | None) -> serial.Serial:
+    ser = serial.Serial(
+        port=port,
+        baudrate=9600,
+        parity=serial.PARITY_NONE,
+        stopbits=serial.STOPBITS_ONE,
+        timeout=timeout,
+        xonxoff=False,
+        rtscts=False,
+        dsrdtr=False,
+    )
+    #            ser.setRTS(True)
+    if ser is None:
+        print(f"Unable to open serial device {port}")
+        raise IOError
+    return ser
+
+
+class Transport(Protocol):
+    """What the emulator needs from the connection to the machine"""
+
+    async def read_char(self) -> bytes: ...
+
+    async def read_exact(self, num: int) -> bytes: ...
+
+    async def read_until(self, terminator: bytes = b"\r") -> bytes: ...
+
+    def write_bytes(self, b: bytes) -> None: ...
+
+    def close(self) -> None: ...
+
 
 class SerialConnection:
+    """
+    Buffered access to the serial port.
+
+    Whatever the port has waiting is pulled in with a single read and
+    kept in a ring buffer, the protocol then takes bytes out of that.
+    Reads block in the port driver rather than spinning, timeout is how
+    long to wait for the next byte to arrive (None waits forever).
+    """
     ser: serial.Serial
 
-    def __init__(self, port: str) -> None:
+    def __init__(self, port: str, timeout: float | None = None) -> None:
         print("trying to open port: ", port)
-        self.ser = serial.Serial(
-            port=port,
-            baudrate=9600,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=False,
-            xonxoff=False,
-            rtscts=False,
-            dsrdtr=False,
-        )
-        #            self.ser.setRTS(True)
-        if self.ser is None:
-            print(f"Unable to open serial device {port}")
-            raise IOError
+        self.port = port
+        self.timeout = timeout
+        self.buffer = RingBuffer()
+        self.ser = open_port(port, timeout)
 
     def close(self) -> None:
         if self.ser:
             self.ser.close()
 
+    def __fill(self) -> None:
+        # block for the first byte, then take everything else already waiting
+        data = self.ser.read(max(1, self.ser.in_waiting))
+        if len(data) == 0:
+            raise TimeoutError(f"No data from {self.port} within {self.timeout}s")
+        waiting = self.ser.in_waiting
+        if waiting:
+            data += self.ser.read(waiting)
+        self.buffer.write(data)
+
     def dump_chars(self) -> None:
         num = 1
-        while 1:
-            inc = self.ser.read()
-            if len(inc) != 0:
-                print(f"flushed 0x{ord(inc)}X ({num})")
-                num = num + 1
-            else:
-                break
+        waiting = self.ser.in_waiting
+        if waiting:
+            self.buffer.write(self.ser.read(waiting))
+        for inc in self.buffer.read(len(self.buffer)):
+            print(f"flushed 0x{inc:02X} ({num})")
+            num = num + 1
 
     def read(self) -> bytes:
-        return self.ser.read()
+        return self.read_exact(1)
+
+    def read_exact(self, num: int) -> bytes:
+        while len(self.buffer) < num:
+            self.__fill()
+        return self.buffer.read(num)
+
+    def read_until(self, terminator: bytes = b"\r") -> bytes:
+        """Read up to and including the (single byte) terminator"""
+        while True:
+            idx = self.buffer.find(terminator[0])
+            if idx >= 0:
+                return self.buffer.read(idx + 1)
+            self.__fill()
 
     def read_some_chars(self, num: int) -> bytes:
-        sch = self.ser.read(num)
-        while len(sch) < num:
-            sch += self.ser.read(num - len(sch))
-        return sch
+        return self.read_exact(num)
 
     def read_char(self) -> bytes:
-        inc = ""
-        while len(inc) == 0:
-            inc = self.ser.read()
-        return inc
+        return self.read_exact(1)
 
     def write_bytes(self, b: bytes) -> None:
         self.ser.write(b)
@@ -64,3 +188,190 @@ class SerialConnection:
         if len(info) > 1 and info[1] != b"":
             val = int(info[0])
         return physical, logical
+
+
+class BlockingTransport:
+    """
+    Presents a blocking SerialConnection as a Transport. Its coroutines
+    never suspend, so they can be run without an event loop.
+    """
+
+    def __init__(self, connection: SerialConnection) -> None:
+        self.connection = connection
+
+    async def read_char(self) -> bytes:
+        return self.connection.read_char()
+
+    async def read_exact(self, num: int) -> bytes:
+        return self.connection.read_exact(num)
+
+    async def read_until(self, terminator: bytes = b"\r") -> bytes:
+        return self.connection.read_until(terminator)
+
+    def write_bytes(self, b: bytes) -> None:
+        self.connection.write_bytes(b)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class AsyncSerialConnection:  # pylint: disable=too-many-instance-attributes
+    """
+    A serial port Transport for asyncio. The event loop watches the port
+    and bytes are moved into the ring buffer as they arrive, readers
+    wait on a future instead of a blocking read. Writes don't block
+    either: what the port can't take at once is queued and sent as it
+    drains, so a slow line holds up no other drive on the loop. Must be
+    created while the loop is running.
+
+    Where the loop can't watch the port (Windows, whose proactor loop
+    has no add_reader and whose ports have no file descriptor) a thread
+    reads the port and another writes it, handing over to the loop.
+    """
+
+    def __init__(self, port: str, timeout: float | None = None) -> None:
+        print("trying to open port: ", port)
+        self.port = port
+        self.timeout = timeout
+        self.buffer = RingBuffer()
+        self.ser = open_port(port, 0)
+        self.__loop = asyncio.get_running_loop()
+        self.__waiter: asyncio.Future | None = None
+        self.__error: Exception | None = None
+        self.__outgoing = bytearray()
+        self.__writer: ThreadPoolExecutor | None = None
+        try:
+            self.__fd: int | None = self.ser.fileno()
+            self.__loop.add_reader(self.__fd, self.__readable)
+        except (AttributeError, NotImplementedError):
+            self.__fd = None
+            self.__start_threads()
+        else:
+            os.set_blocking(self.__fd, False)
+
+    def __start_threads(self) -> None:
+        # reads give up now and then so the thread notices a close
+        self.ser.timeout = THREAD_READ_TIMEOUT
+        self.ser.write_timeout = None
+        # one thread, so writes go out in order
+        self.__writer = ThreadPoolExecutor(1, thread_name_prefix=f"{self.port}-write")
+        threading.Thread(
+            target=self.__read_forever, name=f"{self.port}-read", daemon=True
+        ).start()
+
+    def close(self) -> None:
+        if self.ser.is_open:
+            if self.__fd is None:
+                self.__writer.shutdown(wait=False, cancel_futures=True)
+            else:
+                self.__loop.remove_reader(self.__fd)
+                self.__loop.remove_writer(self.__fd)
+                self.__outgoing.clear()
+            self.ser.close()
+        self.__wake(ConnectionError(f"{self.port} closed"))
+
+    def __readable(self) -> None:
+        try:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+        except serial.SerialException as e:
+            # most likely the device went away
+            self.__loop.remove_reader(self.__fd)
+            self.__wake(e)
+            return
+        self.__received(data)
+
+    def __read_forever(self) -> None:
+        # on the reader thread
+        while self.ser.is_open:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError, TypeError) as e:
+                # TypeError: pyserial's reads fail that way on a port closed under them
+                if self.ser.is_open:
+                    self.__call_soon(self.__wake, e)
+                return
+            if data:
+                self.__call_soon(self.__received, data)
+
+    def __call_soon(self, fn, *args) -> None:
+        try:
+            self.__loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            # the loop has been closed, nobody is reading any more
+            pass
+
+    def __received(self, data: bytes) -> None:
+        if data:
+            self.buffer.write(data)
+            self.__wake()
+
+    def __wake(self, error: Exception | None = None) -> None:
+        if error is not None:
+            self.__error = error
+        if self.__waiter is not None and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    async def __fill(self) -> None:
+        if self.__error is not None:
+            raise self.__error
+        self.__waiter = self.__loop.create_future()
+        try:
+            await asyncio.wait_for(self.__waiter, self.timeout)
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(
+                f"No data from {self.port} within {self.timeout}s"
+            ) from e
+        finally:
+            self.__waiter = None
+        if self.__error is not None:
+            raise self.__error
+
+    async def read_char(self) -> bytes:
+        return await self.read_exact(1)
+
+    async def read_exact(self, num: int) -> bytes:
+        while len(self.buffer) < num:
+            await self.__fill()
+        return self.buffer.read(num)
+
+    async def read_until(self, terminator: bytes = b"\r") -> bytes:
+        """Read up to and including the (single byte) terminator"""
+        while True:
+            idx = self.buffer.find(terminator[0])
+            if idx >= 0:
+                return self.buffer.read(idx + 1)
+            await self.__fill()
+
+    def write_bytes(self, b: bytes) -> None:
+        if self.__fd is None:
+            self.__writer.submit(self.__write_blocking, bytes(b))
+            return
+        if self.__outgoing:
+            # still waiting on the port, keep the order
+            self.__outgoing += b
+            return
+        self.__outgoing += b
+        self.__writable()
+        if self.__outgoing:
+            self.__loop.add_writer(self.__fd, self.__writable)
+
+    def __write_blocking(self, b: bytes) -> None:
+        # on the writer thread
+        try:
+            self.ser.write(b)
+        except (serial.SerialException, OSError) as e:
+            self.__call_soon(self.__wake, e)
+
+    def __writable(self) -> None:
+        try:
+            sent = os.write(self.__fd, self.__outgoing)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.__loop.remove_writer(self.__fd)
+            self.__outgoing.clear()
+            self.__wake(e)
+            return
+        del self.__outgoing[:sent]
+        if not self.__outgoing:
+            self.__loop.remove_writer(self.__fd)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Serve several emulated drives from one process.
+
+The config file is JSON, mapping each serial port to the disk it should
+serve (a sector directory, or an image file ending in .img):
+
+    {
+        "drives": {
+            "/dev/ttyUSB0": "disks/station1",
+            "/dev/ttyUSB1": "disks/station2.img"
+        },
+        "scan_interval": 2.0,
+        "write_policy": "group",
+        "metrics_port": 9477
+    }
+
+write_policy is optional, one of flush (the default), fsync, group or
+memory, see pddemulate.disk. With metrics_port, Prometheus metrics for
+every drive are served on http://localhost:<port>/metrics, see
+pddemulate.metrics.
+
+All drives run on one event loop. A drive is started when its port shows
+up in serial.tools.list_ports and stopped when it goes away, and a drive
+that fails is restarted without disturbing the others.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import serial.tools.list_ports
+
+from pddemulate.disk import make_write_policy
+from pddemulate.drive import AsyncPDDemulator
+from pddemulate.metrics import DriveMetrics, MetricsServer
+from pddemulate.trace import Tracer, configure_logging
+
+VERSION = "1.0"
+
+RESTART_DELAY = 1.0
+
+
+class Drive:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """One serial port and the disk behind it"""
+
+    def __init__(self, port: str, image: str, write_policy: str | None = None) -> None:
+        self.port = port
+        self.image = image
+        self.write_policy = write_policy
+        self.emulator: AsyncPDDemulator | None = None
+        self.task: asyncio.Task | None = None
+        self.restarts = 0
+        self.tracer = Tracer()
+        self.metrics = DriveMetrics(port, self.tracer)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                # a missing or locked disk is retried like a failed port
+                if self.emulator is None:
+                    policy = (
+                        None if self.write_policy is None
+                        else make_write_policy(self.write_policy)
+                    )
+                    self.emulator = AsyncPDDemulator(
+                        self.image, tracer=self.tracer, write_policy=policy
+                    )
+                await self.emulator.open(self.port)
+                print(f"Drive {self.port} ready, serving {self.image}")
+                await self.emulator.handle_requests()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # keep this to ourselves, the other drives carry on
+                self.restarts += 1
+                print(f"Drive {self.port} failed: {e!r}, restarting")
+            finally:
+                if self.emulator is not None:
+                    self.emulator.close()
+            await asyncio.sleep(RESTART_DELAY)
+
+
+class DriveSupervisor:
+    drives: dict[str, Drive]
+
+    def __init__(
+            self,
+            drives: dict[str, str],
+            scan_interval: float = 2.0,
+            write_policy: str | None = None,
+            metrics_port: int | None = None,
+        ) -> None:
+        self.write_policy = write_policy
+        self.drives = {}
+        for port, image in drives.items():
+            self.add_drive(port, image)
+        self.scan_interval = scan_interval
+        self.metrics: MetricsServer | None = None
+        if metrics_port is not None:
+            self.metrics = MetricsServer(metrics_port)
+            # read on each scrape, drives added later show up too
+            self.metrics.add_source(
+                lambda: [drive.metrics for drive in list(self.drives.values())]
+            )
+
+    def add_drive(self, port: str, image: str) -> Drive:
+        """Supervise another drive, started on the next scan if its port is there"""
+        drive = self.drives[port] = Drive(port, image, self.write_policy)
+        return drive
+
+    @classmethod
+    def from_config(cls, path: str) -> "DriveSupervisor":
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            config["drives"],
+            config.get("scan_interval", 2.0),
+            config.get("write_policy"),
+            config.get("metrics_port"),
+        )
+
+    @staticmethod
+    def present_ports() -> set[str]:
+        return {port.device for port in serial.tools.list_ports.comports()}
+
+    def start(self, drive: Drive) -> None:
+        print(f"Port {drive.port} appeared")
+        drive.task = asyncio.create_task(drive.run(), name=drive.port)
+
+    def stop(self, drive: Drive) -> None:
+        print(f"Port {drive.port} went away")
+        drive.task.cancel()
+        drive.task = None
+
+    async def scan(self) -> None:
+        """Start drives whose port has appeared, stop those whose port has gone"""
+        loop = asyncio.get_running_loop()
+        present = await loop.run_in_executor(None, self.present_ports)
+        for drive in self.drives.values():
+            # configs may name ports by a stable symlink (/dev/serial/by-id/...)
+            here = os.path.realpath(drive.port) in present or drive.port in present
+            if here and drive.task is None:
+                self.start(drive)
+            elif not here and drive.task is not None:
+                self.stop(drive)
+
+    async def serve(self) -> None:  # never returns
+        if self.metrics is not None:
+            self.metrics.start()
+            print(f"Metrics on http://localhost:{self.metrics.port}/metrics")
+        try:
+            while True:
+                await self.scan()
+                await asyncio.sleep(self.scan_interval)
+        finally:
+            tasks = [drive.task for drive in self.drives.values() if drive.task is not None]
+            for task in tasks:
+                task.cancel()
+            # let them finish closing their ports before the disks go
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for drive in self.drives.values():
+                drive.task = None
+                if drive.emulator is not None:
+                    drive.emulator.disk.close()
+            if self.metrics is not None:
+                self.metrics.stop()
+
+
+def main() -> None:
+    if len(sys.argv) != 2:
+        print(f"{sys.argv[0]} version {VERSION}")
+        print(f"Usage: {sys.argv[0]} config.json")
+        sys.exit(1)
+    configure_logging()
+    supervisor = DriveSupervisor.from_config(sys.argv[1])
+    print(f"Supervising {len(supervisor.drives)} drives")
+    try:
+        asyncio.run(supervisor.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
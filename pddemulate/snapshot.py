@@ -0,0 +1,108 @@
+"""
+Snapshots of a disk, kept in a content-addressed store.
+
+Every sector's data and ID is stored once as a blob named by its SHA-256,
+however many snapshots hold it. A snapshot is just a manifest: the data
+and ID hash of each of the 80 sectors. Taking one only stores the blobs
+not seen before, and comparing or restoring two snapshots is a matter of
+comparing 80 pairs of hashes.
+
+    <store>/objects/ab/cdef...    blobs
+    <store>/manifests/<name>.json {"created": ..., "sectors": [[data, id], ...]}
+
+A sector directory disk keeps its store in <disk>/snapshots, see
+pddemulate.snapshot_tool to manage them from the command line.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+NUM_SECTORS = 80
+
+
+def blob_hash(blob: bytes) -> str:
+    return hashlib.sha256(blob).hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.manifests = os.path.join(root, "manifests")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.manifests, exist_ok=True)
+
+    def __object_path(self, digest: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def __write_atomic(self, path: str, content: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def put(self, blob: bytes) -> str:
+        """Store blob unless already there, returns its hash"""
+        digest = blob_hash(blob)
+        path = self.__object_path(digest)
+        if not os.path.exists(path):
+            self.__write_atomic(path, bytes(blob))
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.__object_path(digest), "rb") as f:
+            blob = f.read()
+        if blob_hash(blob) != digest:
+            print(f"Snapshot object {digest} is corrupt")
+            raise IOError
+        return blob
+
+    def names(self) -> list[str]:
+        """Every snapshot, oldest first"""
+        entries = [entry for entry in os.scandir(self.manifests) if entry.name.endswith(".json")]
+        entries.sort(key=lambda entry: (entry.stat().st_mtime_ns, entry.name))
+        return [entry.name[:-len(".json")] for entry in entries]
+
+    def load(self, name: str) -> list[tuple[str, str]]:
+        """(data hash, ID hash) of each sector in the snapshot"""
+        try:
+            with open(os.path.join(self.manifests, name + ".json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            print(f"No snapshot named <{name}>")
+            raise
+        return [tuple(entry) for entry in manifest["sectors"]]
+
+    def save(self, name: str, sectors: list[tuple[str, str]]) -> None:
+        manifest = {"created": time.time(), "sectors": [list(entry) for entry in sectors]}
+        self.__write_atomic(
+            os.path.join(self.manifests, name + ".json"), json.dumps(manifest).encode()
+        )
+
+    @staticmethod
+    def diff(a: list[tuple[str, str]], b: list[tuple[str, str]]) -> list[int]:
+        """Sectors whose data or ID differ between two manifests"""
+        return [psn for psn, (x, y) in enumerate(zip(a, b)) if x != y]
+
+
+def manifest_of(disk) -> list[tuple[str, str]]:
+    """The disk's current (data hash, ID hash) per sector, nothing stored"""
+    return [
+        (blob_hash(disk.read_sector(psn, 1)), blob_hash(disk.get_sector_id(psn)))
+        for psn in range(NUM_SECTORS)
+    ]
+
+
+def new_snapshot_name() -> str:
+    # sorts in the order taken
+    now = time.time()
+    return time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now % 1 * 1e6):06d}"
@@ -0,0 +1,50 @@
+"""
+List, take, compare and restore snapshots of a sector directory disk.
+
+    python -m pddemulate.snapshot_tool diskdir list
+    python -m pddemulate.snapshot_tool diskdir take [name]
+    python -m pddemulate.snapshot_tool diskdir diff name [other]
+    python -m pddemulate.snapshot_tool diskdir restore name
+
+The disk is locked while the tool works on it, so it refuses a disk an
+emulator is serving. A journal left by a crashed emulator is replayed
+first, otherwise that replay would undo a restore on the next start.
+"""
+
+import os
+import sys
+
+from pddemulate.disk import Disk
+from pddemulate.journal import JOURNAL_NAME
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    if len(args) < 2 or args[1] not in ("list", "take", "diff", "restore") or (
+        args[1] in ("diff", "restore") and len(args) < 3
+    ):
+        print(f"Usage: {sys.argv[0]} diskdir list")
+        print(f"       {sys.argv[0]} diskdir take [name]")
+        print(f"       {sys.argv[0]} diskdir diff name [other]")
+        print(f"       {sys.argv[0]} diskdir restore name")
+        sys.exit(1)
+    disk = Disk(args[0], journaled=os.path.exists(os.path.join(args[0], JOURNAL_NAME)))
+    try:
+        match args[1]:
+            case "list":
+                for name in disk.snapshots():
+                    print(name)
+            case "take":
+                print(disk.snapshot(args[2] if len(args) > 2 else None))
+            case "diff":
+                changed = disk.diff(args[2], args[3] if len(args) > 3 else None)
+                print(f"{len(changed)} sectors differ: {' '.join(map(str, changed))}")
+            case "restore":
+                changed = disk.restore(args[2])
+                print(f"Restored {len(changed)} sectors from {args[2]}")
+    finally:
+        disk.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Tracing for the emulator's serial exchange, kept in memory.
+
+The emulator logs through the "pddemulate" logger with lazy %-style
+arguments, so a message below the configured level costs one level
+check and is never formatted. A Tracer adds, per drive:
+
+* a span per command, timing how long the emulator spent parsing it,
+  in the disk and writing the response; time spent waiting for the
+  machine to send bytes is kept apart, it is not ours
+* counters of bytes in and out, commands, serial connections, checksum
+  mismatches and errors
+* ring buffers of the latest spans and log records, formatted only when
+  dumped, on demand or when a command fails. Several drives can share a
+  process and an event loop: a record logged while a drive's emulator is
+  handling a command goes only to that drive's ring, records logged
+  outside any drive go to all of them
+
+An emulator without a Tracer does none of this. Observers (see
+pddemulate.metrics) are given each span as it finishes.
+"""
+
+import logging
+import sys
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, TextIO
+
+from pddemulate.serial import Transport
+
+LOGGER_NAME = "pddemulate"
+
+# spans kept per tracer, log records are kept four times as many
+TRACE_CAPACITY = 256
+
+log = logging.getLogger(LOGGER_NAME)
+
+# the tracer of the drive whose emulator is running, per task
+_active: ContextVar["Tracer | None"] = ContextVar("pddemulate_tracer", default=None)
+
+
+def configure_logging(verbose: bool = False, stream: TextIO | None = None) -> None:
+    """
+    Print the emulator's messages to stdout: saves and problems, or with
+    verbose every command too.
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+    log.addHandler(handler)
+    log.setLevel(min(log.getEffectiveLevel(), handler.level))
+
+
+class LogRing(logging.Handler):
+    """Keeps the latest log records unformatted, formats them when dumped"""
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__(logging.DEBUG)
+        self.records: deque[logging.LogRecord] = deque(maxlen=capacity)
+        self.setFormatter(
+            logging.Formatter(
+                "%(asctime)s.%(msecs)03d %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S"
+            )
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+    def lines(self) -> list[str]:
+        return [self.format(record) for record in list(self.records)]
+
+
+class Span:  # pylint: disable=too-many-instance-attributes
+    """One command, all times in seconds"""
+    __slots__ = (
+        "command", "sector", "started", "parse", "disk", "respond", "wait", "error", "mark"
+    )
+
+    def __init__(self, command: str, now: float) -> None:
+        self.command = command
+        self.sector: int | None = None
+        self.started = now
+        self.parse = 0.0
+        self.disk = 0.0
+        self.respond = 0.0
+        self.wait = 0.0
+        self.error: str | None = None
+        # start of the phase being timed
+        self.mark = now
+
+    @property
+    def busy(self) -> float:
+        """Time the emulator spent on the command, leaving out the machine's"""
+        return self.parse + self.disk + self.respond
+
+    def __repr__(self) -> str:
+        sector = "  " if self.sector is None else f"{self.sector:2d}"
+        return (
+            f"{self.command:2s} {sector} busy {self.busy * 1e6:8.0f}us" +
+            f" (parse {self.parse * 1e6:.0f} disk {self.disk * 1e6:.0f}" +
+            f" respond {self.respond * 1e6:.0f}) wait {self.wait * 1e3:.1f}ms" +
+            ("" if self.error is None else f" FAILED {self.error}")
+        )
+
+
+class Tracer:  # pylint: disable=too-many-instance-attributes
+    """
+    Spans and counters for one emulator. Errors and on demand dumps go
+    to dump_path if given, otherwise to stderr.
+    """
+
+    def __init__(self, capacity: int = TRACE_CAPACITY, dump_path: str | None = None) -> None:
+        self.dump_path = dump_path
+        self.spans: deque[Span] = deque(maxlen=capacity)
+        self.current: Span | None = None
+        self.observers: list[Callable[[Span], None]] = []
+        self.ring = LogRing(capacity * 4)
+        self.ring.addFilter(self.__mine)
+        # spans are timed with perf_counter, this puts them on the clock
+        self.clock_offset = time.time() - time.perf_counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.commands = 0
+        self.connections = 0
+        self.checksum_mismatches = 0
+        self.errors = 0
+
+    def install(self, level: int = logging.INFO) -> None:
+        """
+        Start keeping the emulator's log records. The spans already say
+        what each command was, so the debug messages are left out unless
+        asked for: creating a record costs more than the span does.
+        """
+        self.ring.setLevel(level)
+        log.addHandler(self.ring)
+        log.setLevel(min(log.getEffectiveLevel(), level))
+
+    def uninstall(self) -> None:
+        log.removeHandler(self.ring)
+
+    def activate(self) -> None:
+        """Records logged from here on in this task are this drive's"""
+        _active.set(self)
+
+    def __mine(self, _record: logging.LogRecord) -> bool:
+        active = _active.get()
+        return active is None or active is self
+
+    # spans
+
+    def begin(self, command: str) -> None:
+        """A command byte has arrived, any span still open is finished"""
+        self.end()
+        self.commands += 1
+        self.current = Span("CR" if command == "\r" else command, time.perf_counter())
+
+    def parsed(self, sector: int) -> None:
+        span = self.current
+        if span is not None:
+            now = time.perf_counter()
+            span.sector = sector
+            span.parse += now - span.mark
+            span.mark = now
+
+    def disk_done(self) -> None:
+        span = self.current
+        if span is not None:
+            now = time.perf_counter()
+            span.disk += now - span.mark
+            span.mark = now
+
+    def end(self) -> None:
+        span = self.current
+        if span is not None:
+            self.current = None
+            self.spans.append(span)
+            for observer in self.observers:
+                observer(span)
+
+    def failed(self, error: BaseException) -> None:
+        self.errors += 1
+        if self.current is not None:
+            self.current.error = repr(error)
+        self.end()
+        log.error("Command failed: %r", error)
+        self.dump()
+
+    # counters, called by TracedTransport and the emulator
+
+    def received(self, n: int, waited: float) -> None:
+        self.bytes_in += n
+        span = self.current
+        if span is not None:
+            span.wait += waited
+            span.mark = time.perf_counter()
+
+    def sent(self, n: int, took: float) -> None:
+        self.bytes_out += n
+        span = self.current
+        if span is not None:
+            span.respond += took
+            span.mark = time.perf_counter()
+
+    def connected(self) -> None:
+        self.connections += 1
+
+    def checksum_mismatch(self) -> None:
+        self.checksum_mismatches += 1
+
+    def counters(self) -> dict:
+        return {
+            "commands": self.commands,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "connections": self.connections,
+            "checksum_mismatches": self.checksum_mismatches,
+            "errors": self.errors,
+        }
+
+    # dumps
+
+    def write(self, out: TextIO) -> None:
+        """The counters, the latest spans and the latest log records"""
+        out.write(f"--- trace at {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        out.write(" ".join(f"{k}={v}" for k, v in self.counters().items()) + "\n")
+        for span in list(self.spans):
+            started = span.started + self.clock_offset
+            clock = time.strftime("%H:%M:%S", time.localtime(started))
+            out.write(f"{clock}.{int(started % 1 * 1e6):06d} {span!r}\n")
+        for line in self.ring.lines():
+            out.write(line + "\n")
+
+    def dump(self) -> None:
+        if self.dump_path is None:
+            self.write(sys.stderr)
+            return
+        with open(self.dump_path, "a", encoding="utf-8") as f:
+            self.write(f)
+
+
+class TracedTransport:
+    """Wraps the emulator's Transport to count and time what crosses it"""
+
+    def __init__(self, transport: Transport, tracer: Tracer) -> None:
+        self.transport = transport
+        self.tracer = tracer
+
+    async def read_char(self) -> bytes:
+        start = time.perf_counter()
+        data = await self.transport.read_char()
+        self.tracer.received(len(data), time.perf_counter() - start)
+        return data
+
+    async def read_exact(self, num: int) -> bytes:
+        start = time.perf_counter()
+        data = await self.transport.read_exact(num)
+        self.tracer.received(len(data), time.perf_counter() - start)
+        return data
+
+    async def read_until(self, terminator: bytes = b"\r") -> bytes:
+        start = time.perf_counter()
+        data = await self.transport.read_until(terminator)
+        self.tracer.received(len(data), time.perf_counter() - start)
+        return data
+
+    def write_bytes(self, b: bytes) -> None:
+        start = time.perf_counter()
+        self.transport.write_bytes(b)
+        self.tracer.sent(len(b), time.perf_counter() - start)
+
+    def close(self) -> None:
+        self.transport.close()
@@ -0,0 +1,105 @@
+"""
+The knitting machine writes its "tracks" as pairs of even/odd sectors.
+Once the odd sector of a pair arrives, both are joined into a single
+2048 byte file-N.dat, which is what the pattern tools read.
+"""
+
+import itertools
+import os
+import queue
+import threading
+
+# the temporary file is created with the mode any other file we write
+# gets, the kernel applies the umask (mkstemp would make it private)
+TRACK_MODE = 0o666
+
+
+class TrackAssembler:
+    """
+    Builds file-N.dat from the two in-memory sector buffers of a track.
+
+    Files are written atomically (temporary file, synced, then renamed),
+    so neither a reader nor a crash leaves a half written track. When
+    deferred, writing happens on a background thread and flush() waits
+    for it to catch up.
+    """
+
+    def __init__(self, dirpath: str, deferred: bool = False) -> None:
+        self.dirpath = dirpath
+        self.deferred = deferred
+        self.__pending: queue.Queue = queue.Queue()
+        self.__worker: threading.Thread | None = None
+        self.__serial = itertools.count()
+
+    @staticmethod
+    def track_number(psn: int) -> int:
+        """Tracks are numbered from 1, sectors 0 and 1 make up track 1"""
+        return psn // 2 + 1
+
+    def track_path(self, psn: int) -> str:
+        return os.path.join(self.dirpath, f"file-{self.track_number(psn)}.dat")
+
+    def assemble(self, psn: int, first: bytes, second: bytes) -> str:
+        """Write the track holding sector psn, returns the file path"""
+        path = self.track_path(psn)
+        if not self.deferred:
+            self.__write(path, first, second)
+            return path
+        # the sector buffers may be reused before the worker gets to them
+        self.__pending.put((path, bytes(first), bytes(second)))
+        if self.__worker is None:
+            self.__worker = threading.Thread(
+                target=self.__run, name="track-assembler", daemon=True
+            )
+            self.__worker.start()
+        return path
+
+    def flush(self) -> None:
+        """Block until every deferred track has been written"""
+        if self.__worker is not None:
+            self.__pending.join()
+
+    def close(self) -> None:
+        self.flush()
+        if self.__worker is not None:
+            self.__pending.put(None)
+            self.__worker.join()
+            self.__worker = None
+
+    def __run(self) -> None:
+        while True:
+            item = self.__pending.get()
+            try:
+                if item is None:
+                    return
+                self.__write(*item)
+            except OSError as e:
+                print(f"Unable to write track file <{item[0]}>: {e}")
+            finally:
+                self.__pending.task_done()
+
+    def __create_temporary(self) -> tuple[int, str]:
+        while True:
+            tmp = os.path.join(
+                self.dirpath, f".file-{os.getpid()}-{next(self.__serial)}.tmp"
+            )
+            try:
+                flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+                return os.open(tmp, flags, TRACK_MODE), tmp
+            except FileExistsError:
+                # left over from a crash
+                continue
+
+    def __write(self, path: str, first: bytes, second: bytes) -> None:
+        fd, tmp = self.__create_temporary()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(first)
+                f.write(second)
+                f.flush()
+                # the rename must not reach the disk before the data
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
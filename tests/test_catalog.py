@@ -0,0 +1,100 @@
+import os
+import random
+
+import numpy as np
+
+from pattern.catalog import Catalog
+from pattern.file import BrotherFile
+from pattern.similarity import SIGNATURE_BYTES, distance, signature
+from tests.test_file import FILE_SIZE, entry
+
+
+def flip(sig: bytes, bits: int, rng: random.Random) -> bytes:
+    value = int.from_bytes(sig, "big")
+    for bit in rng.sample(range(SIGNATURE_BYTES * 8), bits):
+        value ^= 1 << bit
+    return value.to_bytes(SIGNATURE_BYTES, "big")
+
+
+def catalog_of(tmp_path, signatures: list[bytes]) -> Catalog:
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    with catalog.db:
+        # pylint: disable=protected-access
+        catalog._Catalog__store(
+            "/dumps/file-1.dat",
+            (0, 0),
+            [(i, 901 + i, 10, 10, f"{i:040x}", sig) for i, sig in enumerate(signatures)],
+            None,
+        )
+    return catalog
+
+
+def test_similar_finds_what_a_full_scan_finds(tmp_path):
+    rng = random.Random(4)
+    base = [rng.randbytes(SIGNATURE_BYTES) for _ in range(20)]
+    signatures = [flip(rng.choice(base), rng.randrange(40), rng) for _ in range(500)]
+    catalog = catalog_of(tmp_path, signatures)
+    for k in (0, 8, 20, 40, 80):
+        query = signatures[rng.randrange(len(signatures))]
+        expected = sorted(
+            (distance(query, sig), 901 + i)
+            for i, sig in enumerate(signatures) if distance(query, sig) <= k
+        )
+        assert [(bits, entry.number) for bits, entry in catalog.similar(query, k)] == expected
+    catalog.close()
+
+
+def test_empty_patterns_have_the_blank_signature():
+    blank = bytes(SIGNATURE_BYTES)
+    assert signature(np.zeros((0, 12), dtype=np.uint8)) == blank
+    assert signature(np.zeros((7, 0), dtype=np.uint8)) == blank
+
+
+def track_file(path, *entries: bytes, fill: int = 0x55) -> str:
+    data = bytearray([fill]) * FILE_SIZE
+    directory = b"".join(entries) + bytes(7)
+    data[:len(directory)] = directory
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_repeated_numbers_are_cataloged_as_separate_entries(tmp_path):
+    os.makedirs(tmp_path / "dumps")
+    path = track_file(
+        tmp_path / "dumps" / "file-1.dat", entry(0x0120, 3, 4, 901), entry(0x0200, 2, 8, 901)
+    )
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    report = catalog.index(str(tmp_path / "dumps"), workers=1)
+    assert report.patterns == 2 and not report.errors
+    found = catalog.find(number=901)
+    assert [(e.path, e.entry, e.stitches, e.rows) for e in found] == [
+        (path, 0, 4, 3), (path, 1, 8, 2)
+    ]
+    bf = BrotherFile(path)
+    assert found[0].hash != found[1].hash
+    assert catalog.signature_of(path, 901) == signature(bf.get_entry_data(0))
+    catalog.close()
+
+
+def test_only_new_or_changed_files_are_parsed_again(tmp_path):
+    dumps = tmp_path / "dumps"
+    os.makedirs(dumps)
+    first = track_file(dumps / "file-1.dat", entry(0x0120, 3, 4, 901))
+    second = track_file(dumps / "file-2.dat", entry(0x0120, 3, 4, 902))
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    report = catalog.index(str(dumps), workers=1)
+    assert (report.seen, report.parsed, report.patterns) == (2, 2, 2)
+
+    report = catalog.index(str(dumps), workers=1)
+    assert (report.seen, report.parsed, report.removed) == (2, 0, 0)
+
+    # same size, new contents and mtime
+    track_file(dumps / "file-1.dat", entry(0x0120, 3, 4, 903))
+    st = os.stat(first)
+    os.utime(first, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    os.unlink(second)
+    report = catalog.index(str(dumps), workers=1)
+    assert (report.seen, report.parsed, report.removed) == (1, 1, 1)
+    assert [e.number for e in catalog.find()] == [903]
+    assert catalog.count() == (1, 1)
+    catalog.close()
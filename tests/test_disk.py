@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from pddemulate import disk_sector
+from pddemulate.disk import Disk, GroupCommit, make_write_policy
+
+
+def sector_file(path: str, psn: int) -> bytes:
+    with open(os.path.join(path, f"{psn}.dat"), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(name="fsyncs")
+def fixture_fsyncs(monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(disk_sector.os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+    return synced
+
+
+@pytest.mark.parametrize("name, fsync", [("flush", False), ("fsync", True)])
+def test_write_through_reaches_the_file_before_returning(tmp_path, fsyncs, name, fsync):
+    path = str(tmp_path / "disk")
+    disk = Disk(path, write_policy=make_write_policy(name))
+    disk.write_sector(4, 1, b"w" * 1024)
+    assert sector_file(path, 4) == b"w" * 1024
+    assert bool(fsyncs) == fsync
+    stats = disk.write_stats()
+    assert (stats["policy"], stats["writes"], stats["syncs"], stats["sync_bytes"]) == (
+        name, 1, 1, 1024
+    )
+    disk.close()
+
+
+def test_group_commit_holds_writes_until_close(tmp_path):
+    path = str(tmp_path / "disk")
+    disk = Disk(path, write_policy=GroupCommit(interval_ms=60000, idle_ms=60000))
+    disk.write_sector(4, 1, b"g" * 1024)
+    disk.write_sector(6, 1, b"h" * 1024)
+    assert sector_file(path, 4) == bytes(1024)
+    assert disk.write_stats()["syncs"] == 0
+    disk.close()
+    assert sector_file(path, 4) == b"g" * 1024
+    assert sector_file(path, 6) == b"h" * 1024
+    stats = disk.write_stats()
+    assert (stats["policy"], stats["writes"], stats["syncs"]) == ("group", 2, 2)
+
+
+def test_memory_leaves_the_sector_files_alone(tmp_path):
+    path = str(tmp_path / "disk")
+    disk = Disk(path, write_policy=make_write_policy("memory"))
+    disk.write_sector(4, 1, b"m" * 1024)
+    assert disk.read_sector(4, 1) == b"m" * 1024
+    disk.close()
+    assert sector_file(path, 4) == bytes(1024)
+    stats = disk.write_stats()
+    assert (stats["policy"], stats["writes"], stats["syncs"]) == ("memory", 1, 0)
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(KeyError):
+        make_write_policy("sometimes")
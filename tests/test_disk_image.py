@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from pddemulate.disk import Disk
+from pddemulate.disk_image import IMAGE_SIZE, DiskImage, open_disk, save_image
+
+
+def sector(value: int) -> bytes:
+    return bytes([value]) * 1024
+
+
+def sector_id(value: int) -> bytes:
+    return bytes([value]) + bytes(11)
+
+
+def test_close_with_sectors_still_referenced(tmp_path):
+    image = DiskImage(str(tmp_path / "disk.img"))
+    image.write_sector(0, 0, sector(7))
+    held = image.read_sector(0, 0)
+    with pytest.raises(TypeError):
+        held[0] = 1
+    image.close()
+    assert bytes(held) == sector(7)
+    del held
+    # the image was flushed and can be opened again
+    image = DiskImage(str(tmp_path / "disk.img"))
+    assert bytes(image.read_sector(0, 0)) == sector(7)
+    image.close()
+
+
+def test_writes_survive_reopening_and_assemble_tracks(tmp_path):
+    path = str(tmp_path / "disk.img")
+    image = open_disk(path)
+    assert isinstance(image, DiskImage)
+    image.write_sector(2, 0, sector(1))
+    image.write_sector(3, 0, sector(2))
+    image.set_sector_id(3, sector_id(9))
+    image.close()
+    assert os.path.getsize(path) == IMAGE_SIZE
+    assert (tmp_path / "file-2.dat").read_bytes() == sector(1) + sector(2)
+
+    image = DiskImage(path)
+    assert bytes(image.read_sector(3, 0)) == sector(2)
+    assert image.get_sector_id(3) == sector_id(9)
+    assert image.find_sector_id(0, sector_id(9)) == b"00030000"
+    image.close()
+
+
+def test_directory_import_export_round_trip(tmp_path):
+    disk = Disk(str(tmp_path / "dir"))
+    for psn in (0, 1, 41, 79):
+        disk.write_sector(psn, 0, sector(psn + 1))
+        disk.set_sector_id(psn, sector_id(psn + 1))
+    disk.close()
+
+    image = DiskImage.import_directory(str(tmp_path / "dir"), str(tmp_path / "disk.img"))
+    image.export_directory(str(tmp_path / "out"))
+    image.close()
+
+    for psn in range(80):
+        for suffix in (".dat", ".id"):
+            name = f"{psn}{suffix}"
+            assert (tmp_path / "out" / name).read_bytes() == (tmp_path / "dir" / name).read_bytes()
+
+    # and save_image of the directory disk gives the same image
+    disk = Disk(str(tmp_path / "dir"))
+    save_image(disk, str(tmp_path / "saved.img"))
+    disk.close()
+    assert (tmp_path / "saved.img").read_bytes() == (tmp_path / "disk.img").read_bytes()
+
+
+def test_images_of_the_wrong_size_are_refused(tmp_path):
+    path = tmp_path / "short.img"
+    path.write_bytes(bytes(100))
+    with pytest.raises(IOError):
+        DiskImage(str(path))
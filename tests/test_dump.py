@@ -0,0 +1,70 @@
+import io
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from pattern import dump
+from pattern.file import BrotherFile
+from tests.test_catalog import track_file
+from tests.test_file import entry
+
+
+@pytest.fixture(name="dat_file")
+def fixture_dat_file(tmp_path):
+    return track_file(
+        tmp_path / "file-1.dat",
+        entry(0x0120, 3, 4, 901),
+        entry(0x0200, 2, 8, 901),
+        entry(0x0280, 5, 6, 902),
+        fill=0x5a,
+    )
+
+
+def run_dump(monkeypatch, *args: str) -> bytes:
+    out = io.BytesIO()
+    stdout = io.TextIOWrapper(out, write_through=True)
+    monkeypatch.setattr(sys, "argv", ["dump", *args])
+    monkeypatch.setattr(sys, "stdout", stdout)
+    monkeypatch.setattr(sys, "stderr", io.StringIO())
+    dump.main()
+    return out.getvalue()
+
+
+def test_text_of_one_pattern(monkeypatch, dat_file):
+    pattern = BrotherFile(dat_file).get_pattern_data(902)
+    text = run_dump(monkeypatch, dat_file, "902").decode()
+    lines = text.splitlines()
+    assert lines[-1 - len(pattern)] == "6 Stitches, 5 Rows"
+    assert lines[-len(pattern):] == [
+        "".join("* " if stitch else "  " for stitch in row) for row in pattern
+    ]
+
+
+def test_jsonl_has_a_row_object_for_every_entry(monkeypatch, dat_file):
+    bf = BrotherFile(dat_file)
+    rows = [json.loads(line) for line in run_dump(monkeypatch, dat_file, "--jsonl").splitlines()]
+    expected = [
+        {"pattern": pat.number, "row": row,
+         "stitches": "".join(str(s) for s in bf.get_entry_data(index)[row])}
+        for index, pat in enumerate(bf.get_patterns())
+        for row in range(pat.rows)
+    ]
+    assert rows == expected
+
+
+def test_binary_header_and_packed_rows(monkeypatch, dat_file):
+    bf = BrotherFile(dat_file)
+    data = run_dump(monkeypatch, dat_file, "--binary")
+    offset = 0
+    for index, pat in enumerate(bf.get_patterns()):
+        number, stitches, rows = dump.BINARY_HEADER.unpack_from(data, offset)
+        assert (number, stitches, rows) == (pat.number, pat.stitches, pat.rows)
+        offset += dump.BINARY_HEADER.size
+        size = rows * ((stitches + 7) // 8)
+        packed = np.frombuffer(data, np.uint8, size, offset).reshape(rows, -1)
+        unpacked = np.unpackbits(packed, axis=1, count=stitches)
+        assert np.array_equal(unpacked, bf.get_entry_data(index))
+        offset += size
+    assert offset == len(data)
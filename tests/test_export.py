@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from pattern.export import export_all, export_file, pattern_to_image
+from pattern.file import BrotherFile
+from tests.test_catalog import track_file
+from tests.test_file import entry
+
+
+def putpixel_image(pattern: np.ndarray) -> Image.Image:
+    """How the app drew a pattern before pattern_to_image"""
+    height, width = pattern.shape
+    img = Image.new("RGB", (width, height), None)
+    for x in range(width):
+        for y in range(height):
+            img.putpixel((x, y), (0, 0, 0) if pattern[height - y - 1][x] == 1 else (255, 255, 255))
+    return img.convert("1")
+
+
+def test_images_match_the_putpixel_rendering():
+    rng = np.random.default_rng(3)
+    for shape in [(1, 1), (3, 7), (8, 8), (17, 9), (50, 60)]:
+        pattern = rng.integers(0, 2, shape, dtype=np.uint8)
+        image = pattern_to_image(pattern)
+        assert image.mode == "1" and image.size == (shape[1], shape[0])
+        assert image.tobytes() == putpixel_image(pattern).tobytes()
+
+
+def test_every_entry_gets_its_own_image(tmp_path):
+    os.makedirs(tmp_path / "dumps" / "old")
+    path = track_file(
+        tmp_path / "dumps" / "old" / "file-1.dat",
+        entry(0x0120, 3, 4, 901),
+        entry(0x0200, 2, 8, 901),
+        entry(0x0280, 5, 6, 902),
+    )
+    out = tmp_path / "images"
+    written = export_file(path, str(out), "bmp")
+    assert [os.path.basename(p) for p in written] == [
+        "file-1-901-0.bmp", "file-1-901-1.bmp", "file-1-902.bmp"
+    ]
+    bf = BrotherFile(path)
+    for index, image_path in enumerate(written):
+        with Image.open(image_path) as image:
+            assert image.tobytes() == pattern_to_image(bf.get_entry_data(index)).tobytes()
+
+    results = list(export_all([str(tmp_path / "dumps")], str(out), "png", workers=1))
+    assert [(dat_file, error) for dat_file, _, error in results] == [(path, None)]
+    assert sorted(os.listdir(out / "old")) == [
+        "file-1-901-0.png", "file-1-901-1.png", "file-1-902.png"
+    ]
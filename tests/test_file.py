@@ -0,0 +1,28 @@
+from pattern.file import DIRECTORY_ENTRY, BrotherFile
+
+FILE_SIZE = 0x8000
+
+
+def entry(pointer: int, rows: int, stitches: int, number: int) -> bytes:
+    """A directory entry, rows, stitches and number in packed BCD"""
+    nibbles = [int(d) for d in f"{rows:03d}{stitches:03d}0{number:03d}"]
+    packed = [nibbles[i] << 4 | nibbles[i + 1] for i in range(0, 10, 2)]
+    return DIRECTORY_ENTRY.pack(pointer, *packed)
+
+
+def test_a_pattern_number_stored_twice_keeps_both_entries(tmp_path):
+    data = bytearray(FILE_SIZE)
+    directory = entry(0x0120, 3, 4, 901) + entry(0x0200, 2, 8, 901) + entry(0x0280, 5, 6, 902)
+    data[:len(directory)] = directory
+    path = tmp_path / "file-01.dat"
+    path.write_bytes(data)
+
+    bf = BrotherFile(str(path))
+    patterns = bf.get_patterns()
+    assert [(p.number, p.rows, p.stitches) for p in patterns] == [
+        (901, 3, 4), (901, 2, 8), (902, 5, 6)
+    ]
+    assert bf.get_pattern(901) is patterns[0]
+    assert bf.get_pattern_data(901).shape == (3, 4)
+    assert bf.get_pattern_data(902).shape == (5, 6)
+    assert bf.get_pattern(903) is None
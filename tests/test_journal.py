@@ -0,0 +1,83 @@
+import os
+
+from pddemulate import journal
+from pddemulate.disk import Disk
+from pddemulate.journal import Journal
+from tests.test_snapshot import crash_after, sector
+
+
+def journal_path(tmp_path) -> str:
+    return os.path.join(str(tmp_path), journal.JOURNAL_NAME)
+
+
+def test_recover_keeps_only_committed_records(tmp_path):
+    j = Journal(journal_path(tmp_path))
+    j.append(journal.DATA, 0, b"a" * 4)
+    j.commit()
+    j.append(journal.DATA, 1, b"b" * 4)
+    j.close()
+    assert Journal(journal_path(tmp_path)).recover() == [(journal.DATA, 0, b"a" * 4)]
+
+
+def test_recover_stops_at_a_torn_tail(tmp_path):
+    j = Journal(journal_path(tmp_path))
+    j.append(journal.ID, 3, b"i" * 12)
+    j.commit()
+    j.append(journal.DATA, 4, b"d" * 1024)
+    j.commit()
+    j.close()
+    with open(journal_path(tmp_path), "r+b") as f:
+        f.truncate(os.path.getsize(journal_path(tmp_path)) - 100)
+    assert Journal(journal_path(tmp_path)).recover() == [(journal.ID, 3, b"i" * 12)]
+
+
+def test_recover_stops_at_a_bad_checksum(tmp_path):
+    j = Journal(journal_path(tmp_path))
+    j.append(journal.ID, 3, b"i" * 12)
+    j.commit()
+    second = j.size
+    j.append(journal.DATA, 4, b"d" * 1024)
+    j.commit()
+    j.append(journal.ID, 5, b"k" * 12)
+    j.commit()
+    j.close()
+    with open(journal_path(tmp_path), "r+b") as f:
+        f.seek(second + journal.HEADER.size + 10)
+        f.write(b"x")
+    # everything from the damaged record on is dropped, even if committed
+    assert Journal(journal_path(tmp_path)).recover() == [(journal.ID, 3, b"i" * 12)]
+
+
+def test_track_upload_is_replayed_after_a_crash(tmp_path):
+    path = str(tmp_path / "disk")
+    Disk(path, journaled=True).close()
+    crash_after(f"""
+        from pddemulate.disk import Disk, MemoryOnly
+        # the sector files are never touched, only the journal has the data
+        disk = Disk({path!r}, write_policy=MemoryOnly(), journaled=True)
+        disk.write_sector(0, 1, bytes([1]) * 1024)
+        disk.write_sector(1, 1, bytes([2]) * 1024)
+        disk.write_sector(2, 1, bytes([3]) * 1024)
+    """)
+    disk = Disk(path, journaled=True)
+    assert disk.read_sector(0, 1) == sector(1)
+    assert disk.read_sector(1, 1) == sector(2)
+    # half a track is not replayed
+    assert disk.read_sector(2, 1) == bytes(1024)
+    disk.close()
+
+
+def test_id_written_after_a_track_survives_a_crash(tmp_path):
+    path = str(tmp_path / "disk")
+    Disk(path, journaled=True).close()
+    crash_after(f"""
+        from pddemulate.disk import Disk, MemoryOnly
+        disk = Disk({path!r}, write_policy=MemoryOnly(), journaled=True)
+        disk.write_sector(0, 1, bytes([1]) * 1024)
+        disk.write_sector(1, 1, bytes([2]) * 1024)
+        disk.set_sector_id(1, bytes([7]) * 12)
+    """)
+    disk = Disk(path, journaled=True)
+    assert disk.get_sector_id(1) == bytes([7]) * 12
+    assert disk.read_sector(1, 1) == sector(2)
+    disk.close()
@@ -0,0 +1,52 @@
+import os
+
+from pddemulate.benchmark import SECTOR, SECTOR_ID, command_bytes, opmode_request
+from pddemulate.drive import PDDemulator
+from pddemulate.loopback import (
+    LoopbackConnection,
+    RecordingConnection,
+    SessionPlayer,
+    starting_disk_path,
+)
+
+
+def record_download(tmp_path) -> str:
+    """A session in which the machine reads a sector the disk already held"""
+    emu = PDDemulator(str(tmp_path / "disk"))
+    emu.disk.write_sector(4, 0, SECTOR)
+    emu.disk.set_sector_id(4, SECTOR_ID)
+    session = str(tmp_path / "session.jsonl")
+    machine = LoopbackConnection()
+    recorder = RecordingConnection(machine, session, emu.disk)
+    emu.attach(recorder)
+    machine.feed(opmode_request() + command_bytes(b"S", 0) + command_bytes(b"R", 4))
+    for _ in range(3):
+        emu.handle_request()
+    assert SECTOR in machine.take()
+    recorder.close()
+    emu.disk.close()
+    return session
+
+
+def replay(player: SessionPlayer, workdir) -> bool:
+    os.makedirs(workdir)
+    emu = PDDemulator(player.replay_disk(str(workdir)))
+    try:
+        result = player.replay(emu)
+    finally:
+        emu.close()
+        emu.disk.close()
+    assert result.requests == 3
+    return result.matched
+
+
+def test_a_download_replays_against_the_disk_it_started_from(tmp_path):
+    session = record_download(tmp_path)
+    assert os.path.getsize(starting_disk_path(session)) == 80 * (1024 + 12)
+    assert replay(SessionPlayer(session), tmp_path / "replay")
+
+
+def test_a_download_replayed_on_a_blank_disk_does_not_match(tmp_path):
+    session = record_download(tmp_path)
+    os.unlink(starting_disk_path(session))
+    assert not replay(SessionPlayer(session), tmp_path / "replay")
@@ -0,0 +1,39 @@
+import sys
+import urllib.request
+
+from pddemulate import metrics
+from pddemulate.metrics import DriveMetrics, MetricsServer
+from pddemulate.trace import Span, Tracer
+
+
+def scrape(server: MetricsServer) -> str:
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+        return response.read().decode()
+
+
+def test_drives_from_a_source_appear_as_they_are_added():
+    drives: list[DriveMetrics] = []
+    server = MetricsServer(0)
+    server.add_source(lambda: list(drives))
+    server.start()
+    try:
+        assert "pddemulate_formats_total" not in scrape(server)
+        tracer = Tracer()
+        drives.append(DriveMetrics("/dev/ttyUSB1", tracer))
+        span = Span("F", 0.0)
+        span.disk = 0.002
+        tracer.current = span
+        tracer.end()
+        body = scrape(server)
+        assert 'pddemulate_formats_total{drive="/dev/ttyUSB1"} 1' in body
+        assert 'pddemulate_command_seconds_bucket{drive="/dev/ttyUSB1",opcode="F",le="0.0025"} 1' \
+            in body
+    finally:
+        server.stop()
+
+
+def test_queue_depth_is_left_out_where_it_cannot_be_read(monkeypatch):
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    assert metrics.pending_bytes(0) is None
+    drive = DriveMetrics("com3", Tracer(), queue_depth=lambda: metrics.pending_bytes(0))
+    assert "pddemulate_listener_queue_bytes" not in drive.samples()
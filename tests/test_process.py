@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+from multiprocessing import Pipe
+
+import pytest
+
+from pddemulate.process import SHUTDOWN, STATS, STATS_REPORT, DiskProcess, DiskWorker
+from tests.test_serial import NoWatchingLoop
+
+
+def wait_for(disk: DiskProcess, wanted: str, events: list, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        disk.process_events()
+        for event, payload in events:
+            if event == wanted:
+                events.clear()
+                return payload
+        time.sleep(0.01)
+    raise AssertionError(f"no {wanted} event")
+
+
+def test_a_dead_worker_is_replaced_by_the_next_command(tmp_path):
+    events: list = []
+    disk = DiskProcess(
+        str(tmp_path / "img"),
+        lambda path: None,
+        lambda event, payload: events.append((event, payload)),
+    )
+    try:
+        disk.request_stats()
+        first = wait_for(disk, STATS_REPORT, events)
+        pid = disk.process.pid
+        disk.process.kill()
+        disk.process.join()
+
+        disk.request_stats()
+        second = wait_for(disk, STATS_REPORT, events)
+        assert disk.process.pid != pid
+        assert second["imgdir"] == first["imgdir"]
+        assert second["opens"] == 0
+    finally:
+        disk.exit()
+
+
+@pytest.mark.parametrize("loop_factory", [asyncio.SelectorEventLoop, NoWatchingLoop])
+def test_the_worker_takes_commands_with_or_without_a_watched_pipe(tmp_path, loop_factory):
+    child_control, control = Pipe(duplex=False)
+    events, child_events = Pipe(duplex=False)
+    worker = DiskWorker(child_control, child_events, str(tmp_path / "img"))
+
+    def run() -> None:
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(worker.run())
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    control.send((STATS,))
+    assert events.poll(10)
+    event, payload = events.recv()
+    assert event == STATS_REPORT and payload["imgdir"] == str(tmp_path / "img")
+    control.send((SHUTDOWN,))
+    thread.join(10)
+    assert not thread.is_alive()
@@ -0,0 +1,23 @@
+import numpy as np
+
+from app.gui.render import BLANK, STITCH, native_image, scale_image
+
+
+def test_rescaled_native_image_outlines_each_stitch():
+    pattern = np.array([[True, False, False], [False, False, True]])
+    native = native_image(pattern)
+    assert np.asarray(native).tolist() == [[BLANK, BLANK, STITCH], [STITCH, BLANK, BLANK]]
+
+    pixels = np.asarray(scale_image(native, 4))
+    assert pixels.shape == (8, 12)
+    # the first row is drawn at the bottom
+    cell = pixels[4:8, 0:4]
+    assert (cell[1:, 1:] == STITCH).all()
+    assert (cell[0, :] == BLANK).all() and (cell[:, 0] == BLANK).all()
+    cell = pixels[0:4, 4:8]
+    assert (cell[1:, 1:] == BLANK).all()
+    assert (cell[0, :] == STITCH).all() and (cell[:, 0] == STITCH).all()
+
+    # too small for outlines
+    expected = np.asarray(native).repeat(2, axis=0).repeat(2, axis=1)
+    assert (np.asarray(scale_image(native, 2)) == expected).all()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import pty
+import random
+import threading
+import time
+import tty
+
+import pytest
+
+from pddemulate.serial import AsyncSerialConnection, RingBuffer, SerialConnection
+
+
+@pytest.fixture(name="line")
+def fixture_line():
+    """A pseudo terminal standing in for the serial port: (port name, far end fd)"""
+    controller, port = pty.openpty()
+    tty.setraw(controller)
+    tty.setraw(port)
+    name = os.ttyname(port)
+    os.close(port)
+    yield name, controller
+    os.close(controller)
+
+
+class NoWatchingLoop(asyncio.SelectorEventLoop):
+    """Like Windows' proactor loop, can't be asked to watch a file descriptor"""
+
+    def add_reader(self, fd, callback, *args):
+        raise NotImplementedError
+
+    def add_writer(self, fd, callback, *args):
+        raise NotImplementedError
+
+
+@pytest.mark.parametrize("loop_factory", [asyncio.SelectorEventLoop, NoWatchingLoop])
+def test_writes_do_not_block_the_loop_and_keep_their_order(line, loop_factory):
+    name, controller = line
+    # far more than the pty buffers, a blocking write would hang here
+    payload = bytes(range(256)) * 1024
+
+    async def exchange() -> bytes:
+        conn = AsyncSerialConnection(name)
+        try:
+            start = time.perf_counter()
+            conn.write_bytes(payload[:100000])
+            conn.write_bytes(payload[100000:])
+            assert time.perf_counter() - start < 0.5
+            received = bytearray()
+            os.set_blocking(controller, False)
+            while len(received) < len(payload):
+                await asyncio.sleep(0.001)
+                try:
+                    received += os.read(controller, 65536)
+                except BlockingIOError:
+                    pass
+            return bytes(received)
+        finally:
+            conn.close()
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        assert runner.run(asyncio.wait_for(exchange(), 10)) == payload
+
+
+@pytest.mark.parametrize("loop_factory", [asyncio.SelectorEventLoop, NoWatchingLoop])
+def test_reads_wait_for_the_machine(line, loop_factory):
+    name, controller = line
+
+    async def exchange() -> list[bytes]:
+        conn = AsyncSerialConnection(name, timeout=5)
+        try:
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, os.write, controller, b"ZZ")
+            loop.call_later(0.1, os.write, controller, b"\x08\x01R 4\r")
+            return [await conn.read_exact(2), await conn.read_char(), await conn.read_until()]
+        finally:
+            conn.close()
+
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        assert runner.run(exchange()) == [b"ZZ", b"\x08", b"\x01R 4\r"]
+
+
+def test_ring_buffer_behaves_like_a_byte_queue():
+    rng = random.Random(5)
+    ring = RingBuffer(16)
+    model = bytearray()
+    for _ in range(5000):
+        if rng.random() < 0.5:
+            data = rng.randbytes(rng.randrange(0, 40 if rng.random() < 0.05 else 12))
+            ring.write(data)
+            model += data
+        else:
+            n = rng.randrange(0, 14)
+            assert ring.read(n) == bytes(model[:n])
+            del model[:n]
+        assert len(ring) == len(model)
+        value = rng.randrange(4)
+        assert ring.find(value) == model.find(value)
+
+
+def test_serial_reads_span_arrivals_and_time_out(line):
+    name, controller = line
+    conn = SerialConnection(name, timeout=0.3)
+    try:
+        os.write(controller, b"ZZ\x08")
+        threading.Timer(0.05, os.write, [controller, b"\x01R 4"]).start()
+        threading.Timer(0.1, os.write, [controller, b"\r" + bytes(range(256)) * 8]).start()
+        assert conn.read_exact(2) == b"ZZ"
+        assert conn.read_char() == b"\x08"
+        assert conn.read_until() == b"\x01R 4\r"
+        assert conn.read_exact(2048) == bytes(range(256)) * 8
+        with pytest.raises(TimeoutError):
+            conn.read_char()
+    finally:
+        conn.close()
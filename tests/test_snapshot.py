@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from pddemulate import disk as disk_module
+from pddemulate.disk import Disk
+from pddemulate.snapshot import SnapshotStore, blob_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sector(value: int) -> bytes:
+    return bytes([value]) * 1024
+
+
+def crash_after(script: str) -> None:
+    """Run script in a child that dies without closing anything"""
+    code = textwrap.dedent(script) + "\nimport os\nos._exit(0)\n"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_store_round_trip_keeps_each_blob_once(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    first = store.put(b"knit")
+    assert store.put(b"knit") == first == blob_hash(b"knit")
+    assert store.get(first) == b"knit"
+    store.save("a", [(first, first)])
+    assert store.load("a") == [(first, first)]
+    assert len(os.listdir(os.path.join(str(tmp_path), "objects", first[:2]))) == 1
+
+
+def test_store_refuses_a_corrupt_blob(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    digest = store.put(b"knit")
+    with open(os.path.join(str(tmp_path), "objects", digest[:2], digest[2:]), "wb") as f:
+        f.write(b"purl")
+    with pytest.raises(IOError):
+        store.get(digest)
+
+
+def test_diff_and_restore_round_trip(tmp_path):
+    disk = Disk(str(tmp_path / "disk"))
+    disk.write_sector(0, 1, sector(1))
+    disk.write_sector(1, 1, sector(2))
+    disk.snapshot("s1")
+    disk.write_sector(0, 1, sector(3))
+    disk.set_sector_id(5, b"\x01" * 12)
+    assert disk.diff("s1") == [0, 5]
+
+    assert disk.restore("s1") == [0, 5]
+    assert disk.read_sector(0, 1) == sector(1)
+    assert disk.get_sector_id(5) == bytes(12)
+    assert disk.diff("s1") == []
+    disk.close()
+
+    # what the restore replaced was kept, and the restore sticks
+    disk = Disk(str(tmp_path / "disk"))
+    before = [name for name in disk.snapshots() if name != "s1"]
+    assert len(before) == 1
+    assert disk.diff(before[0], "s1") == [0, 5]
+    assert disk.read_sector(0, 1) == sector(1)
+    with open(tmp_path / "disk" / "file-1.dat", "rb") as f:
+        assert f.read() == sector(1) + sector(2)
+    disk.close()
+
+
+def test_restoring_an_unchanged_disk_takes_no_snapshot(tmp_path):
+    disk = Disk(str(tmp_path / "disk"))
+    disk.snapshot("s1")
+    assert disk.restore("s1") == []
+    assert disk.snapshots() == ["s1"]
+    disk.close()
+
+
+def test_auto_snapshot_once_per_session(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(disk_module.time, "monotonic", lambda: now[0])
+    disk = Disk(str(tmp_path / "disk"), auto_snapshot=True)
+    disk.write_sector(0, 1, sector(1))
+    disk.write_sector(1, 1, sector(2))
+    assert len(disk.snapshots()) == 1
+
+    # within the gap, the same save
+    now[0] += disk_module.SESSION_GAP / 2
+    disk.write_sector(2, 1, sector(3))
+    assert len(disk.snapshots()) == 1
+
+    # a new save gets a snapshot of the disk as the last one left it
+    now[0] += disk_module.SESSION_GAP + 1
+    disk.write_sector(0, 1, sector(4))
+    names = disk.snapshots()
+    assert len(names) == 2
+    assert disk.diff(names[1]) == [0]
+    disk.close()
+
+
+def test_auto_snapshot_skips_an_unchanged_disk(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(disk_module.time, "monotonic", lambda: now[0])
+    disk = Disk(str(tmp_path / "disk"), auto_snapshot=True)
+    disk.write_sector(0, 1, bytes(1024))
+    disk.snapshot("manual")
+    now[0] += disk_module.SESSION_GAP + 1
+    disk.write_sector(0, 1, sector(1))
+    assert disk.snapshots()[-1] == "manual"
+    disk.close()
+
+
+def test_a_disk_in_use_is_refused(tmp_path):
+    disk = Disk(str(tmp_path / "disk"))
+    with pytest.raises(IOError):
+        Disk(str(tmp_path / "disk"))
+    disk.close()
+    Disk(str(tmp_path / "disk")).close()
+
+
+def test_tool_restore_survives_a_crashed_journal(tmp_path):
+    path = str(tmp_path / "disk")
+    disk = Disk(path, journaled=True)
+    disk.write_sector(0, 1, sector(0xAA))
+    disk.write_sector(1, 1, sector(0xBB))
+    disk.snapshot("s1")
+    disk.close()
+    crash_after(f"""
+        from pddemulate.disk import Disk
+        disk = Disk({path!r}, journaled=True)
+        disk.write_sector(0, 1, bytes([0xCC]) * 1024)
+        disk.write_sector(1, 1, bytes([0xDD]) * 1024)
+    """)
+    subprocess.run(
+        [sys.executable, "-m", "pddemulate.snapshot_tool", path, "restore", "s1"],
+        cwd=ROOT, check=True, capture_output=True,
+    )
+    disk = Disk(path, journaled=True)
+    assert disk.read_sector(0, 1) == sector(0xAA)
+    assert disk.read_sector(1, 1) == sector(0xBB)
+    disk.close()
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from pddemulate.trace import Tracer
+
+log = logging.getLogger("pddemulate.drive")
+
+
+def test_each_drive_keeps_only_its_own_log_records():
+    first, second = Tracer(), Tracer()
+    first.install()
+    second.install()
+
+    async def drive(tracer: Tracer, name: str) -> None:
+        tracer.activate()
+        for i in range(3):
+            log.info("%s %d", name, i)
+            await asyncio.sleep(0)
+
+    async def both() -> None:
+        await asyncio.gather(drive(first, "first"), drive(second, "second"))
+
+    try:
+        asyncio.run(both())
+        log.info("shared")
+        assert [r.getMessage() for r in first.ring.records] == [
+            "first 0", "first 1", "first 2", "shared"
+        ]
+        assert [r.getMessage() for r in second.ring.records] == [
+            "second 0", "second 1", "second 2", "shared"
+        ]
+    finally:
+        first.uninstall()
+        second.uninstall()
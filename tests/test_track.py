@@ -0,0 +1,24 @@
+import os
+import stat
+
+import pytest
+
+from pddemulate import track
+from pddemulate.track import TrackAssembler
+
+
+@pytest.mark.parametrize("umask", [0o022, 0o077])
+def test_track_files_follow_the_umask_and_are_synced(tmp_path, monkeypatch, umask):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(track.os, "fsync", lambda fd: synced.append(fd) or fsync(fd))
+    previous = os.umask(umask)
+    try:
+        path = TrackAssembler(str(tmp_path)).assemble(3, b"a" * 1024, b"b" * 1024)
+    finally:
+        os.umask(previous)
+    assert path == str(tmp_path / "file-2.dat")
+    assert (tmp_path / "file-2.dat").read_bytes() == b"a" * 1024 + b"b" * 1024
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o666 & ~umask
+    assert len(synced) == 1
+    assert os.listdir(tmp_path) == ["file-2.dat"]